@@ -5,10 +5,46 @@ default[:pbspro][:version] = "18.1.3-0"
 default[:pbspro][:slots] = nil
 
 default[:pbspro][:is_grouped] = true
+# seconds a new execute node waits for its mom to report in before starting a scheduling cycle
+default[:pbspro][:node_up_timeout] = 30
+# the autoscaler creates the PBS nodes of booting instances, with their resources, in one qmgr session. See autostart.py
+default[:pbspro][:precreate_nodes] = true
+# execute nodes hand their join records to a registrar on the master, which adds them to pbs_server in batches of up to
+# max_batch, window seconds after the first record of each batch arrives. The spool must be on a share the execute nodes
+# mount, they fall back to registering themselves after ack_timeout seconds. See node_registrar.py
+default[:pbspro][:registrar][:enabled] = true
+default[:pbspro][:registrar][:spool] = "/sched/pbs/registrar"
+default[:pbspro][:registrar][:window] = 2
+default[:pbspro][:registrar][:max_batch] = 500
+default[:pbspro][:registrar][:ack_timeout] = 120
+
+# per cycle timings and counters, see cycle_metrics.py. Set metrics_textfile to a path in node_exporter's textfile directory to export them.
+default[:pbspro][:status_file] = "#{node[:cyclecloud][:bootstrap]}/pbs/autoscale_status.json"
+default[:pbspro][:metrics_textfile] = nil
+# count the bytes of every CycleCloud API response in api_bytes. Re-encodes each response as JSON, so it is off by default.
+default[:pbspro][:metrics_api_bytes] = false
+# a directory to record each cycle's qstat/pbsnodes/CycleCloud inputs to, for replaying offline. See cycle_recorder.py
+default[:pbspro][:record_cycles] = nil
+default[:pbspro][:record_cycles_keep] = 10
+# scale up requests are sent per nodearray / placement group, this many at a time and at most scale_up_rate per second. See scale_up.py
+default[:pbspro][:scale_up_concurrency] = 4
+default[:pbspro][:scale_up_rate] = 5
+default[:pbspro][:scale_up_retries] = 2
+default[:pbspro][:scale_up_failure_cooldown] = 300
+# run scale up (queued demand only), scale down (the full cycle) and the nodearray refresh at their own rates. The first two
+# back off to their max interval while there is nothing to do. See cycle_schedule.py
+default[:pbspro][:multi_rate] = true
+default[:pbspro][:scale_up_interval] = 15
+default[:pbspro][:scale_up_max_interval] = 60
+default[:pbspro][:scale_down_interval] = 60
+default[:pbspro][:scale_down_max_interval] = 300
+default[:pbspro][:nodearray_refresh_interval] = 300
 
 default[:pbspro][:submit_hook][:__comment__] = "This file was generated by serializing node[:cyclecloud][:pbspro][:submit_hook]."
 default[:pbspro][:submit_hook][:disable_eager_packing] = true
 default[:pbspro][:submit_hook][:enabled] = true
+# appended to on every submission, so the autoscale hook starts a cycle within a second rather than at its next interval
+default[:pbspro][:submit_hook][:demand_trigger] = "#{node[:cyclecloud][:bootstrap]}/pbs/autoscale.demand"
 
 default[:pbspro][:submit_hook][:logging][:level] = "INFO"
 default[:pbspro][:submit_hook][:logging][:filename] = "#{node[:cyclecloud][:bootstrap]}/pbs/submit_hook.log"
@@ -24,6 +60,20 @@ default[:pbspro][:autoscale_hook][:src_dirs] = ["#{node[:cyclecloud][:home]}/sys
 default[:pbspro][:autoscale_hook][:cyclecloud_home] = node[:cyclecloud][:home]
 default[:pbspro][:autoscale_hook][:autostart_log_level] = "DEBUG"
 default[:pbspro][:autoscale_hook][:autostart_log_file_level] = "DEBUG"
+# the hook fires every freq seconds, but only runs a cycle every interval seconds or when the submit hook signals demand_trigger,
+# at most once per demand_debounce seconds. See autostart_hook.py
+default[:pbspro][:autoscale_hook][:freq] = 1
+default[:pbspro][:autoscale_hook][:interval] = 15
+default[:pbspro][:autoscale_hook][:demand_debounce] = 1
+default[:pbspro][:autoscale_hook][:demand_trigger] = "#{node[:cyclecloud][:bootstrap]}/pbs/autoscale.demand"
+# written by the autoscaler when multi_rate is enabled, next_due replaces interval
+default[:pbspro][:autoscale_hook][:schedule] = "#{node[:cyclecloud][:bootstrap]}/pbs/autoscale_schedule.json"
+# cProfile autoscale cycles into cyclecloud's logs directory, see cycle_profiler.py
+default[:pbspro][:autoscale_hook][:autostart_profile] = false
+default[:pbspro][:autoscale_hook][:autostart_profile_every] = 1
+default[:pbspro][:autoscale_hook][:autostart_profile_slower_than] = 0
+default[:pbspro][:autoscale_hook][:autostart_profile_max_files] = 10
+default[:pbspro][:autoscale_hook][:autostart_profile_max_mb] = 50
 
 if node[:cyclecloud][:node][:template] == "master"
 	default[:cyclecloud][:cluster][:autoscale][:idle_time_before_jobs] = 3600
@@ -4,6 +4,7 @@
 import logging_init  # import first to ensure other modules (requests) don't define logging.basicConfig first
 
 import collections
+import hashlib
 import json
 import os
 import sys
@@ -14,12 +15,20 @@ from cyclecloud import machine, clustersapi, autoscale_util, autoscaler as autos
 from cyclecloud.autoscale_util import Record
 import cyclecloud.config
 from cyclecloud.job import Job, PackingStrategy
+import cycle_lock
+import cycle_metrics
+import cycle_profiler
+import cycle_recorder
+import cycle_schedule
+import deadline
+import fork_server
+import memory_monitor
 import mockpbs
 import pbs_driver
-from pbscc import InvalidSizeExpressionError
 import pbscc
+import scale_up
+import tandem_utils
 from copy import deepcopy
-import numbers
 
 
 class PBSAutostart:
@@ -34,22 +43,43 @@ class PBSAutostart:
     
     '''
     
-    def __init__(self, driver, clusters_api, cc_config):
+    def __init__(self, driver, clusters_api, cc_config, node_inventory=None, budget=None, metrics=None):
         self.cc_config = cc_config
         self.disable_grouping = cc_config.get("cyclecloud.cluster.autoscale.use_node_groups", True) is not True
         self.driver = driver
         self.clusters_api = clusters_api
         self.default_placement_attrs = self.cc_config.get("cyclecloud.placement_group.defaults", {"group_id": "single"})
+        self._resource_schema = None
+        self.machine_index = None
+        # pass in the same NodeInventory across cycles to avoid re-parsing unchanged pbsnodes.
+        self.node_inventory = node_inventory or NodeInventory()
+        # unlimited by default, see deadline.CycleBudget
+        self.budget = budget or deadline.CycleBudget()
+        self.metrics = metrics or cycle_metrics.CycleMetrics()
+        self.memory_monitor = None
+        if str(self.cc_config.get("pbspro.memory_monitor", False)).lower() == "true":
+            self.memory_monitor = memory_monitor.MemoryMonitor(history=int(self.cc_config.get("pbspro.memory_monitor_history", 5)),
+                                                               path=MEMORY_HISTORY_PATH)
         
-    def query_jobs(self):
+    def resource_schema(self):
+        '''
+            The scheduler resources (sched_config) along with the type of every known resource (qmgr), compiled once
+            into a pbscc.ResourceSchema.
+        '''
+        if self._resource_schema is None:
+            scheduler_config = self.driver.scheduler_config()
+            resource_types = dict(pbscc.BUILTIN_RESOURCE_TYPES)
+            resource_types.update(self.driver.resource_definitions())
+            # special case for hostname so we can automatically place jobs onto the appropriate host
+            self._resource_schema = pbscc.ResourceSchema(scheduler_config["resources"] + ["hostname", "instance_id"], resource_types)
+        return self._resource_schema
+        
+    def query_jobs(self, running_jobs=None, queued_jobs=None):
         '''
             Converts PBS jobs into cyclecloud.job.Job instances. It will also compress jobs that have the exact same requirements.
+            running_jobs and queued_jobs are the driver's (output, converter) results, if they were already queried.
         '''
-        scheduler_config = self.driver.scheduler_config()
-        scheduler_resources = [] + scheduler_config["resources"]
-        # special case for hostname so we can automatically place jobs onto the appropriate host
-        scheduler_resources.append("hostname")
-        scheduler_resources.append("instance_id")
+        schema = self.resource_schema()
         
         group_jobs = not self.disable_grouping
         running_autoscale_jobs = []
@@ -57,11 +87,14 @@ class PBSAutostart:
     
         # get the raw string outputs first, and convert it second. This somewhat limits the
         # race condition of asking the status of the queue twice.
-        running_raw_jobs_str, running_converter = self.driver.running_jobs()
-        queued_raw_jobs_str, queued_converter = self.driver.queued_jobs()
+        running_raw_jobs_str, running_converter = running_jobs or self.metrics.timed("qstat_running", self.driver.running_jobs)()
+        queued_raw_jobs_str, queued_converter = queued_jobs or self.metrics.timed("qstat_queued", self.driver.queued_jobs)()
         
+        self.metrics.start_phase("parse")
         running_raw_jobs = running_converter(running_raw_jobs_str)
         queued_raw_jobs = queued_converter(queued_raw_jobs_str)
+        self.metrics.incr("jobs_seen", len(running_raw_jobs) + len(queued_raw_jobs))
+        self.metrics.incr("jobs_queued", len(queued_raw_jobs))
         
         raw_jobs = []
         
@@ -103,10 +136,9 @@ class PBSAutostart:
                     
                     for key, value in chunk.iteritems():
                         if key not in ["select", "nodect"]:
-                            try:
-                                value = pbscc.parse_gb_size(key, value) * chunk["nodect"]
-                            except InvalidSizeExpressionError:
-                                pass
+                            value = schema.convert(key, value)
+                            if pbscc.is_number(value):
+                                value = value * chunk["nodect"]
                             
                             sub_raw_job["resource_list"][key] = value
                     
@@ -124,13 +156,13 @@ class PBSAutostart:
             
             if pbs_job["job_state"].upper() == pbscc.JOB_STATE_RUNNING:
                 # update running job
-                live_resources = pbscc.parse_exec_vnode(raw_job["exec_vnode"])
+                live_resources = pbscc.parse_exec_vnode(raw_job["exec_vnode"], schema)
                 for key, value in live_resources.iteritems():
                     # live resources are calculated on a per node basis, but the Resource_List is based
                     # on a total basis.
                     # we will normalize this below
                     
-                    if isinstance(value, numbers.Number):
+                    if pbscc.is_number(value):
                         pbs_job.Resource_List[key] = value * nodect
                     else:
                         pbs_job.Resource_List[key] = value
@@ -197,16 +229,13 @@ class PBSAutostart:
             autoscale_job.ncpus += slots_per_job
             
             for attr, value in pbs_job.Resource_List.iteritems():
-                if attr not in scheduler_resources:
+                if attr not in schema:
                     # if it isn't a scheduler level attribute, don't bother 
                     # considering it for autoscale as the scheduler won't respect it either.
                     continue
-                try:
-                    value = pbscc.parse_gb_size(attr, value)
+                value = schema.convert(attr, value)
+                if pbscc.is_number(value):
                     value = value / nodect
-                except InvalidSizeExpressionError:
-                    if value.lower() in ["true", "false"]:
-                        value = value.lower() == "true"
 
                 autoscale_job.resources[attr] = value
                 
@@ -220,8 +249,12 @@ class PBSAutostart:
             pbscc.error(format_string % values)
         
         # leave an option for disabling this in case it causes issues.
+        self.metrics.end_phase("parse")
+        self.metrics.incr("job_signatures", len(set([job_signature(job) for job in idle_autoscale_jobs])))
+        
         if self.cc_config.get("pbspro.compress_jobs", False):
-            all_autoscale_jobs = running_autoscale_jobs + compress_queued_jobs(idle_autoscale_jobs)
+            with self.metrics.phase("compression"):
+                all_autoscale_jobs = running_autoscale_jobs + compress_queued_jobs(idle_autoscale_jobs)
         else:
             all_autoscale_jobs = running_autoscale_jobs + idle_autoscale_jobs
             
@@ -236,14 +269,12 @@ class PBSAutostart:
         '''
         nodearray_definitions = machine.fetch_nodearray_definitions(self.clusters_api, self.default_placement_attrs)
         nodearray_definitions.placement_group_optional = True
+        schema = self.resource_schema()
         
         for machinetype in nodearray_definitions:
             # ensure that any custom attribute the user specified, like disk = 100G, gets parsed correctly
             for key, value in machinetype.iteritems():
-                try:
-                    machinetype[key] = pbscc.parse_gb_size(key, value)
-                except InvalidSizeExpressionError:
-                    pass
+                machinetype[key] = schema.convert(key, value)
                 
             # kludge: there is a strange bug where ungrouped is showing up as a string and not a boolean.
             if not machinetype.get("group_id"):
@@ -254,16 +285,80 @@ class PBSAutostart:
                 
         return nodearray_definitions
                 
-    def autoscale(self):
+    def autoscale(self, scale_down=True):
         '''
-            The main loop described at the top of this class. 
+            The main loop described at the top of this class. With scale_down=False only queued demand is considered - nothing
+            else is queried when no jobs are queued, and no nodes are offlined or deleted. See cycle_schedule.
             Returns machine_requests, idle_machines and total_machines for ease of unit testing.
         '''
-        pbscc.info("Begin autoscale cycle")
+        self.metrics.reset()
+        if self.memory_monitor:
+            self.memory_monitor.start_cycle()
+        success = False
+        try:
+            ret = self._autoscale(scale_down)
+            success = True
+            return ret
+        finally:
+            self.metrics.finish(success)
+            pbscc.flush_aggregates()
+            if self.memory_monitor:
+                self.metrics.extra["memory"] = self.memory_monitor.end_cycle()
+            self.write_metrics()
+    
+    def write_metrics(self):
+        '''
+            Writes the metrics of the last cycle to pbspro.status_file (JSON) and pbspro.metrics_textfile (node_exporter
+            textfile collector format), if they are set.
+        '''
+        status_file = self.cc_config.get("pbspro.status_file")
+        if status_file:
+            self.metrics.write_json(status_file)
+        
+        metrics_textfile = self.cc_config.get("pbspro.metrics_textfile")
+        if metrics_textfile:
+            self.metrics.write_textfile(metrics_textfile)
+    
+    def _autoscale(self, scale_down=True):
+        pbscc.info("Begin autoscale cycle" if scale_down else "Begin scale up cycle")
+        self.budget.reset()
         
-        nodearray_definitions = self.fetch_nodearray_definitions()
+        timed = self.metrics.timed
+        calls = [("nodearray_definitions", timed("nodearray_fetch", self.fetch_nodearray_definitions)),
+                 ("pbsnodes", timed("pbsnodes", lambda: self.driver.pbsnodes().get(None))),
+                 ("running_jobs", timed("qstat_running", self.driver.running_jobs)),
+                 ("queued_jobs", timed("qstat_queued", self.driver.queued_jobs))]
         
-        pbsnodes_by_hostname, existing_machines, booting_instance_ids, instance_ids_to_shutdown = self.get_existing_machines(nodearray_definitions)
+        if not scale_down:
+            queued_jobs = calls.pop()[1]()
+            if _no_jobs(queued_jobs[0]):
+                pbscc.info("No queued jobs, ending scale up cycle")
+                return [], [], []
+            calls.append(("queued_jobs", lambda: queued_jobs))
+        
+        # these are independent of each other, so when the cycle has a budget they are queried concurrently.
+        queries = deadline.gather(self.budget, calls, concurrent=self.budget.limited())
+        
+        for name in ["nodearray_definitions", "pbsnodes"]:
+            if queries[name][1]:
+                raise queries[name][1]
+        
+        # without the jobs we can not tell which machines are idle, so only remove the nodes that are already offline.
+        scale_down_only = False
+        for name in ["running_jobs", "queued_jobs"]:
+            error = queries[name][1]
+            if isinstance(error, deadline.DeadlineExceededError):
+                scale_down_only = True
+            elif error:
+                raise error
+        
+        if scale_down_only:
+            pbscc.warn("Jobs could not be queried within the cycle budget of %s seconds, only scaling down this cycle." % self.budget.seconds)
+        
+        nodearray_definitions = queries["nodearray_definitions"][0]
+        
+        pbsnodes_by_hostname, existing_machines, booting_instance_ids, instance_ids_to_shutdown = self.get_existing_machines(nodearray_definitions,
+                                                                                                                            queries["pbsnodes"][0])
         
         start_enabled = "true" == str(self.cc_config.get("cyclecloud.cluster.autoscale.start_enabled", "true")).lower()
         
@@ -271,30 +366,46 @@ class PBSAutostart:
             pbscc.warn("cyclecloud.cluster.autoscale.start_enabled is false, new machines will not be allocated.")
         
         autoscaler = autoscalerlib.Autoscaler(nodearray_definitions, existing_machines, self.default_placement_attrs, start_enabled)
+        self.machine_index = MachineIndex(autoscaler.machines, pbsnodes_by_hostname)
         
         # throttle how many jobs we attempt to match. When pbspro.compress_jobs is true (default) this shouldn't really be an issue
         # unless the user has over $pbspro.max_unmatched_jobs unique sets of requirements.
         max_unmatched_jobs = int(self.cc_config.get("pbspro.max_unmatched_jobs", 10000))
         unmatched_jobs = 0
+        unmatched_job_cache = self.unmatched_job_cache(nodearray_definitions, existing_machines, start_enabled)
+        
+        jobs = [] if scale_down_only else self.query_jobs(queries["running_jobs"][0], queries["queued_jobs"][0])
         
-        for job in self.query_jobs():
+        self.metrics.start_phase("matching")
+        for job in jobs:
             if job.executing_hostname:
-                try:
-                    autoscaler.get_machine(hostname=job.executing_hostname).add_job(job, force=True)
+                executing_machine = self.machine_index.machine(hostname=job.executing_hostname)
+                if executing_machine:
+                    executing_machine.add_job(job, force=True)
                     continue
-                except RuntimeError as e:
-                    pbscc.error(str(e))
-                    pass
+                pbscc.error("Could not find machine with hostname %s for running job %s", job.executing_hostname, job.name)
+            
+            # identical jobs to one we already failed to match will fail as well, so don't bother trying.
+            if unmatched_job_cache.skip(job):
+                continue
                     
             if not autoscaler.add_job(job):
+                unmatched_job_cache.add(job)
                 unmatched_jobs += 1
-                pbscc.info("Can not match job %s." % job.name)
+                pbscc.aggregate("info", "Can not match job", job.name)
                 if max_unmatched_jobs > 0 and unmatched_jobs >= max_unmatched_jobs:
                     pbscc.warn('Maximum number of unmatched jobs reached - %s. To configure this setting, change {"pbspro": "max_unmatched_jobs": N}} in %s' % (unmatched_jobs, pbscc.CONFIG_PATH))
                     break
         
+        unmatched_job_cache.report()
+        unmatched_job_cache.save()
+        
         machine_requests = autoscaler.get_new_machine_requests()
         idle_machines = autoscaler.get_idle_machines()
+        self.metrics.end_phase("matching")
+        self.metrics.incr("unmatched_jobs", unmatched_jobs)
+        self.metrics.incr("machine_requests", sum([r.instancecount for r in machine_requests]))
+        self.metrics.incr("idle_machines", len(idle_machines))
         
         autoscale_request = autoscale_util.create_autoscale_request(machine_requests)
         for request_set in autoscale_request["sets"]:
@@ -309,7 +420,8 @@ class PBSAutostart:
             else:
                 configuration["pbspro"]["is_grouped"] = True
                 
-        autoscale_util.scale_up(self.clusters_api, autoscale_request)
+        with self.metrics.phase("scale_up"):
+            self.metrics.extra["scale_up"] = self.scale_up_dispatcher().dispatch(autoscale_request)
         
         for r in machine_requests:
             if r.placeby_value:
@@ -323,13 +435,22 @@ class PBSAutostart:
             for m in autoscaler.machines:
                 pbscc.fine("    %s" % str(m))
         
+        if not scale_down:
+            pbscc.info("End scale up cycle")
+            return machine_requests, idle_machines, autoscaler.machines
+        
+        # whatever happened above, leave time to scale down.
+        self.budget.release_reserve()
+        
+        self.metrics.start_phase("delete")
         if instance_ids_to_shutdown:
             pbscc.info("Shutting down instance ids %s" % instance_ids_to_shutdown.keys())
             self.clusters_api.shutdown(instance_ids_to_shutdown.keys())
             
             for hostname in instance_ids_to_shutdown.itervalues():
-                pbscc.info("Deleting %s" % hostname)
+                pbscc.info("Deleting %s", hostname)
                 self.driver.delete_host(hostname)
+        self.metrics.end_phase("delete")
         
         now = time.time()
         
@@ -338,16 +459,21 @@ class PBSAutostart:
         if not stop_enabled:
             pbscc.warn("cyclecloud.cluster.autoscale.stop_enabled is false, idle machines will not be terminated")
         
-        if stop_enabled:
+        self.metrics.start_phase("offline")
+        if stop_enabled and not scale_down_only:
             idle_before_threshold = float(self.cc_config.get("cyclecloud.cluster.autoscale.idle_time_before_jobs", 3600))
             idle_after_threshold = float(self.cc_config.get("cyclecloud.cluster.autoscale.idle_time_after_jobs", 300))
         
             for m in idle_machines:
+                if self.budget.expired():
+                    pbscc.warn("Cycle budget of %s seconds exceeded, remaining idle machines will be considered next cycle." % self.budget.seconds)
+                    break
+                
                 if m.get_attr("instance_id", "") not in booting_instance_ids:
-                    pbscc.debug("Could not find instance id in CycleCloud %s" % m.get_attr("instance_id", ""))
+                    pbscc.debug("Could not find instance id in CycleCloud %s", m.get_attr("instance_id", ""))
                     continue
                 
-                pbsnode = pbsnodes_by_hostname.get(m.hostname)
+                pbsnode = self.machine_index.pbsnode(hostname=m.hostname, instance_id=m.get_attr("instance_id", ""))
                 
                 # the machine may not have converged yet, so
                 if pbsnode:
@@ -366,30 +492,66 @@ class PBSAutostart:
                         last_used_time = time.time()
 
                     if now - last_used_time > idle_after_threshold:
-                        pbscc.info("Setting %s offline after %s seconds" % (m.hostname, now - last_used_time))
+                        pbscc.info("Setting %s offline after %s seconds", m.hostname, now - last_used_time)
                         self.driver.set_offline(m.hostname)
                     elif now - last_state_change_time > idle_before_threshold:
-                        pbscc.info("Setting %s offline after %s seconds" % (m.hostname, now - last_state_change_time))
+                        pbscc.info("Setting %s offline after %s seconds", m.hostname, now - last_state_change_time)
                         self.driver.set_offline(m.hostname)
+        self.metrics.end_phase("offline")
         
         pbscc.info("End autoscale cycle")
         # returned for testing purposes
         return machine_requests, idle_machines, autoscaler.machines
     
-    def get_existing_machines(self, nodearray_definitions):
+    def scale_up_dispatcher(self):
+        '''
+            Sends each nodearray / placement group of the autoscale request separately, pbspro.scale_up_concurrency at a time and
+            at most pbspro.scale_up_rate requests per second (0 for no limit), see scale_up.ScaleUpDispatcher. A set that still
+            fails after pbspro.scale_up_retries retries is not requested again for pbspro.scale_up_failure_cooldown seconds.
+        '''
+        return scale_up.ScaleUpDispatcher(self.clusters_api, self.budget,
+                                          concurrency=int(self.cc_config.get("pbspro.scale_up_concurrency", 1)),
+                                          rate=float(self.cc_config.get("pbspro.scale_up_rate", 0)),
+                                          max_retries=int(self.cc_config.get("pbspro.scale_up_retries", 2)),
+                                          history_path=SCALE_UP_HISTORY_PATH,
+                                          failure_cooldown=float(self.cc_config.get("pbspro.scale_up_failure_cooldown", 300)),
+                                          metrics=self.metrics)
+    
+    def unmatched_job_cache(self, nodearray_definitions, existing_machines, start_enabled):
+        '''
+            By default the cache only lives for this cycle. Set pbspro.persist_unmatched_jobs to true to carry unmatchable
+            signatures over to following cycles, for up to pbspro.unmatched_jobs_ttl seconds or until the nodearray definitions
+            or the existing machines change.
+            
+            While cyclecloud.cluster.autoscale.start_enabled is false a job may only be unmatched because the existing machines
+            are busy, so nothing is carried over then.
+        '''
+        path = None
+        if str(self.cc_config.get("pbspro.persist_unmatched_jobs", False)).lower() == "true" and start_enabled:
+            path = UNMATCHED_JOBS_PATH
+        ttl = float(self.cc_config.get("pbspro.unmatched_jobs_ttl", 300))
+        return UnmatchedJobCache(capacity_fingerprint(nodearray_definitions, existing_machines), path, ttl)
+    
+    def get_existing_machines(self, nodearray_definitions, pbsnodes=None):
         '''
             Queries pbsnodes and CycleCloud to get a sane set of cyclecloud.machine.Machine instances that represent the current state of the cluster.
         '''
-        pbsnodes = self.driver.pbsnodes().get(None)
+        if pbsnodes is None:
+            pbsnodes = self.driver.pbsnodes().get(None)
+        self.node_inventory.refresh(pbsnodes)
         existing_machines = []
         
         booting_instance_ids = autoscale_util.nodes_by_instance_id(self.clusters_api, nodearray_definitions)
+        cyclecloud_instance_ids = set(booting_instance_ids.keys())
         
         instance_ids_to_shutdown = Record()
         
         nodes_by_instance_id = Record()
         
         for pbsnode in pbsnodes.values():
+            if self.remove_stale_precreated_host(pbsnode, cyclecloud_instance_ids):
+                continue
+            
             inst = self.process_pbsnode(pbsnode, instance_ids_to_shutdown, nodearray_definitions)
             if not inst:
                 continue
@@ -414,8 +576,79 @@ class PBSAutostart:
             existing_machines.append(inst)
             nodes_by_instance_id[instance_id] = node
         
+        if str(self.cc_config.get("pbspro.precreate_nodes", False)).lower() == "true":
+            with self.metrics.phase("precreate"):
+                self.precreate_hosts(booting_instance_ids.values(), pbsnodes, nodearray_definitions)
+        
         return pbsnodes, existing_machines, nodes_by_instance_id, instance_ids_to_shutdown
     
+    def precreate_hosts(self, booting_nodes, pbsnodes, nodearray_definitions):
+        '''
+            Creates the vnodes of booting instances as soon as CycleCloud reports their hostname, all in one qmgr session and
+            with every resources_available that execute.rb would otherwise set one qmgr call at a time: the core count of the
+            machine type, the custom resources of the nodearray (Configuration.autoscale) and ungrouped, which is what
+            execute.rb derives from the pbspro.is_grouped set on the request. The node then only has to start its pbs_mom, and
+            jobs can be placed on it as soon as the mom reports in.
+        '''
+        existing = set([name.lower() for name in pbsnodes])
+        schema = self.resource_schema()
+        hosts = []
+        for node in booting_nodes:
+            hostname = (node.get("hostname") or "").split(".")[0]
+            if not hostname or hostname.lower() in existing:
+                continue
+            
+            placement_group = node.get("PlacementGroupId")
+            machinetype = nodearray_definitions.get_machinetype(node["Template"], node["MachineType"], placement_group)
+            attributes = collections.OrderedDict()
+            attributes["resources_available.ncpus"] = machinetype["ncpus"]
+            attributes["resources_available.slot_type"] = node["Template"]
+            attributes["resources_available.nodearray"] = node["Template"]
+            attributes["resources_available.machinetype"] = node["MachineType"]
+            if placement_group:
+                attributes["resources_available.group_id"] = placement_group
+            attributes["resources_available.ungrouped"] = "false" if placement_group else "true"
+            attributes["resources_available.instance_id"] = node["InstanceId"]
+            for key, value in sorted(machinetype.iteritems()):
+                # the custom resources. Anything PBS reports itself or that is set above is left alone, as is the placeholder
+                # group_id fetch_nodearray_definitions gives ungrouped machine types.
+                if key in schema.types and key not in pbscc.BUILTIN_RESOURCE_TYPES and key not in ["group_id", "ungrouped"] \
+                        and "resources_available." + key not in attributes:
+                    attributes["resources_available." + key] = _qmgr_value(schema.types[key], value)
+            attributes["comment"] = PRECREATED_COMMENT
+            hosts.append((hostname, attributes))
+        
+        if not hosts:
+            return
+        
+        pbscc.info("Pre-creating PBS nodes %s", [hostname for hostname, _ in hosts])
+        self.metrics.incr("nodes_precreated", len(hosts))
+        try:
+            failed = self.driver.create_hosts(hosts)
+        except Exception as e:
+            failed = [hostname for hostname, _ in hosts]
+            pbscc.debug(traceback.format_exc())
+            pbscc.warn("Could not pre-create PBS nodes: %s", str(e))
+        if failed:
+            pbscc.warn("PBS nodes %s were not pre-created, they will add themselves when they boot.", failed)
+    
+    def remove_stale_precreated_host(self, pbsnode, cyclecloud_instance_ids):
+        '''
+            A pre-created node whose instance never came up and is gone from CycleCloud would otherwise stay down forever.
+            Returns True if pbsnode was deleted.
+        '''
+        if pbsnode.get("comment") != PRECREATED_COMMENT or "down" not in pbsnode["state"].split(","):
+            return False
+        
+        instance_id = pbsnode["resources_available"].get("instance_id")
+        if not instance_id or instance_id in cyclecloud_instance_ids:
+            return False
+        
+        hostname = pbsnode["resources_available"]["vnode"]
+        pbscc.info("Deleting pre-created node %s, instance %s no longer exists", hostname, instance_id)
+        self.driver.delete_host(hostname)
+        return True
+    
     def process_pbsnode(self, pbsnode, instance_ids_to_shutdown, nodearray_definitions):
         '''
             If the pbsnode is offline, will handle evaluating whether the node can be shutdown. See instance_ids_to_shutdown, which
@@ -431,10 +664,10 @@ class PBSAutostart:
         
         if "offline" in states:
             if not pbsnode.get("jobs", []):
-                pbscc.fine("%s is offline and has no jobs, can shut down" % hostname)
+                pbscc.fine("%s is offline and has no jobs, can shut down", hostname)
                 
                 if not instance_id:
-                    pbscc.error("instance_id was not defined for host %s, can not shut it down" % hostname)
+                    pbscc.error("instance_id was not defined for host %s, can not shut it down", hostname)
                 elif "down" in states:
                     # don't immediately remove down nodes
                     remove_down_nodes = float(self.cc_config.get("pbspro.remove_down_nodes", 300))
@@ -443,28 +676,13 @@ class PBSAutostart:
                 else:
                     instance_ids_to_shutdown[instance_id] = hostname
             else:
-                pbscc.fine("Host %s is offline but still running jobs" % hostname)
+                pbscc.fine("Host %s is offline but still running jobs", hostname)
         
         # just ignore complex down nodes (down,job-busy etc)
         if "down" in states:
             return
         
-        # convert relevant resources from bytes to floating point (GB)
-        for key in resources:
-            
-            value = resources[key]
-            if isinstance(value, basestring) and value.lower() in ["true", "false"]:
-                value = value.lower() == "true"
-            elif isinstance(value, list):
-                # TODO will need to support this eventually
-                continue
-            else:
-                try:
-                    resources[key] = pbscc.parse_gb_size(key, resources[key])
-                except InvalidSizeExpressionError:
-                    pass
-        
-        resources["hostname"] = hostname
+        resources = self.node_inventory.resources_available(pbsnode, self._parse_resources_available)
         
         nodearray_name = resources.get("nodearray") or resources.get("slot_type")
         group_id = resources.get("group_id")
@@ -473,13 +691,256 @@ class PBSAutostart:
             machinetype = nodearray_definitions.get_machinetype(nodearray_name, resources.get("machinetype"), group_id)
         else:
             # rely solely on resources_available
-            pbscc.debug("machinetype is not defined for host %s, relying only on resources_available" % hostname)
+            pbscc.aggregate("debug", "machinetype is not defined, relying only on resources_available for host", hostname)
             machinetype = {"availableCount": 1, "name": "undefined"}
             
-        inst = machine.new_machine_instance(machinetype, **pbsnode["resources_available"])
+        inst = machine.new_machine_instance(machinetype, **resources)
 
         return inst
     
+    def _parse_resources_available(self, pbsnode):
+        # convert relevant resources from bytes to floating point (GB)
+        schema = self.resource_schema()
+        resources = {}
+        for key, value in pbsnode["resources_available"].iteritems():
+            if isinstance(value, list):
+                # TODO will need to support this eventually
+                resources[key] = value
+                continue
+            resources[key] = schema.convert(key, value)
+        
+        # host has incorrect case
+        resources["hostname"] = pbsnode["resources_available"]["vnode"]
+        return resources
+    
+
+class NodeInventory:
+    '''
+        pbsnodes inventory that carries parsed resources_available over from one refresh to the next. A node is only re-parsed
+        when its last_state_change_time or the hash of its raw resources_available differ from what was cached for that vnode.
+        Nodes that disappear from pbsnodes are evicted on refresh.
+        
+        The inventory lives as long as the process, so it pays off for the passes of one hook firing - a cycle_lock rerun,
+        or several cycle_schedule loops - not across firings. Note that machines are still created every cycle, as the
+        autoscaler assigns jobs to them in place.
+    '''
+    
+    def __init__(self):
+        # vnode -> (last_state_change_time, hash of raw resources_available, parsed resources_available)
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def refresh(self, pbsnodes):
+        for vnode in list(self._entries):
+            if vnode not in pbsnodes:
+                self._entries.pop(vnode)
+    
+    def resources_available(self, pbsnode, parse):
+        '''
+            Returns the parsed resources_available of the pbsnode, calling parse(pbsnode) only if the cached copy is stale.
+            The returned dict is shared between cycles and must not be modified.
+        '''
+        raw = pbsnode["resources_available"]
+        vnode = raw["vnode"]
+        last_state_change_time = pbsnode.get("last_state_change_time")
+        # qmgr changes to resources_available do not touch last_state_change_time. Hashing the items is a single pass in C,
+        # with no copy kept around.
+        try:
+            raw_hash = hash(frozenset(raw.iteritems()))
+        except TypeError:
+            # a list valued resource
+            raw_hash = hash(repr(sorted(raw.iteritems())))
+        
+        entry = self._entries.get(vnode)
+        if entry and entry[0] == last_state_change_time and entry[1] == raw_hash:
+            self.hits += 1
+            return entry[2]
+        
+        self.misses += 1
+        parsed = parse(pbsnode)
+        self._entries[vnode] = (last_state_change_time, raw_hash, parsed)
+        return parsed
+
+
+UNMATCHED_JOBS_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "unmatched_jobs.json")
+CYCLE_LOCK_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "autoscale.lock")
+SCALE_UP_HISTORY_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "scale_up_history.json")
+# the comment set on nodes created by precreate_hosts, execute.rb checks for it as well.
+PRECREATED_COMMENT = "cyclecloud-precreated"
+SCHEDULE_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "autoscale_schedule.json")
+CLUSTER_STATUS_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "cluster_status.json")
+MEMORY_HISTORY_PATH = os.path.join(os.path.dirname(pbscc.CONFIG_PATH), "memory_history.json")
+
+
+def _qmgr_value(resource_type, value):
+    # the reverse of ResourceSchema.convert, sizes were converted to gb
+    if isinstance(value, bool):
+        return str(value).lower()
+    if resource_type == "size" and pbscc.is_number(value):
+        return "%dmb" % int(value * 1024)
+    return value
+
+
+def _no_jobs(qstat_output):
+    '''
+        True if the output of driver.queued_jobs() or running_jobs() holds no jobs, without parsing it.
+    '''
+    if isinstance(qstat_output, basestring):
+        return qstat_output.strip() in ["", "[]"]
+    return not qstat_output
+
+
+def job_signature(job):
+    '''
+        Normalized, hashable form of everything that determines whether a job can be matched to a nodearray.
+    '''
+    return (job.nodearray, job.nodes, job.placeby, job.placeby_value, job.exclusive, job.packing_strategy) + tuple(sorted(job.resources.items()))
+
+
+def capacity_fingerprint(nodearray_definitions, machines):
+    '''
+        A digest of the nodearray definitions, ignoring the placeholder group_id/ungrouped values we generate every cycle, and
+        of the instance ids of the existing machines.
+    '''
+    machinetypes = []
+    for machinetype in nodearray_definitions:
+        machinetypes.append(sorted([(k, v) for k, v in machinetype.iteritems() if k not in ["group_id", "ungrouped"]]))
+    instance_ids = sorted([m.get_attr("instance_id", "") for m in machines])
+    return hashlib.md5(repr((sorted(machinetypes), instance_ids))).hexdigest()
+
+
+class MachineIndex:
+    '''
+        Case-insensitive hash index over the machines of the autoscaler and the pbsnodes, by hostname, instance_id and group_id.
+        Built once per cycle so that placing running jobs and evaluating idle machines are dict lookups. pbsnodes are indexed by
+        node name as well as resources_available.vnode/host, as pbs does not always report them with the same case.
+    '''
+    
+    def __init__(self, machines, pbsnodes):
+        self.machines_by_hostname = {}
+        self.machines_by_instance_id = {}
+        self.machines_by_group_id = collections.defaultdict(list)
+        self.pbsnodes_by_hostname = {}
+        self.pbsnodes_by_instance_id = {}
+        
+        for m in machines:
+            if m.hostname:
+                self.machines_by_hostname[m.hostname.lower()] = m
+            instance_id = m.get_attr("instance_id", "")
+            if instance_id:
+                self.machines_by_instance_id[instance_id] = m
+            group_id = m.get_attr("group_id", "")
+            if group_id:
+                self.machines_by_group_id[group_id].append(m)
+        
+        for node_name, pbsnode in pbsnodes.iteritems():
+            resources = pbsnode.get("resources_available", {})
+            for hostname in [node_name, resources.get("vnode"), resources.get("host")]:
+                if isinstance(hostname, basestring) and hostname.lower() not in self.pbsnodes_by_hostname:
+                    self.pbsnodes_by_hostname[hostname.lower()] = pbsnode
+            instance_id = resources.get("instance_id")
+            if instance_id:
+                self.pbsnodes_by_instance_id[instance_id] = pbsnode
+    
+    def machine(self, hostname=None, instance_id=None):
+        m = None
+        if hostname:
+            m = self.machines_by_hostname.get(hostname.lower())
+        if m is None and instance_id:
+            m = self.machines_by_instance_id.get(instance_id)
+        return m
+    
+    def machines_in_group(self, group_id):
+        return self.machines_by_group_id.get(group_id, [])
+    
+    def pbsnode(self, hostname=None, instance_id=None):
+        pbsnode = None
+        if hostname:
+            pbsnode = self.pbsnodes_by_hostname.get(hostname.lower())
+        if pbsnode is None and instance_id:
+            pbsnode = self.pbsnodes_by_instance_id.get(instance_id)
+        return pbsnode
+
+
+class UnmatchedJobCache:
+    '''
+        Records the signatures (see job_signature) of jobs that could not be matched to any nodearray, so that identical jobs
+        skip matching entirely and are reported once with a count, instead of each one logging and counting against
+        pbspro.max_unmatched_jobs.
+        
+        When path is set, signatures are persisted and skipped in later cycles as well, until they are older than ttl seconds
+        or the nodearray definitions or existing machines (fingerprint, see capacity_fingerprint) change.
+    '''
+    
+    def __init__(self, fingerprint, path=None, ttl=300):
+        self.fingerprint = fingerprint
+        self.path = path
+        self.ttl = ttl
+        # signature -> [first job name, number of jobs]
+        self.unmatched = collections.OrderedDict()
+        # signature repr -> time it was first found unmatchable, from previous cycles
+        self.first_seen = {}
+        self._previous = {}
+        
+        if path:
+            self._load()
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fr:
+                persisted = json.load(fr)
+        except Exception as e:
+            pbscc.warn("Could not load unmatched job cache %s, ignoring it. Error was %s" % (self.path, str(e)))
+            return
+        
+        if persisted.get("fingerprint") != self.fingerprint:
+            pbscc.debug("Nodearray definitions or machines changed, invalidating the unmatched job cache")
+            return
+        
+        now = time.time()
+        for key, first_seen in persisted.get("signatures", {}).iteritems():
+            if now - first_seen < self.ttl:
+                self._previous[key] = first_seen
+    
+    def skip(self, job):
+        signature = job_signature(job)
+        if signature in self.unmatched:
+            self.unmatched[signature][1] += 1
+            return True
+        
+        key = repr(signature)
+        if key in self._previous:
+            self.unmatched[signature] = [job.name, 1]
+            self.first_seen[key] = self._previous[key]
+            return True
+        
+        return False
+    
+    def add(self, job):
+        signature = job_signature(job)
+        self.unmatched[signature] = [job.name, 1]
+        self.first_seen[repr(signature)] = time.time()
+    
+    def report(self):
+        for first_job_name, count in self.unmatched.itervalues():
+            if count > 1:
+                pbscc.info("Can not match %d jobs identical to job %s.", count, first_job_name)
+    
+    def save(self):
+        if not self.path:
+            return
+        
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump({"fingerprint": self.fingerprint, "signatures": self.first_seen}, fw)
+            os.rename(tmp_path, self.path)
+        except Exception as e:
+            pbscc.warn("Could not save unmatched job cache %s. Error was %s" % (self.path, str(e)))
+
 
 def compress_queued_jobs(autoscale_jobs):
     '''
@@ -495,7 +956,7 @@ def compress_queued_jobs(autoscale_jobs):
         We do not compress SCATTER jobs.
     '''
     ret = []
-    compression_buckets = collections.defaultdict(lambda: [])
+    compression_buckets = collections.OrderedDict()
     
     for job in autoscale_jobs:
         if job.packing_strategy == PackingStrategy.SCATTER:
@@ -503,10 +964,9 @@ def compress_queued_jobs(autoscale_jobs):
             ret.append(job)
             continue
         
-        comp_bucket = (job.nodearray, job.nodes, job.placeby, job.placeby_value, job.exclusive, job.packing_strategy) + tuple(job.resources.items())
-        compression_buckets[comp_bucket].append(job)
+        compression_buckets.setdefault(job_signature(job), []).append(job)
         
-    for comp_bucket, job_list in compression_buckets.iteritems():
+    for job_list in compression_buckets.itervalues():
         if len(job_list) == 1:
             ret.extend(job_list)
             continue
@@ -516,13 +976,97 @@ def compress_queued_jobs(autoscale_jobs):
                          first_job.resources, first_job.placeby, first_job.placeby_value)
         ret.append(pseudo_job)
         
-        pbscc.debug("Compressed jobs matching job id %s from %d jobs down to a single job" % (first_job.name, len(job_list)))
+        pbscc.aggregate("debug", "Compressed identical jobs matching job ids", first_job.name, count=len(job_list))
     
     return ret
 
 
+def new_schedule(cc_config):
+    '''
+        The loops of cycle_schedule, at intervals of pbspro.scale_up_interval, pbspro.scale_down_interval and
+        pbspro.nodearray_refresh_interval seconds. The first two back off to their *_max_interval while idle.
+    '''
+    scale_up_interval = float(cc_config.get("pbspro.scale_up_interval", 15))
+    scale_down_interval = float(cc_config.get("pbspro.scale_down_interval", 60))
+    return cycle_schedule.Schedule([cycle_schedule.Loop("scale_up", scale_up_interval,
+                                                        float(cc_config.get("pbspro.scale_up_max_interval", scale_up_interval * 4))),
+                                    cycle_schedule.Loop("scale_down", scale_down_interval,
+                                                        float(cc_config.get("pbspro.scale_down_max_interval", scale_down_interval * 5))),
+                                    cycle_schedule.Loop("refresh", float(cc_config.get("pbspro.nodearray_refresh_interval", 300)))],
+                                   SCHEDULE_PATH)
+
+
+def run_due_loops(autostart, schedule, status_api, run=None):
+    '''
+        Runs whichever loops of schedule are due and returns their names. A scale_down loop is a full cycle, so it also
+        counts as a scale_up. run(func) calls func, e.g. a cycle_profiler.CycleProfiler's run.
+    '''
+    run = run or (lambda func: func())
+    due = schedule.due()
+    if not due:
+        return due
+    
+    pending = set(due)
+    try:
+        if "refresh" in due:
+            # re-read by the next cycle that needs the nodearray definitions
+            status_api.refresh()
+            schedule.done("refresh", True)
+            pending.discard("refresh")
+        
+        if "scale_down" in due or "scale_up" in due:
+            scale_down = "scale_down" in due
+            _, idle_machines, _ = run(lambda: autostart.autoscale(scale_down=scale_down))
+            if scale_down:
+                schedule.done("scale_down", bool(idle_machines))
+            schedule.done("scale_up", autostart.metrics.counters.get("jobs_queued", 0) > 0)
+            pending.difference_update(["scale_up", "scale_down"])
+            
+            # e.g. a quota or machine type change we have not seen yet
+            if [x for x in autostart.metrics.extra.get("scale_up", []) if x["status"] == "failed"]:
+                status_api.refresh()
+    finally:
+        # retry a loop that failed at its base interval
+        for name in pending:
+            schedule.done(name, True)
+        schedule.save()
+    return due
+
+
 def _hook():
     pbscc.set_application_name("cycle_autoscale")
+    
+    # the hook fires on a timer regardless of whether the last cycle is done, see cycle_lock.
+    lock = cycle_lock.CycleLock(CYCLE_LOCK_PATH)
+    if not lock.acquire():
+        pbscc.info("An autoscale cycle is already running, it will run another pass when it is done.")
+        return
+    
+    try:
+        _run_cycle(lock)
+    finally:
+        pending = lock.release()
+    
+    # triggers that arrived after the last pass checked for them. The hook waits for us under its alarm, so rather than run
+    # another cycle they are left in the rerun file for the next firing, which signalling demand makes sure starts a cycle.
+    if pending:
+        pbscc.info("Autoscale was triggered as this cycle finished, leaving it for the next cycle.")
+        _signal_demand()
+
+
+def _signal_demand():
+    # the hook config is the first argument, see autostart_hook.py
+    try:
+        with open(sys.argv[1]) as fr:
+            trigger_path = json.load(fr).get("demand_trigger")
+        if trigger_path:
+            with open(trigger_path, "a") as fw:
+                fw.write("1")
+    except Exception as e:
+        pbscc.warn("Could not signal demand for the next cycle: %s" % str(e))
+
+
+def _run_cycle(lock):
     # allow local overrides of jetpack.config or allow non-jetpack masters to define the complete set of settings.
     overrides = {}
     
@@ -539,6 +1083,21 @@ def _hook():
     
     cc_config = cyclecloud.config.new_provider_config(overrides=overrides)
     
+    # fork the command helper before anything large is loaded, see fork_server.
+    runner = None
+    command_timeout = float(cc_config.get("pbspro.command_timeout", 300))
+    if str(cc_config.get("pbspro.fork_server", False)).lower() == "true":
+        runner = fork_server.ForkServer(timeout=command_timeout)
+    
+    # seconds, 0 for no limit. The last cycle_budget_reserve seconds are kept for scaling down.
+    budget = deadline.CycleBudget(float(cc_config.get("pbspro.cycle_budget", 0)), float(cc_config.get("pbspro.cycle_budget_reserve", 0)))
+    if budget.limited():
+        runner = deadline.DeadlineRunner(budget, runner, timeout=command_timeout,
+                                         max_concurrency=int(cc_config.get("pbspro.max_concurrent_commands", 4)))
+    
+    metrics = cycle_metrics.CycleMetrics()
+    runner = cycle_metrics.CountingRunner(metrics, runner or tandem_utils)
+    
     if len(sys.argv) < 3:
         # There are no env variables for this as far as I can tell.
         bin_dir = "/opt/pbs/bin"
@@ -547,10 +1106,63 @@ def _hook():
         if not os.path.isdir(bin_dir):
             bin_dir = os.path.dirname(bin_dir)
     
-    clusters_api = clustersapi.ClustersAPI(cc_config.get("cyclecloud.cluster.name"), cc_config)
-    autostart = PBSAutostart(pbs_driver.PBSDriver(bin_dir), clusters_api, cc_config=cc_config)
+    # api_bytes re-serializes every response, so it is opt-in
+    clusters_api = cycle_metrics.CountingClustersAPI(metrics, clustersapi.ClustersAPI(cc_config.get("cyclecloud.cluster.name"), cc_config),
+                                                     str(cc_config.get("pbspro.metrics_api_bytes", False)).lower() == "true")
+    # cli (default) or ifl, see pbs_driver.new_backend
+    driver = pbs_driver.PBSDriver(bin_dir, backend=cc_config.get("pbspro.driver_backend", "cli"), runner=runner)
+    
+    # run scale up, scale down and the nodearray refresh at their own rates, see cycle_schedule. Otherwise every pass is a full cycle.
+    schedule = None
+    status_api = None
+    if str(cc_config.get("pbspro.multi_rate", False)).lower() == "true":
+        status_api = clusters_api = cycle_schedule.CachedStatusAPI(clusters_api, CLUSTER_STATUS_PATH)
+        schedule = new_schedule(cc_config)
+        # set by autostart_hook.py when a job submission triggered this run
+        if os.getenv("AUTOSTART_TRIGGER") == "demand":
+            schedule.trigger("scale_up")
+    
+    # a directory to save the inputs of each cycle to, for replaying with cycle_recorder.py
+    record_dir = cc_config.get("pbspro.record_cycles")
+    recorder = None
+    autostart_config = cc_config
+    if record_dir:
+        recorder = cycle_recorder.Recorder()
+        driver = cycle_recorder.RecordingDriver(driver, recorder)
+        clusters_api = cycle_recorder.RecordingClustersAPI(clusters_api, recorder)
+        autostart_config = cycle_recorder.RecordingConfig(cc_config, recorder)
+    
+    autostart = PBSAutostart(driver, clusters_api, cc_config=autostart_config, budget=budget, metrics=metrics)
+    if recorder:
+        autostart = cycle_recorder.RecordingAutostart(autostart, recorder)
+    
+    # off unless autostart_profile is set in the hook config
+    profiler = cycle_profiler.from_environment()
+    
+    def autoscale_pass():
+        if recorder:
+            recorder.start()
+        ran = True
+        try:
+            if schedule:
+                ran = bool(run_due_loops(autostart, schedule, status_api, profiler.run))
+            else:
+                profiler.run(autostart.autoscale)
+        finally:
+            if recorder and ran:
+                recorder.save(record_dir, int(cc_config.get("pbspro.record_cycles_keep", 10)))
     
-    autostart.autoscale()
+    try:
+        autoscale_pass()
+        if lock.rerun_requested():
+            pbscc.info("Autoscale was triggered during this cycle, running one more pass.")
+            if schedule:
+                schedule.trigger("scale_up")
+            autoscale_pass()
+    finally:
+        driver.close()
+        if runner:
+            runner.close()
 
 
 # Since this is invoked from a hook, __name__ is not "__main__", so we rely on a special env variable. Otherwise unit testing would be impossible.
@@ -0,0 +1,237 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Scale benchmarks for PBSAutostart, built on the fakes in autostart_mocks.
+
+Each scenario generates a queue with a realistic mix of serial arrays, multi-chunk MPI, exclusive, grouped and ungrouped
+jobs, along with a cluster of hosts of which most are running jobs, then measures query_jobs, compress_queued_jobs,
+get_existing_machines and a full autoscale(). Each measurement runs in a forked child that generates its own inputs, and
+reports the time taken along with peak_growth_bytes, how far the peak RSS rose above the RSS of the inputs during the
+measured call. fixture_rss_bytes, the RSS of the inputs themselves, is reported but not compared.
+
+    python autostart_bench.py                                  # small scenarios
+    python autostart_bench.py --scale all --output results.json
+    python autostart_bench.py --save-baseline bench_baseline.json
+    python autostart_bench.py --baseline bench_baseline.json --tolerance 0.25
+
+With --baseline, the exit code is 1 if any measurement took more than (1 + tolerance) times its baseline time or peak
+growth. Baselines are only comparable on the machine they were recorded on, so none is committed. CI records one from the
+target branch and compares against it in the same job, on the same runner:
+
+    git checkout origin/master && python autostart_bench.py --save-baseline /tmp/bench_baseline.json
+    git checkout - && python autostart_bench.py --baseline /tmp/bench_baseline.json
+'''
+import gc
+import json
+import os
+import random
+import re
+import resource
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+# measurements run in forked children, which would not have the background log writer thread.
+os.environ.setdefault("AUTOSTART_LOG_ASYNC", "false")
+import logging_init  # noqa, see autostart
+import bench_baseline
+from autostart import PBSAutostart, compress_queued_jobs
+from autostart_mocks import MockClustersAPI, MockDriver, PBSQ, nodearray_definitions
+from cyclecloud import autoscale_util, machine
+from memory_monitor import _rss_bytes
+
+
+# (jobs, nodes)
+SCALES = OrderedDict([
+    ("small", [(1000, 100), (10000, 1000)]),
+    ("medium", [(50000, 2500), (100000, 5000)]),
+    ("large", [(250000, 7500), (500000, 10000)])
+])
+
+MEASUREMENTS = ["query_jobs", "compress_queued_jobs", "get_existing_machines", "autoscale"]
+
+# growth below this is page and allocator noise, not a regression.
+MIN_GROWTH_BYTES = 1024 * 1024
+
+HOST_NCPUS = 32
+
+
+def _machinetypes():
+    return [machine.new_machinetype("execute", "a4", HOST_NCPUS, 128, 100000),
+            machine.new_machinetype("execute", "a8", 2 * HOST_NCPUS, 256, 100000)]
+
+
+def generate_queue(num_jobs, num_nodes, seed=0):
+    '''
+        Returns a PBSQ with num_jobs jobs, one running job on each of 80% of the num_nodes hosts, along with the hosts and the
+        CycleCloud nodes that back them.
+    '''
+    rand = random.Random(seed)
+    q = PBSQ()
+    hosts = []
+    cc_nodes = {"execute": []}
+
+    busy_nodes = int(num_nodes * .8)
+    for n in range(num_nodes):
+        hostname = "ip-%08X" % n
+        instance_id = "i-%d" % n
+        host = {"state": "free",
+                "resources_assigned": {},
+                "resources_available": {"vnode": hostname.lower(),
+                                        "host": hostname,
+                                        "ncpus": HOST_NCPUS,
+                                        "mem": "128gb",
+                                        "machinetype": "a4",
+                                        "nodearray": "execute",
+                                        "slot_type": "execute",
+                                        "group_id": "group-%d" % (n % 10),
+                                        "ungrouped": "false",
+                                        "instance_id": instance_id},
+                "jobs": [],
+                "last_state_change_time": time.time() - rand.randint(0, 3600)}
+        cc_nodes["execute"].append({"MachineType": "a4", "InstanceId": instance_id, "Template": "execute"})
+
+        if n < busy_nodes:
+            q.qsub(select_expr="1:ncpus=%d" % HOST_NCPUS, place="excl")
+            job_id = str(q.job_id - 1)
+            q.set_running(job_id, "(%s:ncpus=%d)" % (hostname.lower(), HOST_NCPUS))
+            host["state"] = "job-busy"
+            host["resources_assigned"] = {"ncpus": HOST_NCPUS}
+            host["jobs"] = ["%s.pbsserver/0" % job_id]
+        hosts.append(host)
+
+    mix = [(.4, lambda: q.qsub(select_expr="1:ncpus=1", J="Queued:%d Running:0 Exiting:0 Expired:0" % rand.choice([10, 100, 1000]))),
+           (.2, lambda: q.qsub(select_expr="%d:ncpus=%d+1:ncpus=4" % (rand.choice([2, 4, 8]), HOST_NCPUS), place="scatter:excl:group=group_id")),
+           (.1, lambda: q.qsub(select_expr="1:ncpus=%d" % rand.choice([8, 16]), place="excl")),
+           (.1, lambda: q.qsub(select_expr="%d:ncpus=%d" % (rand.choice([2, 4]), HOST_NCPUS), place="scatter:group=group_id")),
+           (.2, lambda: q.qsub(select_expr="1:ncpus=%d:mem=%dgb" % (rand.choice([1, 2, 4]), rand.choice([1, 4, 8])), place="pack"))]
+
+    queued = max(0, num_jobs - busy_nodes)
+    for _ in range(queued):
+        r = rand.random()
+        for fraction, qsub in mix:
+            r -= fraction
+            if r <= 0:
+                break
+        qsub()
+
+    return q, hosts, cc_nodes
+
+
+def _new_autostart(q, hosts, cc_nodes):
+    cluster_def = nodearray_definitions(*_machinetypes())
+    cc_config = {"pbspro.compress_jobs": True}
+    return PBSAutostart(MockDriver(jobs=q.queues, hosts=hosts), MockClustersAPI(cluster_def, cc_nodes), cc_config)
+
+
+def _reset_peak_rss():
+    '''
+        Resets the peak RSS (VmHWM) to the current RSS, returns False where the kernel does not support it.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as fw:
+            fw.write("5")
+        return True
+    except IOError:
+        return False
+
+
+def _peak_rss_bytes(was_reset):
+    if was_reset:
+        try:
+            with open("/proc/self/status") as fr:
+                return int(re.search(r"VmHWM:\s+(\d+) kB", fr.read()).group(1)) * 1024
+        except (IOError, AttributeError):
+            pass
+    # ru_maxrss may still be the high water mark of building the inputs, so this can understate the growth.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(name, num_jobs, num_nodes):
+    q, hosts, cc_nodes = generate_queue(num_jobs, num_nodes)
+    autostart = _new_autostart(q, hosts, cc_nodes)
+
+    if name == "query_jobs":
+        func = autostart.query_jobs
+    elif name == "compress_queued_jobs":
+        autostart.cc_config = {}
+        jobs = [x for x in autostart.query_jobs() if not x.executing_hostname]
+        func = lambda: compress_queued_jobs(jobs)
+    elif name == "get_existing_machines":
+        nodearray_definitions = autostart.fetch_nodearray_definitions()
+        func = lambda: autostart.get_existing_machines(nodearray_definitions)
+    else:
+        func = autostart.autoscale
+
+    gc.collect()
+    was_reset = _reset_peak_rss()
+    rss_before = _rss_bytes() if was_reset else None
+    if rss_before is None:
+        was_reset = False
+        rss_before = _peak_rss_bytes(False)
+    started = time.time()
+    func()
+    seconds = time.time() - started
+    return OrderedDict([("seconds", seconds),
+                        ("peak_growth_bytes", max(0, _peak_rss_bytes(was_reset) - rss_before)),
+                        ("fixture_rss_bytes", rss_before)])
+
+
+def _measure_in_child(name, num_jobs, num_nodes):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = _measure(name, num_jobs, num_nodes)
+        except Exception:
+            result = {"error": traceback.format_exc()}
+        with os.fdopen(write_fd, "w") as fw:
+            json.dump(result, fw)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as fr:
+        data = fr.read()
+    os.waitpid(pid, 0)
+    return json.loads(data, object_pairs_hook=OrderedDict)
+
+
+def run(scenarios, measurements=MEASUREMENTS, log=sys.stderr):
+    autoscale_util.set_uuid_func(autoscale_util.IncrementingUUID())
+    results = OrderedDict()
+    for num_jobs, num_nodes in scenarios:
+        key = "%dx%d" % (num_jobs, num_nodes)
+        results[key] = OrderedDict()
+        for name in measurements:
+            results[key][name] = result = _measure_in_child(name, num_jobs, num_nodes)
+            if "error" in result:
+                log.write("%s %s failed:\n%s\n" % (key, name, result["error"]))
+            else:
+                log.write("%-14s %-22s %10.3fs %10.1fMB peak growth %10.1fMB inputs\n" % (key, name, result["seconds"],
+                                                                                     result["peak_growth_bytes"] / 1024. / 1024,
+                                                                                     result["fixture_rss_bytes"] / 1024. / 1024))
+    return results
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Scale benchmarks for PBSAutostart")
+    parser.add_argument("--scale", choices=SCALES.keys() + ["all"], default="small")
+    parser.add_argument("--measure", action="append", choices=MEASUREMENTS, help="Defaults to all of them")
+    bench_baseline.add_arguments(parser, tolerance=0.25)
+    args = parser.parse_args(argv)
+
+    if args.scale == "all":
+        scenarios = [x for scale in SCALES.itervalues() for x in scale]
+    else:
+        scenarios = SCALES[args.scale]
+
+    results = run(scenarios, args.measure or MEASUREMENTS)
+    return bench_baseline.finish(args, results, ["seconds", "peak_growth_bytes"], slack={"peak_growth_bytes": MIN_GROWTH_BYTES})
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
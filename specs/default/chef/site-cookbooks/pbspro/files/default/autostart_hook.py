@@ -5,6 +5,7 @@
 import json
 import os
 import subprocess
+import time
 import traceback
 
 try:
@@ -13,6 +14,55 @@ except ImportError:
     import mockpbs as pbs
 
 
+def take_trigger(hook_config, now=None):
+    """
+        The hook fires every second or so, but only starts a cycle when demand_trigger has been signalled (the queuejob hook
+        in submit_hook.py appends to it) or when interval seconds have passed since the last cycle started. If the autoscaler
+        runs its loops at different rates, the interval is replaced by the next_due time in its schedule file, see
+        cycle_schedule.py. Demand is debounced - a signal within demand_debounce seconds of the last cycle starting is left
+        for a later firing, so a burst of submissions starts one cycle rather than one per firing. Signals arriving while a
+        cycle runs are picked up by cycle_lock's extra pass.
+        
+        Returns why a cycle should run, or None. Without a demand_trigger or interval every firing runs a cycle.
+    """
+    now = now or time.time()
+    trigger_path = hook_config.get("demand_trigger")
+    interval = float(hook_config.get("interval") or 0)
+    if not trigger_path:
+        return "interval"
+    
+    last_started_path = trigger_path + ".last"
+    since_last = now - os.path.getmtime(last_started_path) if os.path.exists(last_started_path) else None
+    
+    reason = None
+    schedule_path = hook_config.get("schedule")
+    if schedule_path and os.path.exists(schedule_path):
+        try:
+            with open(schedule_path) as fr:
+                next_due = json.load(fr).get("next_due")
+        except Exception:
+            # being replaced, or corrupt - let the autoscaler sort it out
+            next_due = None
+        # once per due time, as the cycle we started may not have saved the next one yet - unless that was over an interval ago.
+        if next_due is None or (now >= next_due and (since_last is None or now - since_last < next_due or since_last >= interval)):
+            reason = "schedule"
+    elif since_last is None or since_last >= interval:
+        reason = "interval"
+    
+    if os.path.exists(trigger_path) and (since_last is None or since_last >= float(hook_config.get("demand_debounce") or 0)):
+        try:
+            os.remove(trigger_path)
+            reason = "demand"
+        except OSError:
+            # taken by another firing
+            pass
+    
+    if reason:
+        with open(last_started_path, "a"):
+            os.utime(last_started_path, (now, now))
+    return reason
+
+
 def perform_hook():
     """
         See /var/spool/pbs/server_logs/* or /opt/cycle/jetpack/logs/autoscale.log for log messages
@@ -23,6 +73,10 @@ def perform_hook():
 
         with open(pbs.hook_config_filename) as fr:
             hook_config = json.load(fr)
+        
+        reason = take_trigger(hook_config)
+        if not reason:
+            return
             
         log_dir = os.path.join(hook_config.get("cyclecloud_home"), "logs")
         
@@ -31,9 +85,17 @@ def perform_hook():
         
         env_with_src_dirs = {"PYTHONPATH": os.pathsep.join(hook_config.get("src_dirs", [])),
                              "AUTOSTART_HOOK": "1",
+                             "AUTOSTART_TRIGGER": reason,
                              "AUTOSTART_LOG_FILE": os.path.join(log_dir, "autoscale.log"),
                              "AUTOSTART_LOG_FILE_LEVEL": hook_config.get("autostart_log_file_level") or "DEBUG",
-                             "AUTOSTART_LOG_LEVEL": hook_config.get("autostart_log_level") or "DEBUG"}
+                             "AUTOSTART_LOG_LEVEL": hook_config.get("autostart_log_level") or "DEBUG",
+                             "AUTOSTART_PROFILE": str(hook_config.get("autostart_profile") or "false"),
+                             "AUTOSTART_PROFILE_DIR": log_dir}
+        
+        # see cycle_profiler.py
+        for key in ["every", "slower_than", "max_files", "max_mb"]:
+            if hook_config.get("autostart_profile_%s" % key) is not None:
+                env_with_src_dirs["AUTOSTART_PROFILE_%s" % key.upper()] = str(hook_config["autostart_profile_%s" % key])
 
         jetpack_config = hook_config.get("jetpack_python")
         if not jetpack_config:
@@ -46,7 +108,7 @@ def perform_hook():
 
         cmd = [hook_config["jetpack_python"], "-m", "autostart", pbs.hook_config_filename, pbs_bin_dir]
         
-        pbs.logmsg(pbs.LOG_DEBUG, "Running %s with environment %s" % (cmd, env_with_src_dirs))
+        pbs.logmsg(pbs.LOG_DEBUG, "Running %s (%s) with environment %s" % (cmd, reason, env_with_src_dirs))
         
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env_with_src_dirs)
         stdout, stderr = proc.communicate()
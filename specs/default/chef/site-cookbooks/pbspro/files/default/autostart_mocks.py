@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+In memory stand ins for PBS and CycleCloud that PBSAutostart runs against, shared by autostart_test, autostart_bench and
+autostart_sim.
+
+    MockDriver       the PBSDriver interface over a dict of jobs and a list of pbsnodes hosts
+    MockClustersAPI  the clusters API over a cluster status, add_nodes adds nodes to it and shutdown removes them
+    PBSQ             builds the jobs qsub would, for MockDriver
+'''
+import random
+import time
+from itertools import chain
+
+import pbscc
+from autostart import PBSAutostart
+from cyclecloud import autoscale_util
+from cyclecloud.autoscale_util import Record
+from pbscc import InvalidSizeExpressionError
+
+
+class MockDriver:
+    def __init__(self, queues=None, jobs=None, hosts=None):
+        self._queues = queues or ["workq"]
+        self._jobs = jobs or {}
+        assert isinstance(jobs, dict)
+        self._hosts = hosts or []
+        self._declared_resources = {"resources": ["ncpus", "mem", "arch", "host", "vnode", "aoe", "slot_type", 
+                                                  "group_id", "ungrouped", "instance_id", "ipv4", "disk", "scratch",
+                                                  "swlicense", "graphics", "dyna"]}
+        self._resource_definitions = {"slot_type": "string", "group_id": "string", "ungrouped": "string", "instance_id": "string",
+                                      "machinetype": "string", "nodearray": "string", "disk": "size", "ngpus": "size",
+                                      "scratch": "size", "swlicense": "long", "graphics": "boolean", "dyna": "long"}
+        
+    def queues(self):
+        return self._queues
+    
+    def queued_jobs(self):
+        # TODO multiple queues
+        return [x for x in self._jobs.get("workq", []) if x["job_state"] == "Q"], lambda x: x
+    
+    def running_jobs(self):
+        return [x for x in self._jobs.get("workq", []) if x["job_state"] == "R"], lambda x: x
+    
+    def scheduler_config(self):
+        return self._declared_resources
+    
+    def resource_definitions(self):
+        return self._resource_definitions
+    
+    def pbsnodes(self, grouping=None):
+        ret = {None: {}}
+        for host in self._hosts:
+            state = host.get(grouping)
+            if state not in ret:
+                ret[state] = {}
+            ret[state][host["resources_available"]["vnode"]] = host
+        return ret
+    
+    def set_offline(self, hostname):
+        try:
+            host = self.get_host(hostname)
+        except:
+            return
+        if "offline" not in host["state"]:
+            if host["state"] == "free":
+                host["state"] = "offline"
+            else:
+                host["state"] = host["state"] + ",offline"
+                    
+    def delete_host(self, hostname):
+        self._hosts = [x for x in self._hosts if x["resources_available"]["vnode"] != hostname]
+        
+    def create_hosts(self, hosts):
+        for hostname, attributes in hosts:
+            resources = dict([(key.split(".", 1)[1], value) for key, value in attributes.iteritems() if key.startswith("resources_available.")])
+            self.add_host(hostname, state="state-unknown,down", **resources)
+            self._hosts[-1]["comment"] = attributes.get("comment")
+        return []
+        
+    def get_host(self, hostname):
+        select = [x for x in self._hosts if x["resources_available"]["vnode"].lower() == hostname.lower()]
+        assert len(select) == 1, "%s %s %s" % (select, hostname, [x["hostname"].lower() for x in self._hosts])
+        return select[0]
+        
+    def add_host(self, hostname, state="free", **resources):
+        host = {"host": hostname, "hostname": hostname, "state": state}
+        resources_assigned = resources.pop("resources_assigned", {})
+        if state == "job-busy" and not resources_assigned:
+            raise RuntimeError("define resources_assigned")
+        
+        host["resources_available"] = resources
+        host["resources_available"]["host"] = hostname.upper()
+        host["resources_available"]["vnode"] = host["resources_available"]["host"].lower() 
+        host["resources_assigned"] = resources_assigned
+        host["jobs"] = resources.pop("jobs", [])
+        host["last_state_change_time"] = time.time()
+        self._hosts.append(host)
+        
+
+class MockClustersAPI:
+    
+    def __init__(self, cluster_def, nodes=None):
+        self.cluster_def = cluster_def
+        nodes = nodes or {}
+        self._nodes = nodes
+        if not hasattr(nodes, "keys"):
+            self._nodes = {"execute": []}
+            for node in nodes:
+                # node.get_attr("instance_id", autoscale_util.uuid("instance_id"))] = node
+                self._nodes["execute"].append(node)
+        
+    def status(self, nodes=False):
+        if nodes:
+            self.cluster_def["nodes"] = nodes = []
+            for node_list in self._nodes.itervalues():
+                nodes.extend(node_list)
+        else:
+            self.cluster_def.pop("nodes", [])
+        return self.cluster_def
+    
+    def nodes(self):
+        for key in self._nodes:
+            random.shuffle(self._nodes[key])
+        return self._nodes
+    
+    def add_nodes(self, request):
+        for request_set in request["sets"]:
+            for _ in range(request_set["count"]):
+                select = [x for x in self.cluster_def["nodearrays"] if x["name"] == request_set["nodearray"]]
+                assert select, "%s not in %s" % (request_set["nodearray"], [x["name"] for x in self.cluster_def["nodearrays"]])
+                nodearray = select[0]
+                select = [b for b in nodearray["buckets"] if b["definition"] == request_set["definition"]]
+                assert select, "No matching bucket found for request %s" % request
+                mt = select[0]["virtualMachine"]
+                mt_name = select[0]["definition"]["machineType"]
+                node = Record({"vcpuCount": mt["vcpuCount"],
+                               "memory": mt["Memory"], 
+                               "machineType": mt_name,
+                               "placementGroupId": request_set.get("placementGroupId")})
+                node.update(request_set["nodeAttributes"])
+                node["nodearray"] = request_set["nodearray"]
+                node["Template"] = request_set["nodearray"]
+                node["InstanceId"] = autoscale_util.uuid("instance")
+                
+                if node["nodearray"] not in self._nodes:
+                    self._nodes[node["nodearray"]] = []
+                self._nodes[node["nodearray"]].append(node)
+                
+    def shutdown(self, instance_ids):
+        instance_ids = list(instance_ids)
+        for key in self._nodes:
+            self._nodes[key] = [x for x in self._nodes[key] if x["InstanceId"] not in instance_ids]
+
+
+def nodearray_definitions(*machinetypes):
+    machinetypes = sorted(machinetypes, key=lambda x: -x.get("priority", 100))
+    cluster_status = {}
+    ret = {}
+    
+    for machinetype in machinetypes:
+        nodearray = machinetype.get("nodearray")
+        if nodearray not in ret:
+            ret[nodearray] = {"nodearray": {},
+                              "name": nodearray,
+                              "buckets": []}
+        
+        name = machinetype.get("machinetype")
+        ret[nodearray]["buckets"].append({"definition": {"machineType": name},
+                                          "virtualMachine": machinetype})
+
+    cluster_status["nodearrays"] = ret.values()
+    return cluster_status
+
+    
+class PBSQ:
+    
+    def __init__(self):
+        self.queues = {"workq": []}
+        self.job_id = 1
+        self.hosts = []
+    
+    def qsub(self, job_id=None, job_state="Q", J=None, select_expr=None, **resource_list):
+        assert "select" not in resource_list
+        if not job_id:
+            job_id = str(self.job_id)
+            self.job_id += 1
+            
+        jobdef = {"resource_list": {},
+                  "job_id": job_id,
+                  "job_state": job_state}
+        
+        for key, value in resource_list.iteritems():
+            jobdef["resource_list"][key] = value
+            
+        jobdef["resource_list"]["nodect"] = 1      
+            
+        if "job_state" not in jobdef:
+            jobdef["job_state"] = "Q"
+            
+        if "ncpus" not in jobdef["resource_list"]:
+            jobdef["resource_list"]["ncpus"] = jobdef.get("nodes", 1)
+        
+        if J:
+            jobdef["array"] = True
+            jobdef["array_state_count"] = J
+            
+        if select_expr:
+            jobdef["resource_list"]["select"] = select_expr
+            chunk_totals = {}
+            for chunk in pbscc.parse_select(jobdef):
+                chunk["ncpus"] = chunk.get("ncpus", 1)
+                for key, value in chunk.iteritems():
+                    if key == "select":
+                        continue
+                    try:
+                        if key == "nodect":
+                            value = pbscc.parse_gb_size(key, value)
+                        else:
+                            value = pbscc.parse_gb_size(key, value) * int(chunk["select"])
+                        chunk_totals[key] = chunk_totals.get(key, 0) + value
+                    except InvalidSizeExpressionError:
+                        chunk_totals[key] = value
+                        
+            for key, value in chunk_totals.iteritems():
+                if key != "select":
+                    jobdef["resource_list"][key] = value
+        
+        self.queues["workq"].append(jobdef)
+        
+    def qdel(self, jobid):
+        to_delete = [x for x in self.queues["workq"] if x["job_id"] == str(jobid)]
+        assert len(to_delete) >= 1
+        self.queues["workq"] = [x for x in self.queues["workq"] if x not in to_delete]
+        
+    def query_jobs(self):
+        cluster = MockClustersAPI({})
+        a = PBSAutostart(MockDriver(["workq"], self.queues), cluster, {})
+        return a.query_jobs()
+    
+    def set_running(self, job_id, exec_vnode):
+        '''
+            Testing: change the job state and set exec_vnode expression so that autoscale knows where the jobs are placed
+        '''
+        for job in chain(*self.queues.values()):
+            if str(job["job_id"]) == str(job_id):
+                job["exec_vnode"] = exec_vnode
+                job["job_state"] = "R"
+                return
+        raise AssertionError("Could not find job_id %s" % job_id)
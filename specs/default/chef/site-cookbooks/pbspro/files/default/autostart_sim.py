@@ -0,0 +1,501 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Discrete event simulation of a cluster driven by PBSAutostart, for evaluating autoscale settings against a workload
+without starting any VMs.
+
+PBSAutostart runs unmodified against MockDriver and MockClustersAPI, with autostart's clock replaced by a virtual one.
+Everything around it is modelled:
+
+    submit      jobs arrive, either from a workload file or generated with a daily cycle
+    schedule    after every change a first fit FIFO scheduler starts the queued jobs that fit (excl and group=
+                placements are honoured), like pbs_sched being triggered by qsub, job end and node up
+    finish      jobs end after their runtime, and the host's last_used_time is updated
+    boot        instances requested through add_nodes join as pbsnodes after boot_delay (+/- boot_jitter)
+    fail        optionally, hosts go down,offline at failure_rate per node hour, and their jobs are requeued
+    cycle       autoscale() runs every cycle_interval seconds
+
+and the report has the queue wait percentiles, node hours, idle node hours (booted with no jobs, including offline) and
+the CPU time autoscale() itself took per cycle.
+
+    python autostart_sim.py --hours 168 --jobs-per-hour 200
+    python autostart_sim.py --workload jobs.json --set cyclecloud.cluster.autoscale.idle_time_after_jobs=900
+    python autostart_sim.py --sweep cyclecloud.cluster.autoscale.idle_time_after_jobs=60,300,900,1800
+
+A workload file is a JSON list of {"submit": seconds, "select": "2:ncpus=16", "place": "scatter:excl", "runtime": seconds}.
+'''
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+# keep a week of cycles out of the log files.
+os.environ.setdefault("AUTOSTART_LOG_LEVEL", "WARN")
+os.environ.setdefault("AUTOSTART_LOG_ASYNC", "false")
+import logging_init  # noqa, see autostart
+import autostart
+import pbscc
+from autostart import PBSAutostart
+from autostart_mocks import MockClustersAPI, MockDriver, nodearray_definitions
+from cyclecloud import autoscale_util, machine
+
+
+class VirtualTime:
+    '''
+        Stands in for the time module in autostart, everything but time() is the real thing.
+    '''
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class SimDriver(MockDriver):
+
+    def __init__(self, sim):
+        MockDriver.__init__(self, jobs={"workq": []}, hosts=[])
+        self.sim = sim
+
+    def set_offline(self, hostname):
+        MockDriver.set_offline(self, hostname)
+        host = self.sim.hosts.get(hostname.lower())
+        if host:
+            host["last_state_change_time"] = self.sim.clock.now
+
+    def delete_host(self, hostname):
+        MockDriver.delete_host(self, hostname)
+        self.sim.hosts.pop(hostname.lower(), None)
+
+
+class SimClustersAPI(MockClustersAPI):
+
+    def __init__(self, sim, cluster_def):
+        MockClustersAPI.__init__(self, cluster_def, {"execute": []})
+        self.sim = sim
+
+    def add_nodes(self, request):
+        known = set([x["InstanceId"] for nodes in self._nodes.itervalues() for x in nodes])
+        MockClustersAPI.add_nodes(self, request)
+        for nodes in self._nodes.itervalues():
+            for node in nodes:
+                if node["InstanceId"] not in known:
+                    # what nodes_by_instance_id expects from the real api
+                    node["MachineType"] = node["machineType"]
+                    self.sim.instance_requested(node)
+
+    def shutdown(self, instance_ids):
+        instance_ids = list(instance_ids)
+        MockClustersAPI.shutdown(self, instance_ids)
+        for instance_id in instance_ids:
+            self.sim.instance_terminated(instance_id)
+
+
+def percentiles(values, points=(50, 90, 99)):
+    ret = OrderedDict()
+    values = sorted(values)
+    for point in points:
+        ret["p%d" % point] = values[min(len(values) - 1, int(math.ceil(point / 100.0 * len(values))) - 1)] if values else None
+    ret["max"] = values[-1] if values else None
+    ret["mean"] = sum(values) / float(len(values)) if values else None
+    return ret
+
+
+def generate_workload(hours, jobs_per_hour, host_ncpus=16, seed=0):
+    '''
+        Poisson arrivals peaking in the middle of the day at 1.8x, and at night dropping to 0.2x, jobs_per_hour. 70% are
+        serial, 20% use part of a host, 10% are MPI jobs over whole, exclusive, hosts in one placement group.
+    '''
+    rand = random.Random(seed)
+    peak = 1.8 * jobs_per_hour / 3600.0
+    workload = []
+    t = 0
+    while True:
+        t += rand.expovariate(peak)
+        if t > hours * 3600:
+            break
+        # thinning against the daily cycle
+        if rand.random() > (1 - 0.8 * math.cos(2 * math.pi * t / 86400)) / 1.8:
+            continue
+        r = rand.random()
+        if r < .7:
+            workload.append({"submit": t, "select": "1:ncpus=1", "runtime": rand.expovariate(1 / 1200.0)})
+        elif r < .9:
+            workload.append({"submit": t, "select": "1:ncpus=%d" % rand.choice([2, 4, 8, host_ncpus]), "runtime": rand.expovariate(1 / 3600.0)})
+        else:
+            workload.append({"submit": t, "select": "%d:ncpus=%d" % (rand.choice([2, 4, 8]), host_ncpus), "place": "scatter:excl:group=group_id",
+                             "runtime": rand.expovariate(1 / 7200.0)})
+    return workload
+
+
+class Simulation:
+
+    def __init__(self, workload, cc_config=None, host_ncpus=16, host_mem=64, max_nodes=1000, cycle_interval=15,
+                 boot_delay=300, boot_jitter=120, failure_rate=0, seed=0):
+        self.workload = sorted(workload, key=lambda x: x["submit"])
+        self.cc_config = {"pbspro.compress_jobs": True}
+        self.cc_config.update(cc_config or {})
+        self.host_ncpus = host_ncpus
+        self.cycle_interval = cycle_interval
+        self.boot_delay = boot_delay
+        self.boot_jitter = boot_jitter
+        self.failure_rate = failure_rate
+        self.rand = random.Random(seed)
+        self.seed = seed
+
+        self.clock = VirtualTime()
+        self.driver = SimDriver(self)
+        self.clusters_api = SimClustersAPI(self, nodearray_definitions(machine.new_machinetype("execute", "a4", host_ncpus, host_mem, max_nodes)))
+
+        self._events = []
+        self._seq = 0
+
+        # job_id -> job, in submit order
+        self.jobs = OrderedDict()
+        # vnode -> host
+        self.hosts = {}
+        # instance_id -> {"requested", "node", "hostname", "idle_since"}
+        self.instances = {}
+        self._next_host = 0
+        self._next_job = 1
+
+        self.queue_waits = []
+        self.cycle_cpu_seconds = []
+        self.finished_jobs = 0
+        self.requeued_jobs = 0
+        self.node_seconds = 0
+        self.idle_node_seconds = 0
+        self.instances_started = 0
+        self.peak_instances = 0
+
+    def _push(self, when, kind, payload=None):
+        self._seq += 1
+        heapq.heappush(self._events, (when, self._seq, kind, payload))
+
+    def run(self, duration=None):
+        if duration is None:
+            duration = (self.workload[-1]["submit"] if self.workload else 0) + 2 * 3600
+
+        for entry in self.workload:
+            self._push(entry["submit"], "submit", entry)
+        self._push(0, "cycle")
+
+        handlers = {"submit": self._submit, "finish": self._finish, "boot": self._boot, "fail": self._fail, "cycle": self._cycle}
+
+        # fixed instance ids and job ids so that runs with the same seed are comparable
+        autoscale_util.set_uuid_func(autoscale_util.IncrementingUUID())
+        random.seed(self.seed)
+        real_time = autostart.time
+        autostart.time = self.clock
+        try:
+            self.autostart = PBSAutostart(self.driver, self.clusters_api, self.cc_config)
+            changed = False
+            while self._events and self._events[0][0] <= duration:
+                when, _, kind, payload = heapq.heappop(self._events)
+                self.clock.now = when
+                handlers[kind](payload)
+                changed = changed or kind != "cycle"
+                if changed and (not self._events or self._events[0][0] > when):
+                    self._schedule()
+                    changed = False
+        finally:
+            autostart.time = real_time
+
+        self.clock.now = duration
+        for instance_id in list(self.instances):
+            self.instance_terminated(instance_id)
+        return self.report(duration)
+
+    def _submit(self, entry):
+        job_id = str(self._next_job)
+        self._next_job += 1
+        place = entry.get("place", "")
+        job = {"job_id": job_id,
+               "job_state": "Q",
+               "resource_list": {"select": entry["select"], "place": place},
+               "submitted": self.clock.now,
+               "runtime": entry["runtime"],
+               "run": 0}
+        chunks = []
+        for chunk in pbscc.parse_select(job):
+            chunks.extend([int(chunk.get("ncpus", 1))] * int(chunk["select"]))
+        job["resource_list"]["ncpus"] = sum(chunks)
+        job["resource_list"]["nodect"] = len(chunks)
+        job["chunks"] = chunks
+        job["excl"] = "excl" in place
+        job["grouped"] = "group=" in place
+        self.jobs[job_id] = job
+
+    def _usable(self, host):
+        states = host["state"].split(",")
+        return "offline" not in states and "down" not in states
+
+    def _place(self, job, free_ncpus):
+        candidates = [(vnode, ncpus) for vnode, ncpus in free_ncpus.iteritems() if not job["excl"] or not self.hosts[vnode]["jobs"]]
+        if job["grouped"]:
+            groups = {}
+            for vnode, ncpus in candidates:
+                groups.setdefault(self.hosts[vnode]["resources_available"]["group_id"], []).append((vnode, ncpus))
+            groups = groups.values()
+        else:
+            groups = [candidates]
+
+        for group in groups:
+            # one chunk per host, largest chunks on the emptiest hosts
+            group = sorted(group, key=lambda x: -x[1])
+            chunks = sorted(job["chunks"], reverse=True)
+            if len(group) < len(chunks):
+                continue
+            if all([ncpus >= chunk for (_, ncpus), chunk in zip(group, chunks)]):
+                return [(vnode, chunk) for (vnode, _), chunk in zip(group, chunks)]
+        return None
+
+    def _schedule(self):
+        free_ncpus = {}
+        for vnode, host in self.hosts.iteritems():
+            if self._usable(host) and host["ncpus_free"] > 0:
+                free_ncpus[vnode] = host["ncpus_free"]
+
+        failed = set()
+        for job in self.jobs.itervalues():
+            if not free_ncpus:
+                break
+            if job["job_state"] != "Q":
+                continue
+            signature = (tuple(job["chunks"]), job["excl"], job["grouped"])
+            if signature in failed:
+                continue
+            placement = self._place(job, free_ncpus)
+            if not placement:
+                failed.add(signature)
+                continue
+
+            self._start(job, placement)
+            for vnode, _ in placement:
+                free_ncpus[vnode] = self.hosts[vnode]["ncpus_free"]
+                if free_ncpus[vnode] <= 0 or job["excl"]:
+                    free_ncpus.pop(vnode)
+
+    def _set_state(self, host, state):
+        if "offline" in host["state"].split(","):
+            state = "offline" if state == "free" else state + ",offline"
+        if host["state"] != state:
+            host["state"] = state
+            host["last_state_change_time"] = self.clock.now
+
+    def _track_idle(self, host):
+        instance = self.instances.get(host["resources_available"]["instance_id"])
+        if not instance:
+            return
+        if host["jobs"] and instance["idle_since"] is not None:
+            self.idle_node_seconds += self.clock.now - instance["idle_since"]
+            instance["idle_since"] = None
+        elif not host["jobs"] and instance["idle_since"] is None:
+            instance["idle_since"] = self.clock.now
+
+    def _start(self, job, placement):
+        now = self.clock.now
+        self.queue_waits.append(now - job["submitted"])
+        job["job_state"] = "R"
+        job["run"] += 1
+        job["exec_vnode"] = "+".join(["(%s:ncpus=%d)" % x for x in placement])
+        job["placement"] = placement
+        for vnode, ncpus in placement:
+            host = self.hosts[vnode]
+            host["ncpus_free"] -= self.host_ncpus if job["excl"] else ncpus
+            host["resources_assigned"]["ncpus"] = self.host_ncpus - host["ncpus_free"]
+            host["jobs"].append("%s.pbsserver/0" % job["job_id"])
+            self._set_state(host, "job-busy" if host["ncpus_free"] <= 0 else "free")
+            self._track_idle(host)
+        self._push(now + job["runtime"], "finish", (job["job_id"], job["run"]))
+
+    def _release(self, job):
+        for vnode, ncpus in job.pop("placement"):
+            host = self.hosts.get(vnode)
+            if not host:
+                continue
+            host["ncpus_free"] += self.host_ncpus if job["excl"] else ncpus
+            host["resources_assigned"]["ncpus"] = self.host_ncpus - host["ncpus_free"]
+            host["jobs"].remove("%s.pbsserver/0" % job["job_id"])
+            if not host["jobs"]:
+                host["last_used_time"] = self.clock.now
+            if "down" not in host["state"]:
+                self._set_state(host, "free")
+            self._track_idle(host)
+
+    def _finish(self, payload):
+        job_id, run = payload
+        job = self.jobs.get(job_id)
+        # requeued since
+        if not job or job["run"] != run:
+            return
+        self._release(job)
+        self.jobs.pop(job_id)
+        self.finished_jobs += 1
+
+    def instance_requested(self, node):
+        self.instances[node["InstanceId"]] = {"requested": self.clock.now, "node": node, "hostname": None, "idle_since": None}
+        self.instances_started += 1
+        self.peak_instances = max(self.peak_instances, len(self.instances))
+        delay = max(0, self.rand.uniform(self.boot_delay - self.boot_jitter, self.boot_delay + self.boot_jitter))
+        self._push(self.clock.now + delay, "boot", node["InstanceId"])
+
+    def instance_terminated(self, instance_id):
+        instance = self.instances.pop(instance_id, None)
+        if not instance:
+            return
+        self.node_seconds += self.clock.now - instance["requested"]
+        if instance["idle_since"] is not None:
+            self.idle_node_seconds += self.clock.now - instance["idle_since"]
+        if instance["hostname"]:
+            host = self.hosts.pop(instance["hostname"], None)
+            if host:
+                self.driver._hosts = [x for x in self.driver._hosts if x is not host]
+
+    def _boot(self, instance_id):
+        instance = self.instances.get(instance_id)
+        if not instance:
+            # shut down while booting
+            return
+        node = instance["node"]
+        hostname = "ip-%08x" % self._next_host
+        self._next_host += 1
+        node["hostname"] = hostname
+        instance["hostname"] = hostname
+        group_id = node.get("placementGroupId")
+        host = {"state": "free",
+                "resources_assigned": {"ncpus": 0},
+                "resources_available": {"vnode": hostname,
+                                        "host": hostname.upper(),
+                                        "ncpus": self.host_ncpus,
+                                        "machinetype": node["machineType"],
+                                        "nodearray": node["nodearray"],
+                                        "slot_type": node["nodearray"],
+                                        "group_id": group_id or "single",
+                                        "ungrouped": "false" if group_id else "true",
+                                        "instance_id": instance_id},
+                "jobs": [],
+                "ncpus_free": self.host_ncpus,
+                "last_state_change_time": self.clock.now}
+        self.hosts[hostname] = host
+        self.driver._hosts.append(host)
+        self._track_idle(host)
+        if self.failure_rate > 0:
+            self._push(self.clock.now + self.rand.expovariate(self.failure_rate / 3600.0), "fail", hostname)
+
+    def _fail(self, hostname):
+        host = self.hosts.get(hostname)
+        if not host:
+            return
+        for job_entry in list(host["jobs"]):
+            job = self.jobs[job_entry.split(".")[0]]
+            self._release(job)
+            job["job_state"] = "Q"
+            job.pop("exec_vnode", None)
+            self.requeued_jobs += 1
+        host["state"] = "down,offline"
+        host["last_state_change_time"] = self.clock.now
+
+    def _cycle(self, _):
+        self.driver._jobs["workq"] = self.jobs.values()
+        started = os.times()
+        self.autostart.autoscale()
+        finished = os.times()
+        self.cycle_cpu_seconds.append((finished[0] + finished[1]) - (started[0] + started[1]))
+        self._push(self.clock.now + self.cycle_interval, "cycle")
+
+    def report(self, duration):
+        report = OrderedDict()
+        report["simulated_hours"] = duration / 3600.0
+        report["config"] = self.cc_config
+        report["jobs"] = OrderedDict([("submitted", len(self.workload)),
+                                      ("started", len(self.queue_waits)),
+                                      ("finished", self.finished_jobs),
+                                      ("requeued", self.requeued_jobs),
+                                      ("still_queued", len([x for x in self.jobs.itervalues() if x["job_state"] == "Q"])),
+                                      ("queue_wait_seconds", percentiles(self.queue_waits))])
+        report["nodes"] = OrderedDict([("started", self.instances_started),
+                                       ("peak", self.peak_instances),
+                                       ("node_hours", self.node_seconds / 3600.0),
+                                       ("idle_node_hours", self.idle_node_seconds / 3600.0),
+                                       ("idle_fraction", self.idle_node_seconds / self.node_seconds if self.node_seconds else 0)])
+        report["autoscale"] = OrderedDict([("cycles", len(self.cycle_cpu_seconds)),
+                                           ("cpu_seconds", sum(self.cycle_cpu_seconds)),
+                                           ("cpu_seconds_per_cycle", percentiles(self.cycle_cpu_seconds))])
+        return report
+
+
+def _parse_setting(expr):
+    key, value = expr.split("=", 1)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Discrete event simulation of autoscale settings")
+    parser.add_argument("--workload", help="JSON workload file, otherwise one is generated")
+    parser.add_argument("--hours", type=float, default=24, help="Hours of generated workload")
+    parser.add_argument("--jobs-per-hour", type=float, default=100)
+    parser.add_argument("--duration", type=float, help="Seconds to simulate, defaults to the last submit plus 2 hours")
+    parser.add_argument("--set", action="append", default=[], help="key=value autoscale setting, may be repeated")
+    parser.add_argument("--sweep", help="key=v1,v2,... run the simulation once per value")
+    parser.add_argument("--host-ncpus", type=int, default=16)
+    parser.add_argument("--max-nodes", type=int, default=1000)
+    parser.add_argument("--cycle-interval", type=float, default=15)
+    parser.add_argument("--boot-delay", type=float, default=300)
+    parser.add_argument("--boot-jitter", type=float, default=120)
+    parser.add_argument("--failure-rate", type=float, default=0, help="Host failures per node hour")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report(s) as JSON to this path instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.workload:
+        with open(args.workload) as fr:
+            workload = json.load(fr)
+    else:
+        workload = generate_workload(args.hours, args.jobs_per_hour, args.host_ncpus, args.seed)
+
+    cc_config = dict([_parse_setting(x) for x in args.set])
+    configs = [cc_config]
+    if args.sweep:
+        key, values = args.sweep.split("=", 1)
+        configs = []
+        for value in values.split(","):
+            config = dict(cc_config)
+            config.update([_parse_setting("%s=%s" % (key, value))])
+            configs.append(config)
+
+    reports = []
+    for config in configs:
+        sim = Simulation(workload, config, host_ncpus=args.host_ncpus, max_nodes=args.max_nodes, cycle_interval=args.cycle_interval,
+                         boot_delay=args.boot_delay, boot_jitter=args.boot_jitter, failure_rate=args.failure_rate, seed=args.seed)
+        report = sim.run(args.duration)
+        reports.append(report)
+        sys.stderr.write("%s: wait p50 %s p99 %s, %.1f node hours (%.1f idle), %.4fs autoscale cpu/cycle\n" % (
+                         json.dumps(config), report["jobs"]["queue_wait_seconds"]["p50"], report["jobs"]["queue_wait_seconds"]["p99"],
+                         report["nodes"]["node_hours"], report["nodes"]["idle_node_hours"],
+                         report["autoscale"]["cpu_seconds_per_cycle"]["mean"] or 0))
+
+    output = json.dumps(reports if args.sweep else reports[0], indent=2)
+    if args.output:
+        with open(args.output, "w") as fw:
+            fw.write(output)
+    else:
+        print output
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
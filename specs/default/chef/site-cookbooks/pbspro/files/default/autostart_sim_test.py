@@ -0,0 +1,51 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import unittest
+
+import autostart_sim
+
+
+class Test(unittest.TestCase):
+
+    def test_boot_and_scale_down(self):
+        # two whole host jobs, so two nodes that take exactly boot_delay to join
+        workload = [{"submit": 0, "select": "1:ncpus=16", "runtime": 600},
+                    {"submit": 0, "select": "1:ncpus=16", "runtime": 600}]
+        sim = autostart_sim.Simulation(workload, host_ncpus=16, cycle_interval=15, boot_delay=300, boot_jitter=0)
+        report = sim.run()
+
+        self.assertEquals(["simulated_hours", "config", "jobs", "nodes", "autoscale"], report.keys())
+        self.assertEquals(2, report["simulated_hours"])
+        self.assertEquals({"submitted": 2, "started": 2, "finished": 2, "requeued": 0, "still_queued": 0},
+                          dict([(k, v) for k, v in report["jobs"].iteritems() if k != "queue_wait_seconds"]))
+        self.assertEquals(300, report["jobs"]["queue_wait_seconds"]["p50"])
+        self.assertEquals(300, report["jobs"]["queue_wait_seconds"]["max"])
+
+        self.assertEquals(2, report["nodes"]["started"])
+        self.assertEquals(2, report["nodes"]["peak"])
+        # both ran their job for 600 seconds, then sat idle until they were shut down, well before the 2 hours are up
+        self.assertTrue(2 * 900 / 3600.0 <= report["nodes"]["node_hours"] < 2.0, report["nodes"])
+        self.assertTrue(0 < report["nodes"]["idle_node_hours"] < report["nodes"]["node_hours"], report["nodes"])
+        self.assertEquals({}, sim.instances)
+
+        # every cycle_interval from 0 through the end of the simulation
+        self.assertEquals(7200 / 15 + 1, report["autoscale"]["cycles"])
+
+    def test_seeded_runs_match(self):
+        workload = autostart_sim.generate_workload(hours=1, jobs_per_hour=30, seed=3)
+        self.assertEquals(workload, autostart_sim.generate_workload(hours=1, jobs_per_hour=30, seed=3))
+
+        reports = []
+        for _ in range(2):
+            report = autostart_sim.Simulation(workload, seed=3).run()
+            # cpu time is the only thing that is measured rather than simulated
+            report.pop("autoscale")
+            reports.append(report)
+        self.assertEquals(reports[0], reports[1])
+        self.assertEquals(len(workload), reports[0]["jobs"]["submitted"])
+        self.assertTrue(reports[0]["jobs"]["started"] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
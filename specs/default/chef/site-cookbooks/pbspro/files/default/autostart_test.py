@@ -3,239 +3,24 @@
 #
 import logging_init
 import numbers
+import os
+import shutil
+import tempfile
 import unittest
 
-from autostart import PBSAutostart
+import autostart
+from autostart import PBSAutostart, MachineIndex, NodeInventory, compress_queued_jobs, capacity_fingerprint, PRECREATED_COMMENT
 from cyclecloud import machine, autoscale_util
 from cyclecloud.job import Job
 from cyclecloud.machine import MachineRequest
-from cyclecloud.autoscale_util import Record
 import time
-from itertools import chain
 from cyclecloud.config import InstanceConfig
-import random
+from autostart_mocks import MockDriver, MockClustersAPI, PBSQ, nodearray_definitions
+import cycle_recorder
+import deadline
 import pbscc
-from pbscc import InvalidSizeExpressionError
 
 
-class MockDriver:
-    def __init__(self, queues=None, jobs=None, hosts=None):
-        self._queues = queues or ["workq"]
-        self._jobs = jobs or {}
-        assert isinstance(jobs, dict)
-        self._hosts = hosts or []
-        self._declared_resources = {"resources": ["ncpus", "mem", "arch", "host", "vnode", "aoe", "slot_type", 
-                                                  "group_id", "ungrouped", "instance_id", "ipv4", "disk", "scratch",
-                                                  "swlicense", "graphics", "dyna"]}
-        
-    def queues(self):
-        return self._queues
-    
-    def queued_jobs(self):
-        # TODO multiple queues
-        return [x for x in self._jobs.get("workq", []) if x["job_state"] == "Q"], lambda x: x
-    
-    def running_jobs(self):
-        return [x for x in self._jobs.get("workq", []) if x["job_state"] == "R"], lambda x: x
-    
-    def scheduler_config(self):
-        return self._declared_resources
-    
-    def pbsnodes(self, grouping=None):
-        ret = {None: {}}
-        for host in self._hosts:
-            state = host.get(grouping)
-            if state not in ret:
-                ret[state] = {}
-            ret[state][host["resources_available"]["vnode"]] = host
-        return ret
-    
-    def set_offline(self, hostname):
-        try:
-            host = self.get_host(hostname)
-        except:
-            return
-        if "offline" not in host["state"]:
-            if host["state"] == "free":
-                host["state"] = "offline"
-            else:
-                host["state"] = host["state"] + ",offline"
-                    
-    def delete_host(self, hostname):
-        self._hosts = [x for x in self._hosts if x["resources_available"]["vnode"] != hostname]
-        
-    def get_host(self, hostname):
-        select = [x for x in self._hosts if x["resources_available"]["vnode"].lower() == hostname.lower()]
-        assert len(select) == 1, "%s %s %s" % (select, hostname, [x["hostname"].lower() for x in self._hosts])
-        return select[0]
-        
-    def add_host(self, hostname, state="free", **resources):
-        host = {"host": hostname, "hostname": hostname, "state": state}
-        resources_assigned = resources.pop("resources_assigned", {})
-        if state == "job-busy" and not resources_assigned:
-            raise RuntimeError("define resources_assigned")
-        
-        host["resources_available"] = resources
-        host["resources_available"]["host"] = hostname.upper()
-        host["resources_available"]["vnode"] = host["resources_available"]["host"].lower() 
-        host["resources_assigned"] = resources_assigned
-        host["jobs"] = resources.pop("jobs", [])
-        host["last_state_change_time"] = time.time()
-        self._hosts.append(host)
-        
-
-class MockClustersAPI:
-    
-    def __init__(self, cluster_def, nodes=None):
-        self.cluster_def = cluster_def
-        nodes = nodes or {}
-        self._nodes = nodes
-        if not hasattr(nodes, "keys"):
-            self._nodes = {"execute": []}
-            for node in nodes:
-                # node.get_attr("instance_id", autoscale_util.uuid("instance_id"))] = node
-                self._nodes["execute"].append(node)
-        
-    def status(self, nodes=False):
-        if nodes:
-            self.cluster_def["nodes"] = nodes = []
-            for node_list in self._nodes.itervalues():
-                nodes.extend(node_list)
-        else:
-            self.cluster_def.pop("nodes", [])
-        return self.cluster_def
-    
-    def nodes(self):
-        for key in self._nodes:
-            random.shuffle(self._nodes[key])
-        return self._nodes
-    
-    def add_nodes(self, request):
-        for request_set in request["sets"]:
-            for _ in range(request_set["count"]):
-                select = [x for x in self.cluster_def["nodearrays"] if x["name"] == request_set["nodearray"]]
-                assert select, "%s not in %s" % (request_set["nodearray"], [x["name"] for x in self.cluster_def["nodearrays"]])
-                nodearray = select[0]
-                select = [b for b in nodearray["buckets"] if b["definition"] == request_set["definition"]]
-                assert select, "No matching bucket found for request %s" % request
-                mt = select[0]["virtualMachine"]
-                mt_name = select[0]["definition"]["machineType"]
-                node = Record({"vcpuCount": mt["vcpuCount"],
-                               "memory": mt["Memory"], 
-                               "machineType": mt_name,
-                               "placementGroupId": request_set.get("placementGroupId")})
-                node.update(request_set["nodeAttributes"])
-                node["nodearray"] = request_set["nodearray"]
-                node["Template"] = request_set["nodearray"]
-                node["InstanceId"] = autoscale_util.uuid("instance")
-                
-                if node["nodearray"] not in self._nodes:
-                    self._nodes[node["nodearray"]] = []
-                self._nodes[node["nodearray"]].append(node)
-                
-    def shutdown(self, instance_ids):
-        instance_ids = list(instance_ids)
-        for key in self._nodes:
-            self._nodes[key] = [x for x in self._nodes[key] if x["InstanceId"] not in instance_ids]
-
-
-def _nodearray_definitions(*machinetypes):
-    machinetypes = sorted(machinetypes, key=lambda x: -x.get("priority", 100))
-    cluster_status = {}
-    ret = {}
-    
-    for machinetype in machinetypes:
-        nodearray = machinetype.get("nodearray")
-        if nodearray not in ret:
-            ret[nodearray] = {"nodearray": {},
-                              "name": nodearray,
-                              "buckets": []}
-        
-        name = machinetype.get("machinetype")
-        ret[nodearray]["buckets"].append({"definition": {"machineType": name},
-                                          "virtualMachine": machinetype})
-
-    cluster_status["nodearrays"] = ret.values()
-    return cluster_status
-
-    
-class PBSQ:
-    
-    def __init__(self):
-        self.queues = {"workq": []}
-        self.job_id = 1
-        self.hosts = []
-    
-    def qsub(self, job_id=None, job_state="Q", J=None, select_expr=None, **resource_list):
-        assert "select" not in resource_list
-        if not job_id:
-            job_id = str(self.job_id)
-            self.job_id += 1
-            
-        jobdef = {"resource_list": {},
-                  "job_id": job_id,
-                  "job_state": job_state}
-        
-        for key, value in resource_list.iteritems():
-            jobdef["resource_list"][key] = value
-            
-        jobdef["resource_list"]["nodect"] = 1      
-            
-        if "job_state" not in jobdef:
-            jobdef["job_state"] = "Q"
-            
-        if "ncpus" not in jobdef["resource_list"]:
-            jobdef["resource_list"]["ncpus"] = jobdef.get("nodes", 1)
-        
-        if J:
-            jobdef["array"] = True
-            jobdef["array_state_count"] = J
-            
-        if select_expr:
-            jobdef["resource_list"]["select"] = select_expr
-            chunk_totals = {}
-            for chunk in pbscc.parse_select(jobdef):
-                chunk["ncpus"] = chunk.get("ncpus", 1)
-                for key, value in chunk.iteritems():
-                    if key == "select":
-                        continue
-                    try:
-                        if key == "nodect":
-                            value = pbscc.parse_gb_size(key, value)
-                        else:
-                            value = pbscc.parse_gb_size(key, value) * int(chunk["select"])
-                        chunk_totals[key] = chunk_totals.get(key, 0) + value
-                    except InvalidSizeExpressionError:
-                        chunk_totals[key] = value
-                        
-            for key, value in chunk_totals.iteritems():
-                if key != "select":
-                    jobdef["resource_list"][key] = value
-        
-        self.queues["workq"].append(jobdef)
-        
-    def qdel(self, jobid):
-        to_delete = [x for x in self.queues["workq"] if x["job_id"] == str(jobid)]
-        assert len(to_delete) >= 1
-        self.queues["workq"] = [x for x in self.queues["workq"] if x not in to_delete]
-        
-    def query_jobs(self):
-        cluster = MockClustersAPI({})
-        a = PBSAutostart(MockDriver(["workq"], self.queues), cluster, {})
-        return a.query_jobs()
-    
-    def set_running(self, job_id, exec_vnode):
-        '''
-            Testing: change the job state and set exec_vnode expression so that autoscale knows where the jobs are placed
-        '''
-        for job in chain(*self.queues.values()):
-            if str(job["job_id"]) == str(job_id):
-                job["exec_vnode"] = exec_vnode
-                job["job_state"] = "R"
-                return
-        raise AssertionError("Could not find job_id %s" % job_id)
-    
-        
 class Test(unittest.TestCase):
     def __init__(self, methodName='runTest'):
         unittest.TestCase.__init__(self, methodName=methodName)
@@ -261,11 +46,11 @@ class Test(unittest.TestCase):
                            q.query_jobs())
         
         # 4 cpus packed onto one machine and 2 exclusive
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 100, 100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 100, 100))
         self.assertEquals([self._machine_request(machine_type="a2", count=3)], self._autoscale(q, cluster_def))
         
     def test_qsub_scatter_excl(self):
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 100, 100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 100, 100))
         
         for strategy in ["scatter", "vscatter"]:
             for modifier in [":excl", ":exclhost"]:
@@ -309,7 +94,7 @@ class Test(unittest.TestCase):
                 self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
             
     def test_pbsuserguide_too_many_cpus(self):
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
         
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=33:mem=1G", place="pack", _can_be_added=False)
@@ -320,7 +105,7 @@ class Test(unittest.TestCase):
         self.assertEquals([self._machine_request(machine_type="a4", count=2)], self._autoscale(q, cluster_def))
         
     def _rebalance(self, q, cluster_def=None, hosts=None, cc_config=None):
-        cluster_def = cluster_def or _nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
+        cluster_def = cluster_def or nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
         pbs_autostart = PBSAutostart(MockDriver(jobs=q.queues, hosts=hosts), MockClustersAPI(cluster_def), cc_config or {})
         return pbs_autostart.autoscale()
     
@@ -380,7 +165,7 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="4:ncpus=1:mem=2G:arch=linux", place="free")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2win", 16, 8, 100, arch="windows"),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2win", 16, 8, 100, arch="windows"),
                                              machine.new_machinetype("execute", "a2linux", 16, 8, 100, arch="linux"))
         self.assertEquals([self._machine_request(machine_type="a2linux", count=1)], self._autoscale(q, cluster_def))
         
@@ -396,14 +181,14 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="4:dyna=1:ncpus=1:mem=3G", place="free")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 16, 8, 100),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 16, 8, 100),
                                              machine.new_machinetype("execute", "a2dyna", 16, 8, 100, dyna=4))
         # 3gb with 8gb per machine, so we need 2 machines
         self.assertEquals([self._machine_request(machine_type="a2dyna", count=2)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="4:dyna=1:ncpus=1:mem=1G", place="free")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 16, 8, 100),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 16, 8, 100),
                                              machine.new_machinetype("execute", "a2dyna", 16, 8, 100, dyna=4))
         # 1gb with 8gb per machine, so we need 1 machine
         self.assertEquals([self._machine_request(machine_type="a2dyna", count=1)], self._autoscale(q, cluster_def))
@@ -420,7 +205,7 @@ class Test(unittest.TestCase):
         q = PBSQ()
         q.qsub(select_expr="4:dyna=1, ncpus=2:mem=1G", place="free")
         dyna_license = machine.NumericValue(2, "dyna")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 8, 8, 100),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2nodyna", 8, 8, 100),
                                              machine.new_machinetype("execute", "a2dyna", 2, 8, 100, dyna=dyna_license))
         
         self.assertEquals([self._machine_request(machine_type="a2dyna", count=2)], self._autoscale(q, cluster_def))
@@ -433,13 +218,13 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="4:mem=2G:ncpus=1:arch=linux", place="scatter:excl")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, arch="linux"))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, arch="linux"))
         self.assertEquals([self._machine_request(machine_type="a2", count=4)], self._autoscale(q, cluster_def))
     
     def test_pbsuserguide_ex6_scatter(self):
         q = PBSQ()
         q.qsub(select_expr="4:mem=2G:ncpus=1:arch=linux", place="scatter")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, arch="linux"))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, arch="linux"))
         self.assertEquals([self._machine_request(machine_type="a2", count=4)], self._autoscale(q, cluster_def))
         
     def test_pbsuserguide_ex7(self):
@@ -452,10 +237,10 @@ class Test(unittest.TestCase):
         q = PBSQ()
         q.qsub(select_expr="3:ncpus=1:mem=10G:scratch=100M")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, scratch=.333))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, scratch=.333))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, scratch=.225))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 32, 128, 100, scratch=.225))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
 
     def test_pbsuserguide_ex8(self):
@@ -468,7 +253,7 @@ class Test(unittest.TestCase):
         q.qsub(select_expr="1:ncpus=2:mem=50G:host=zooland")
         
         a2_mt = machine.new_machinetype("execute", "a2", 32, 128, 100)
-        cluster_def = _nodearray_definitions(a2_mt)
+        cluster_def = nodearray_definitions(a2_mt)
         
         # pbs calls the hostname resource host, so we have to duplicate
         
@@ -484,7 +269,7 @@ class Test(unittest.TestCase):
             -lplace=scatter
         '''
         q = PBSQ()
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, swlicense=0),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, swlicense=0),
                                                 machine.new_machinetype("execute", "a4", 16, 64, 100, swlicense=1))
         q.qsub(select_expr="2:ncpus=2:mem=6G:swlicense=1", place="scatter:excl")
         self.assertEquals([self._machine_request(machine_type="a4", count=2)], self._autoscale(q, cluster_def))
@@ -501,7 +286,7 @@ class Test(unittest.TestCase):
         a2_mt = machine.new_machinetype("execute", "a2", 32, 128, 100, priority=100)
         a4_mt = machine.new_machinetype("execute", "a4", 32, 128, 100, priority=50)
         
-        cluster_def = _nodearray_definitions(a2_mt, a4_mt)
+        cluster_def = nodearray_definitions(a2_mt, a4_mt)
         
         # if there aren't any machines, request an a2 as this has the highest priority
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
@@ -523,14 +308,14 @@ class Test(unittest.TestCase):
         # for allocation testing purposes, I'm going to add a free job here too to ensure we don't try to use that one.
         q.qsub(select_expr="1:ncpus=1:mem=1G", place="free")
         q.qsub(select_expr="1:ncpus=3:mem=6G", place="pack:excl")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 24, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 24, 100, priority=100))
          
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=1:mem=1G", place="free")
         q.qsub(select_expr="3:ncpus=3:mem=6G", place="pack:excl")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 24, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 24, 100, priority=100))
         
         self.assertEquals([self._machine_request(machine_type="a2", count=3)], self._autoscale(q, cluster_def))
     
@@ -543,7 +328,7 @@ class Test(unittest.TestCase):
         '''
         #  this isn't really any different than ex11
         q = PBSQ()
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 50, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 50, 100, priority=100))
         q.qsub(select_expr="1:ncpus=1:mem=25G", place="pack:excl")
         
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
@@ -559,10 +344,10 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=10:mem=12G", place="free")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 20, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 20, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
     
     def test_pbsuserguide_ex14(self):
@@ -573,18 +358,18 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=10:mem=12G", place="scatter")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
          
         # add enough CPUs and it still requests 2 machines
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 24, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 24, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=10:mem=12G", place="scatter")
         # add another job
         q.qsub(select_expr="2:ncpus=10:mem=12G", place="scatter")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 24, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 24, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
     
     def test_pbsuserguide_ex15(self):
@@ -596,7 +381,7 @@ class Test(unittest.TestCase):
         # group=host is meaningless without existing machines... and group=host is pretty pointless.
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=10:mem=10G", place="group=host")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100, host=123))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100, host=123))
         # we ignore any group that isn't group_id
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
 #         self.assertEquals([MachineRequest("execute", "a2", 1, "")], q.autoscale_requests(cluster_def))
@@ -610,7 +395,7 @@ class Test(unittest.TestCase):
         # not really that interesting
         q = PBSQ()
         q.qsub(select_expr="10:ncpus=1:mem=1G", place="free")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
     def test_pbsuserguide_ex17(self):
@@ -622,7 +407,7 @@ class Test(unittest.TestCase):
         # not really that interesting
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=1:mem=1G", place="pack:shared")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
     def test_pbsuserguide_ex18(self):
@@ -635,7 +420,7 @@ class Test(unittest.TestCase):
         q.qsub(place="pack:excl",
                       select_expr="1:ncpus=2:mem=2G:graphics=true+1:ncpus=20:mem=20G:graphics=false")
 
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2g", 16, 10, 100, priority=100, graphics=True),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2g", 16, 10, 100, priority=100, graphics=True),
                                                 machine.new_machinetype("execute", "a2", 32, 36, 100, priority=100, graphics=False))
         
         self.assertEquals([self._machine_request(machine_type="a2", count=1),
@@ -654,7 +439,7 @@ class Test(unittest.TestCase):
         #  cbrick isn't defined
         # TODO due to the single placement group hack, cbrick is set to single for this example
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100),
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 36, 100, priority=100),
                                                 machine.new_machinetype("execute", "a2c", 16, 36, 100, priority=50, cbrick="abc"))
         cc_config = {"cyclecloud": {"placement_group": {"defaults": {"cbrick": "ccc"}}}}
         self.assertEquals([self._machine_request(machine_type="a2c", count=1, placeby="cbrick", placeby_value="ccc")], self._autoscale(q, cluster_def, cc_config=cc_config))
@@ -670,7 +455,7 @@ class Test(unittest.TestCase):
                                              placeby="group_id", group_id="def")
         a2p_abc_mt = machine.new_machinetype("execute", "a2p_abc", 16, 36, 100, priority=49,
                                              placeby="group_id", group_id="abc")
-        cluster_def = _nodearray_definitions(a2p_def_mt, a2p_abc_mt)
+        cluster_def = nodearray_definitions(a2p_def_mt, a2p_abc_mt)
         
         other_pg = self._host(a2p_abc_mt, hostname="otherpg")
         
@@ -702,7 +487,7 @@ class Test(unittest.TestCase):
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=100:mem=200G", place="pack:group=router")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2r", 100, 200, 100, priority=100,
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2r", 100, 200, 100, priority=100,
                                                                                     placeby="router", router="router-123"),
                                                 machine.new_machinetype("execute", "a2r0", 100, 200, 100, priority=100,
                                                                                     placeby="router", router="router-123"),
@@ -716,7 +501,7 @@ class Test(unittest.TestCase):
         
         self.assertEquals([MachineRequest("execute", "a2r", 5, "router-123")], q.autoscale_requests(cluster_def))
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2r", 100, 200, 100, priority=100,
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2r", 100, 200, 100, priority=100,
                                                                                      availableCount=4,
                                                                                     placeby="placement_group", placement_group="router-123"),
                                                 machine.new_machinetype("execute", "a2r0", 100, 200, 100, priority=50,
@@ -733,19 +518,19 @@ class Test(unittest.TestCase):
         q = PBSQ()
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="free")
 
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 32, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="free")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="scatter")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
 
         self.assertEquals([self._machine_request(machine_type="a2", count=10)], self._autoscale(q, cluster_def))
         
@@ -753,14 +538,14 @@ class Test(unittest.TestCase):
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="scatter")
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="scatter")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=10)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="scatter")
         q.qsub(select_expr="10:ncpus=1:mem=2G", place="scatter:excl")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 8, 32, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=20)], self._autoscale(q, cluster_def))
     
     def test_pbsuserguide_ex23(self):
@@ -771,38 +556,38 @@ class Test(unittest.TestCase):
         '''
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=2:mem=10G")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 2, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 2, 32, 100, priority=100))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100))
         self.assertEquals([], self._autoscale(q, cluster_def))
         
     def test_pack_available(self):
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=2:mem=2G", place="pack")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 4, 32, 100, priority=100, availableCount=1))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 4, 32, 100, priority=100, availableCount=1))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=2:mem=2G", place="pack")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 2, 32, 100, priority=100, availableCount=2))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 2, 32, 100, priority=100, availableCount=2))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
         
         q.qsub()
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100, availableCount=1))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100, availableCount=1))
         self.assertEquals([self._machine_request(machine_type="a2", count=1)], self._autoscale(q, cluster_def))
         
         q = PBSQ()
         q.qsub()
         q.qsub()
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100, availableCount=2))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 1, 32, 100, priority=100, availableCount=2))
         self.assertEquals([self._machine_request(machine_type="a2", count=2)], self._autoscale(q, cluster_def))
     
     def _test_live(self, live_jobstatus, expected):
         q = PBSQ()
         q.qsub(select_expr="2:ncpus=2", place="scatter:excl")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 8))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 8))
         
         mock_driver = MockDriver(["workq"], q.queues)
         mock_driver.queued_jobs = lambda: (live_jobstatus, lambda x: x)
@@ -895,7 +680,7 @@ class Test(unittest.TestCase):
             host["last_state_change_time"] = time.time()
         
         q = PBSQ()
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 8, 100, placeby="group_id", group_id="single"))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 16, 8, 100, placeby="group_id", group_id="single"))
         
         mock_driver = MockDriver(["workq"], q.queues, hosts=hosts)
         mock_driver.queued_jobs = lambda: (queued, lambda x: x)
@@ -922,7 +707,7 @@ class Test(unittest.TestCase):
         
         q.qsub(select_expr="2:ncpus=2", place="scatter:excl:group=group_id")
         
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a2", 4, 8))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a2", 4, 8))
         
         q.qsub(select_expr="2:ncpus=2", place="scatter:group=group_id")
         pbs_autostart = PBSAutostart(MockDriver(jobs=q.queues), MockClustersAPI(cluster_def), {})
@@ -938,7 +723,7 @@ class Test(unittest.TestCase):
         q.qsub(select_expr="1:ncpus=2:mem=2G:host=zooland")
         
         a2_mt = machine.new_machinetype("execute", "a2", 32, 128, 100)
-        cluster_def = _nodearray_definitions(a2_mt)
+        cluster_def = nodearray_definitions(a2_mt)
         
         zooland = self._host(hostname="zooland", machinetype=a2_mt, ncpus=32, mem=128)
         notzooland = self._host(hostname="notzooland", machinetype=a2_mt, ncpus=32, mem=128)
@@ -994,7 +779,7 @@ class Test(unittest.TestCase):
         
     def test_custom_attribute_on_booting_instance(self):
         mt = machine.new_machinetype("execute", "a2", 4, 128, 100, availableCount=1000 * 1000 * 100)
-        cluster_def = _nodearray_definitions(mt)
+        cluster_def = nodearray_definitions(mt)
         q = PBSQ()
         q.qsub(ungrouped=True)
         driver = MockDriver(jobs=q.queues)
@@ -1004,17 +789,63 @@ class Test(unittest.TestCase):
         self.assertEquals([], idle_machines)
         self.assertTrue(list(all_machines)[0].get_attr("ungrouped"))
         
+    def test_precreate_hosts(self):
+        mt = machine.new_machinetype("execute", "a2", 4, 128, 100, availableCount=1000, graphics=True, scratch=.5)
+        cluster_def = nodearray_definitions(mt)
+        driver = MockDriver(jobs=PBSQ().queues)
+        cluster = MockClustersAPI(cluster_def, nodes=[{"MachineType": "a2", "InstanceId": "123", "Template": "execute",
+                                                       "hostname": "ip-0A000004.internal.cloudapp.net"},
+                                                      # no hostname yet
+                                                      {"MachineType": "a2", "InstanceId": "124", "Template": "execute"}])
+        pbs_autostart = PBSAutostart(driver, cluster, {"pbspro.precreate_nodes": True})
+        pbs_autostart.autoscale()
+        self.assertEquals(["ip-0a000004"], [x["resources_available"]["vnode"] for x in driver._hosts])
+        host = driver.get_host("ip-0A000004")
+        self.assertEquals("state-unknown,down", host["state"])
+        self.assertEquals(PRECREATED_COMMENT, host["comment"])
+        self.assertEquals("execute", host["resources_available"]["slot_type"])
+        self.assertEquals("123", host["resources_available"]["instance_id"])
+        self.assertEquals("true", host["resources_available"]["ungrouped"])
+        self.assertFalse("group_id" in host["resources_available"])
+        # everything execute.rb would otherwise set, the core count and the custom resources as well
+        self.assertEquals(4, host["resources_available"]["ncpus"])
+        self.assertEquals("true", host["resources_available"]["graphics"])
+        self.assertEquals("512mb", host["resources_available"]["scratch"])
+        self.assertEquals(1, pbs_autostart.metrics.counters["nodes_precreated"])
+        
+        # already created
+        pbs_autostart.autoscale()
+        self.assertEquals(1, len(driver._hosts))
+        self.assertEquals(0, pbs_autostart.metrics.counters["nodes_precreated"])
+        
+        # the instance never came up and is gone from CycleCloud
+        cluster._nodes = {"execute": []}
+        pbs_autostart.autoscale()
+        self.assertEquals([], driver._hosts)
+        
     def test_no_nodearray_on_job(self):
         q = PBSQ()
         q.qsub()
         requests = self._autoscale(q)
         self.assertEquals([self._machine_request(count=1)], requests)
         
+    def test_scale_up_only(self):
+        q = PBSQ()
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
+        pbs_autostart = PBSAutostart(MockDriver(jobs=q.queues), MockClustersAPI(cluster_def), {})
+        # nothing queued, so nothing else is looked at
+        self.assertEquals(([], [], []), pbs_autostart.autoscale(scale_down=False))
+        self.assertEquals(0, pbs_autostart.metrics.phases["nodearray_fetch"])
+        
+        q.qsub()
+        self.assertEquals([self._machine_request(count=1)], pbs_autostart.autoscale(scale_down=False)[0])
+        self.assertEquals(1, pbs_autostart.metrics.counters["jobs_queued"])
+        
     def test_host_lifecycle(self):
         q = PBSQ()
         cc_config = InstanceConfig({}, {})
         q.qsub(select_expr="2:ncpus=16", place="scatter:excl:group=group_id")
-        cluster_def = _nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
         cluster = MockClustersAPI(cluster_def)
         driver = MockDriver(jobs=q.queues, hosts=[])
         
@@ -1078,6 +909,197 @@ class Test(unittest.TestCase):
         # shutdown hostname-2
         self.assertEquals(1, len(machines))
         
+    def test_compress_queued_jobs(self):
+        q = PBSQ()
+        for _ in range(3):
+            q.qsub(mem="1G", place="pack")
+        q.qsub(mem="2G", place="pack")
+        q.qsub(mem="1G", place="scatter")
+        
+        cluster = MockClustersAPI({})
+        jobs = PBSAutostart(MockDriver(["workq"], q.queues), cluster, {"pbspro.compress_jobs": True}).query_jobs()
+        self.assertEquals(["1.compressed", "4", "5"], sorted([x.name for x in jobs]))
+        self.assertEquals(3, [x for x in jobs if x.name == "1.compressed"][0].nodes)
+        
+    def test_unmatched_jobs_do_not_starve(self):
+        q = PBSQ()
+        for _ in range(5):
+            q.qsub(select_expr="1:ncpus=64", place="pack")
+        q.qsub(select_expr="1:ncpus=1", place="pack")
+        # only one unique unmatchable signature, so the last job is still considered.
+        self.assertEquals([self._machine_request(count=1)], self._autoscale(q, cc_config={"pbspro.max_unmatched_jobs": 2}))
+        
+    def test_persisted_unmatched_jobs(self):
+        tempdir = tempfile.mkdtemp()
+        unmatched_jobs_path = autostart.UNMATCHED_JOBS_PATH
+        autostart.UNMATCHED_JOBS_PATH = os.path.join(tempdir, "unmatched_jobs.json")
+        try:
+            q = PBSQ()
+            q.qsub(select_expr="1:ncpus=4", place="pack")
+            cc_config = {"pbspro.persist_unmatched_jobs": True, "cyclecloud.cluster.autoscale.start_enabled": False}
+            self.assertEquals([], self._autoscale(q, cc_config=cc_config))
+            # only unmatched because nothing could be started, so it is matched as soon as that changes
+            cc_config["cyclecloud.cluster.autoscale.start_enabled"] = True
+            self.assertEquals([self._machine_request(count=1)], self._autoscale(q, cc_config=cc_config))
+            
+            q.qsub(select_expr="1:ncpus=64", place="pack")
+            self._autoscale(q, cc_config=cc_config)
+            self.assertTrue(os.path.exists(autostart.UNMATCHED_JOBS_PATH))
+        finally:
+            autostart.UNMATCHED_JOBS_PATH = unmatched_jobs_path
+            shutil.rmtree(tempdir)
+    
+    def test_capacity_fingerprint(self):
+        mt = machine.new_machinetype("execute", "a2", 16, 8, 100)
+        nodearrays = [mt]
+        m = machine.new_machine_instance(mt, hostname="host-a", instance_id="i-1")
+        self.assertEquals(capacity_fingerprint(nodearrays, []), capacity_fingerprint(nodearrays, []))
+        self.assertNotEquals(capacity_fingerprint(nodearrays, []), capacity_fingerprint(nodearrays, [m]))
+        
+    def test_machine_index(self):
+        mt = machine.new_machinetype("execute", "a2", 16, 8, 100)
+        m = machine.new_machine_instance(mt, hostname="Host-A", instance_id="i-1", group_id="g1")
+        pbsnode = {"resources_available": {"vnode": "host-a", "host": "HOST-A", "instance_id": "i-1"}}
+        index = MachineIndex([m], {"host-a": pbsnode})
+        
+        self.assertIs(m, index.machine(hostname="HOST-A"))
+        self.assertIs(m, index.machine(hostname="unknown", instance_id="i-1"))
+        self.assertEquals(None, index.machine(hostname="unknown"))
+        self.assertEquals([m], index.machines_in_group("g1"))
+        self.assertIs(pbsnode, index.pbsnode(hostname="Host-A"))
+        self.assertIs(pbsnode, index.pbsnode(instance_id="i-1"))
+        
+    def test_node_inventory(self):
+        q = PBSQ()
+        a2_mt = machine.new_machinetype("execute", "a2", 32, 128, 100)
+        cluster_def = nodearray_definitions(a2_mt)
+        hosts = [self._host(hostname="host-%d" % n, machinetype=a2_mt, ncpus=32, mem="128gb", slot_type="execute") for n in range(3)]
+        driver = MockDriver(jobs=q.queues, hosts=hosts)
+        inventory = NodeInventory()
+        
+        def run():
+            return PBSAutostart(driver, MockClustersAPI(cluster_def), {}, node_inventory=inventory).autoscale()
+        
+        self.assertEquals(3, len(run()[1]))
+        self.assertEquals((0, 3), (inventory.hits, inventory.misses))
+        
+        hosts[0]["last_state_change_time"] = time.time() + 1
+        self.assertEquals(3, len(run()[1]))
+        self.assertEquals((2, 4), (inventory.hits, inventory.misses))
+        
+        hosts[1]["resources_available"]["slot_type"] = "other"
+        run()
+        self.assertEquals((4, 5), (inventory.hits, inventory.misses))
+        
+        driver.delete_host("host-2")
+        run()
+        self.assertEquals(["host-0", "host-1"], sorted(inventory._entries.keys()))
+        
+    def test_scale_down_only_when_over_budget(self):
+        q = PBSQ()
+        q.qsub(select_expr="1:ncpus=16", place="pack")
+        a4_mt = machine.new_machinetype("execute", "a4", 32, 100, 100)
+        cluster_def = nodearray_definitions(a4_mt)
+        host = self._host(hostname="host-0", machinetype=a4_mt, ncpus=32, slot_type="execute", instance_id="i-0")
+        host["resources_available"]["instance_id"] = "i-0"
+        host["last_state_change_time"] = time.time() - 7200
+        driver = MockDriver(jobs=q.queues, hosts=[host])
+        
+        def slow_queued_jobs():
+            time.sleep(1)
+            return [], list
+        driver.queued_jobs = slow_queued_jobs
+        
+        cluster = MockClustersAPI(cluster_def, {"execute": [{"InstanceId": "i-0", "Name": "execute-1", "Status": "Started"}]})
+        pbs_autostart = PBSAutostart(driver, cluster, {}, budget=deadline.CycleBudget(0.2))
+        machine_requests, _, _ = pbs_autostart.autoscale()
+        # the queued job is not known, so nothing is requested, and host-0 is not considered idle.
+        self.assertEquals([], machine_requests)
+        self.assertEquals("idle", host["state"])
+        
+        # with enough budget host-0 is found to be idle
+        pbs_autostart.budget = deadline.CycleBudget(5)
+        pbs_autostart.autoscale()
+        self.assertEquals("idle,offline", host["state"])
+        
+    def test_record_and_replay(self):
+        q = PBSQ()
+        q.qsub(select_expr="1:ncpus=64", place="pack")
+        a4_mt = machine.new_machinetype("execute", "a4", 32, 100, 100)
+        cluster_def = nodearray_definitions(a4_mt, machine.new_machinetype("execute", "a8", 64, 200, 100))
+        host = self._host(hostname="host-0", machinetype=a4_mt, ncpus=32, slot_type="execute", instance_id="i-0")
+        host["last_state_change_time"] = time.time() - 7200
+        driver = MockDriver(jobs=q.queues, hosts=[host])
+        cluster = MockClustersAPI(cluster_def, {"execute": [{"InstanceId": "i-0", "Name": "execute-1", "Status": "Started"}]})
+        
+        recorder = cycle_recorder.Recorder()
+        pbs_autostart = PBSAutostart(cycle_recorder.RecordingDriver(driver, recorder), cycle_recorder.RecordingClustersAPI(cluster, recorder),
+                                     cycle_recorder.RecordingConfig({}, recorder))
+        pbs_autostart = cycle_recorder.RecordingAutostart(pbs_autostart, recorder)
+        
+        # a scale up pass followed by a full one, like pbspro.multi_rate would run them
+        bundles = []
+        tempdir = tempfile.mkdtemp()
+        try:
+            for scale_down in [False, True]:
+                recorder.start()
+                pbs_autostart.autoscale(scale_down=scale_down)
+                bundles.append(cycle_recorder.load_bundle(recorder.save(tempdir)))
+        finally:
+            shutil.rmtree(tempdir)
+        
+        self.assertEquals([False, True], [x["scale_down"] for x in bundles])
+        # only queried by the first pass, the resource schema is kept
+        self.assertEquals(driver.scheduler_config(), bundles[1]["driver"]["scheduler_config"])
+        self.assertEquals(driver.resource_definitions(), bundles[1]["driver"]["resource_definitions"])
+        self.assertEquals(["add_nodes"], [x[0] for x in bundles[0]["actions"]])
+        self.assertEquals([["set_offline", "host-0"]], bundles[1]["actions"])
+        self.assertEquals("idle,offline", host["state"])
+        
+        def summarize(driver_actions, api_actions):
+            ret = [list(x) for x in driver_actions]
+            for action in api_actions:
+                if action[0] == "add_nodes":
+                    ret.append(["add_nodes", [(x["nodearray"], x["definition"]["machineType"], x["count"]) for x in action[1]["sets"]]])
+                else:
+                    ret.append(list(action))
+            return ret
+        
+        for bundle in bundles:
+            recorded_driver = [x for x in bundle["actions"] if x[0] in ["set_offline", "delete_host", "create_hosts"]]
+            recorded_api = [x for x in bundle["actions"] if x[0] in ["add_nodes", "shutdown"]]
+            replayed = cycle_recorder.replay(bundle)
+            self.assertEquals(summarize(recorded_driver, recorded_api), summarize(replayed["driver"], replayed["clusters_api"]))
+        
+    def test_cycle_metrics(self):
+        q = PBSQ()
+        for _ in range(3):
+            q.qsub(select_expr="1:ncpus=16", place="pack")
+        q.qsub(select_expr="1:ncpus=64", place="pack")
+        cluster_def = nodearray_definitions(machine.new_machinetype("execute", "a4", 32, 100, 100))
+        pbs_autostart = PBSAutostart(MockDriver(jobs=q.queues), MockClustersAPI(cluster_def), {})
+        pbs_autostart.autoscale()
+        
+        status = pbs_autostart.metrics.to_dict()
+        self.assertEquals(True, status["success"])
+        self.assertEquals({"jobs_seen": 4, "job_signatures": 2, "unmatched_jobs": 1, "machine_requests": 2},
+                          dict([(k, status["counters"][k]) for k in ["jobs_seen", "job_signatures", "unmatched_jobs", "machine_requests"]]))
+        self.assertTrue(status["phases"]["matching"] > 0)
+        
+    def test_typed_resource_conversion(self):
+        schema = pbscc.ResourceSchema(["ncpus", "mem", "slot_type", "graphics"],
+                                      {"ncpus": "long", "mem": "size", "slot_type": "string", "graphics": "boolean"})
+        self.assertEquals(4, schema.convert("ncpus", "4"))
+        self.assertEquals(2.0, schema.convert("mem", "2gb"))
+        self.assertEquals("execute", schema.convert("slot_type", "execute"))
+        self.assertEquals(True, schema.convert("slot_type", "True"))
+        self.assertEquals(False, schema.convert("graphics", "false"))
+        # undeclared resources are still probed
+        self.assertEquals(0.5, schema.convert("scratch", "512m"))
+        self.assertEquals("abc", schema.convert("arbitrary_string", "abc"))
+        # a value that doesn't match its declared type falls back to probing
+        self.assertEquals("many", schema.convert("ncpus", "many"))
+        
     def test_disable_start(self):
         q = PBSQ()
         q.qsub(select_expr="1:ncpus=16:mem=20G", place="pack")
@@ -1090,7 +1112,7 @@ class Test(unittest.TestCase):
         cc_config = InstanceConfig({}, {})
         q.qsub(select_expr="2:mem=15G+2:ncpus=4", place="group=group_id")
         
-        cluster_def = _nodearray_definitions(
+        cluster_def = nodearray_definitions(
             machine.new_machinetype("execute", "a2", 2, 16, 100),
             machine.new_machinetype("execute", "a4", 4, 8, 100))
         cluster = MockClustersAPI(cluster_def)
@@ -1118,7 +1140,7 @@ class Test(unittest.TestCase):
         cc_config = InstanceConfig({}, {})
         q.qsub(select_expr="1:ncpus=4+4:ncpus=4", place="scatter:excl:group=group_id")
         
-        cluster_def = _nodearray_definitions(
+        cluster_def = nodearray_definitions(
             machine.new_machinetype("execute", "a2", 2, 16, 100),
             machine.new_machinetype("execute", "a4", 4, 8, 100))
         cluster = MockClustersAPI(cluster_def)
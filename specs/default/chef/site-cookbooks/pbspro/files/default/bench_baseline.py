@@ -0,0 +1,70 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+The --output, --save-baseline and --baseline handling shared by autostart_bench and pbscc_bench.
+
+Results map a name to a dict of metrics, or to further results, e.g. {"1000x100": {"autoscale": {"seconds": 1.2}}}. A
+metric regresses when it is more than (1 + tolerance) times its baseline value, and, for metrics given a slack, more than
+that slack above it. Metrics missing on either side are not compared.
+'''
+import json
+import sys
+import time
+
+
+def add_arguments(parser, tolerance):
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline to this path")
+    parser.add_argument("--baseline", help="Compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=tolerance)
+
+
+def _is_measurement(result, metrics):
+    return "error" in result or any([metric in result for metric in metrics])
+
+
+def compare(results, baseline, tolerance, metrics, slack=None, path=()):
+    '''
+        Returns a list of (names, metric, baseline value, new value) for every regression beyond tolerance.
+    '''
+    slack = slack or {}
+    regressions = []
+    for name, result in results.iteritems():
+        expected = baseline.get(name)
+        if not expected or "error" in expected:
+            continue
+        if not _is_measurement(result, metrics):
+            regressions.extend(compare(result, expected, tolerance, metrics, slack, path + (name,)))
+            continue
+        if "error" in result:
+            regressions.append((path + (name,), "error", None, result["error"]))
+            continue
+        for metric in metrics:
+            actual, expected_value = result.get(metric), expected.get(metric)
+            if actual is None or expected_value is None:
+                continue
+            if actual > expected_value * (1 + tolerance) and actual - expected_value > slack.get(metric, 0):
+                regressions.append((path + (name,), metric, expected_value, actual))
+    return regressions
+
+
+def finish(args, results, metrics, slack=None, log=sys.stderr):
+    '''
+        Writes the results to --output and --save-baseline, then compares them against --baseline. Returns the exit code, 1
+        if anything regressed.
+    '''
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, "w") as fw:
+                json.dump({"recorded": time.time(), "results": results}, fw, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as fr:
+        baseline = json.load(fr)["results"]
+    regressions = compare(results, baseline, args.tolerance, metrics, slack)
+    for names, metric, expected, actual in regressions:
+        log.write("REGRESSION %s %s: %s -> %s\n" % (" ".join(names), metric, expected, actual))
+    return 1 if regressions else 0
@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import argparse
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import bench_baseline
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+    
+    def test_compare(self):
+        baseline = {"1000x100": {"autoscale": {"seconds": 1.0, "peak_growth_bytes": 1000},
+                                 "query_jobs": {"seconds": 1.0, "peak_growth_bytes": 10 * 1024 * 1024},
+                                 "compress_queued_jobs": {"error": "Traceback"}}}
+        results = {"1000x100": {"autoscale": {"seconds": 1.2, "peak_growth_bytes": 5000},
+                                "query_jobs": {"seconds": 2.0, "peak_growth_bytes": 20 * 1024 * 1024},
+                                "compress_queued_jobs": {"seconds": 100.0},
+                                "get_existing_machines": {"error": "Traceback"}},
+                   "10000x1000": {"autoscale": {"seconds": 100.0}}}
+        regressions = bench_baseline.compare(results, baseline, 0.25, ["seconds", "peak_growth_bytes"],
+                                             slack={"peak_growth_bytes": 1024 * 1024})
+        self.assertEquals([(("1000x100", "query_jobs"), "peak_growth_bytes", 10 * 1024 * 1024, 20 * 1024 * 1024),
+                           (("1000x100", "query_jobs"), "seconds", 1.0, 2.0)],
+                          sorted(regressions))
+        
+        # flat results, and metrics missing from the baseline are not compared
+        self.assertEquals([(("parse_place",), "ns_per_op", 100, 200)],
+                          bench_baseline.compare({"parse_place": {"ns_per_op": 200, "bytes_per_op": 50}},
+                                                 {"parse_place": {"ns_per_op": 100}}, 0.2, ["ns_per_op", "bytes_per_op"]))
+        self.assertEquals([(("parse_place",), "error", None, "Traceback")],
+                          bench_baseline.compare({"parse_place": {"error": "Traceback"}},
+                                                 {"parse_place": {"ns_per_op": 100}}, 0.2, ["ns_per_op"]))
+        
+    def test_finish(self):
+        parser = argparse.ArgumentParser()
+        bench_baseline.add_arguments(parser, tolerance=0.2)
+        path = os.path.join(self.tempdir, "baseline.json")
+        
+        args = parser.parse_args(["--save-baseline", path])
+        self.assertEquals(0, bench_baseline.finish(args, {"parse_place": {"ns_per_op": 100}}, ["ns_per_op"]))
+        with open(path) as fr:
+            self.assertEquals({"parse_place": {"ns_per_op": 100}}, json.load(fr)["results"])
+        
+        args = parser.parse_args(["--baseline", path])
+        log = StringIO.StringIO()
+        self.assertEquals(0, bench_baseline.finish(args, {"parse_place": {"ns_per_op": 110}}, ["ns_per_op"], log=log))
+        self.assertEquals(1, bench_baseline.finish(args, {"parse_place": {"ns_per_op": 130}}, ["ns_per_op"], log=log))
+        self.assertEquals("REGRESSION parse_place ns_per_op: 100 -> 130\n", log.getvalue())
+        
+        
+if __name__ == "__main__":
+    unittest.main()
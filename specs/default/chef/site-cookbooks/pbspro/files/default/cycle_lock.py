@@ -0,0 +1,144 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Keeps autoscale cycles from overlapping.
+
+The autoscale hook fires on a timer and on demand (see autostart_hook.py), whether or not the previous cycle has finished. Only the invocation holding the
+flock on the lock file runs a cycle. Any other invocation appends a byte to the rerun file and exits immediately, and the
+active cycle checks the rerun file when it is done and runs one extra pass if anything was appended, so however many
+triggers arrive during a cycle they are coalesced into a single pass.
+
+A trigger can still arrive after the last check but before the lock is released. Those are left in the rerun file, and
+release() returns True if there are any, so that the caller can make sure another cycle is started. Whoever acquires the
+lock next consumes them, as its cycle services them.
+
+    lock = CycleLock(path)
+    if lock.acquire():
+        try:
+            run_cycle()
+            if lock.rerun_requested():
+                run_cycle()
+        finally:
+            pending = lock.release()
+        if pending:
+            start_another_cycle_later()
+
+Counters for skipped triggers, coalesced triggers and extra passes are kept in path + ".json".
+'''
+import errno
+import fcntl
+import json
+import os
+
+import pbscc
+
+
+class CycleLock:
+
+    def __init__(self, path):
+        self.path = path
+        self.rerun_path = path + ".rerun"
+        self.metrics_path = path + ".json"
+        self._fd = None
+
+    def acquire(self, request_rerun=True):
+        '''
+            Returns True if we now hold the lock, consuming any rerun requests left over from the last cycle. Otherwise a rerun
+            is requested from the cycle holding it, unless request_rerun is False, and False is returned.
+        '''
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            os.close(fd)
+            if e.errno not in [errno.EAGAIN, errno.EACCES]:
+                raise
+            if request_rerun:
+                self._request_rerun()
+            return False
+        self._fd = fd
+        
+        # serviced by the cycle we are about to run
+        requests = self._take_rerun_requests()
+        if requests:
+            metrics = self.metrics()
+            metrics["skipped"] += requests
+            metrics["coalesced"] += requests
+            self._save_metrics(metrics)
+        return True
+
+    def _request_rerun(self):
+        # appends of a single byte are atomic, so concurrent requesters can not lose each other's requests.
+        fd = os.open(self.rerun_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, "1")
+        finally:
+            os.close(fd)
+
+    def _take_rerun_requests(self):
+        taken_path = self.rerun_path + ".taken"
+        try:
+            os.rename(self.rerun_path, taken_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return 0
+            raise
+        requests = os.path.getsize(taken_path)
+        os.remove(taken_path)
+        return requests
+
+    def rerun_requested(self):
+        '''
+            Called by the lock holder at the end of its cycle. Consumes all pending rerun requests and returns True if there were any.
+        '''
+        assert self._fd is not None, "rerun_requested() called without holding the lock"
+        requests = self._take_rerun_requests()
+        metrics = self.metrics()
+        metrics["skipped"] += requests
+        if requests:
+            metrics["coalesced"] += requests
+            metrics["extra_passes"] += 1
+        self._save_metrics(metrics)
+        return requests > 0
+
+    def metrics(self):
+        '''
+            skipped - invocations that found a cycle in flight
+            coalesced - skipped invocations that were serviced by an extra pass
+            extra_passes - extra passes run at the end of a cycle
+        '''
+        metrics = {"skipped": 0, "coalesced": 0, "extra_passes": 0}
+        if os.path.exists(self.metrics_path):
+            try:
+                with open(self.metrics_path) as fr:
+                    metrics.update(json.load(fr))
+            except Exception as e:
+                pbscc.warn("Could not read %s, resetting cycle lock metrics. Error was %s" % (self.metrics_path, str(e)))
+        return metrics
+
+    def _save_metrics(self, metrics):
+        tmp_path = self.metrics_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump(metrics, fw)
+            os.rename(tmp_path, self.metrics_path)
+        except Exception as e:
+            pbscc.warn("Could not save cycle lock metrics %s. Error was %s" % (self.metrics_path, str(e)))
+
+    def release(self):
+        '''
+            Returns True if rerun requests arrived that no pass has serviced, checked after the lock is released so that none
+            can slip in between.
+        '''
+        if self._fd is None:
+            return False
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        try:
+            return os.path.getsize(self.rerun_path) > 0
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
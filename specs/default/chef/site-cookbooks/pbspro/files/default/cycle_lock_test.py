@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import cycle_lock
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "autoscale.lock")
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+        
+    def test_coalesce(self):
+        active = cycle_lock.CycleLock(self.path)
+        self.assertTrue(active.acquire())
+        
+        # three triggers arrive while the cycle is running
+        for _ in range(3):
+            self.assertFalse(cycle_lock.CycleLock(self.path).acquire())
+        
+        self.assertTrue(active.rerun_requested())
+        # and they are serviced by a single extra pass
+        self.assertFalse(active.rerun_requested())
+        active.release()
+        
+        self.assertEquals({"skipped": 3, "coalesced": 3, "extra_passes": 1}, active.metrics())
+        
+        # the lock is free again
+        next_cycle = cycle_lock.CycleLock(self.path)
+        self.assertTrue(next_cycle.acquire())
+        self.assertFalse(next_cycle.rerun_requested())
+        next_cycle.release()
+        
+    def test_release_reports_late_requests(self):
+        active = cycle_lock.CycleLock(self.path)
+        self.assertTrue(active.acquire())
+        self.assertFalse(active.release())
+        
+        # a trigger arrives after the last rerun_requested() check
+        self.assertTrue(active.acquire())
+        self.assertFalse(active.rerun_requested())
+        self.assertFalse(cycle_lock.CycleLock(self.path).acquire())
+        self.assertTrue(active.release())
+        
+        # and is serviced by whoever takes the lock next
+        self.assertTrue(active.acquire(request_rerun=False))
+        self.assertFalse(active.rerun_requested())
+        self.assertFalse(active.release())
+        self.assertEquals({"skipped": 1, "coalesced": 1, "extra_passes": 0}, active.metrics())
+        
+        # a caller that only wants to take over does not request a rerun when it can not
+        self.assertTrue(active.acquire())
+        self.assertFalse(cycle_lock.CycleLock(self.path).acquire(request_rerun=False))
+        self.assertFalse(active.release())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Per cycle phase timings and counters for the autoscaler.
+
+PBSAutostart.autoscale() times each phase of the cycle (nodearray fetch, pbsnodes, node pre-creation, qstat, parse, compression,
+matching, scale_up, offline and delete) and counts the jobs, signatures, unmatched jobs, CycleCloud API calls and PBS commands it
+went through. At the end of every cycle they are written to a JSON status file and, optionally, to a node_exporter textfile
+collector file, both atomically, so a reader never sees a half written file.
+
+    metrics = CycleMetrics()
+    with metrics.phase("pbsnodes"):
+        driver.pbsnodes()
+    metrics.incr("jobs_seen", len(jobs))
+    metrics.write_json(path)
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pbscc
+
+
+PHASES = ["nodearray_fetch", "pbsnodes", "precreate", "qstat_running", "qstat_queued", "parse", "compression", "matching",
+          "scale_up", "offline", "delete"]
+
+COUNTERS = ["jobs_seen", "jobs_queued", "job_signatures", "unmatched_jobs", "machine_requests", "idle_machines",
+            "scale_up_requests", "scale_up_retries", "scale_up_failures", "nodes_precreated", "api_calls", "api_bytes",
+            "subprocess_forks"]
+
+_PROMETHEUS_PREFIX = "pbspro_autoscale"
+
+
+class CycleMetrics:
+    '''
+        Create one per process and call reset() at the start of every cycle - the runner and API wrappers below hold on to it.
+    '''
+
+    def __init__(self):
+        # phases and counters can be updated from deadline.gather's threads
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.finished = None
+        self.success = None
+        self.phases = OrderedDict([(name, 0.0) for name in PHASES])
+        self.counters = OrderedDict([(name, 0) for name in COUNTERS])
+        self._phase_starts = {}
+        self.extra = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase(name)
+
+    def start_phase(self, name):
+        self._phase_starts[name] = time.time()
+
+    def end_phase(self, name):
+        started = self._phase_starts.pop(name, None)
+        if started is None:
+            return
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - started
+
+    def timed(self, name, func):
+        '''
+            Wraps func so that every call to it is added to phase name.
+        '''
+        def timed_func(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed_func
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, success):
+        self.finished = time.time()
+        self.success = success
+
+    def to_dict(self):
+        finished = self.finished or time.time()
+        ret = OrderedDict()
+        ret["started"] = self.started
+        ret["finished"] = finished
+        ret["duration"] = finished - self.started
+        ret["success"] = self.success
+        ret["phases"] = self.phases
+        ret["counters"] = self.counters
+        ret.update(self.extra)
+        return ret
+
+    def to_prometheus(self):
+        status = self.to_dict()
+        lines = []
+
+        def gauge(name, help_text, samples):
+            metric = "%s_%s" % (_PROMETHEUS_PREFIX, name)
+            lines.append("# HELP %s %s" % (metric, help_text))
+            lines.append("# TYPE %s gauge" % metric)
+            for labels, value in samples:
+                lines.append("%s%s %s" % (metric, labels, _prometheus_value(value)))
+
+        gauge("last_cycle_timestamp_seconds", "Time the last autoscale cycle finished.", [("", status["finished"])])
+        gauge("last_cycle_duration_seconds", "Duration of the last autoscale cycle.", [("", status["duration"])])
+        gauge("last_cycle_success", "1 if the last autoscale cycle completed without an error.", [("", 1 if self.success else 0)])
+        gauge("phase_seconds", "Time spent in each phase of the last autoscale cycle.",
+              [('{phase="%s"}' % name, value) for name, value in self.phases.iteritems()])
+        for name, value in self.counters.iteritems():
+            gauge(name, "%s in the last autoscale cycle." % name.replace("_", " ").capitalize(), [("", value)])
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        _atomic_write(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_textfile(self, path):
+        _atomic_write(path, self.to_prometheus())
+
+
+def _prometheus_value(value):
+    if isinstance(value, bool):
+        return 1 if value else 0
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _atomic_write(path, data):
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "w") as fw:
+            fw.write(data)
+        os.rename(tmp_path, path)
+    except Exception as e:
+        pbscc.warn("Could not write autoscale metrics to %s. Error was %s" % (path, str(e)))
+
+
+class CountingRunner:
+    '''
+        Counts every command run through runner (see pbs_driver.CLIBackend) as a subprocess fork.
+    '''
+
+    def __init__(self, metrics, runner):
+        self.metrics = metrics
+        self.runner = runner
+
+    def call(self, *args, **kwargs):
+        self.metrics.incr("subprocess_forks")
+        return self.runner.call(*args, **kwargs)
+
+    def check_call(self, *args, **kwargs):
+        self.metrics.incr("subprocess_forks")
+        return self.runner.check_call(*args, **kwargs)
+
+    def close(self):
+        if hasattr(self.runner, "close"):
+            self.runner.close()
+
+
+class CountingClustersAPI:
+    '''
+        Counts calls to the CycleCloud clusters API. With count_bytes, api_bytes is the size of the responses re-encoded as
+        JSON, as the decoded responses are all we get to see. That means serializing every response again, which is why it is
+        off by default.
+    '''
+
+    def __init__(self, metrics, clusters_api, count_bytes=False):
+        self.metrics = metrics
+        self.clusters_api = clusters_api
+        self.count_bytes = count_bytes
+
+    def __getattr__(self, name):
+        attr = getattr(self.clusters_api, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.metrics.incr("api_calls")
+            ret = attr(*args, **kwargs)
+            if self.count_bytes and ret is not None:
+                try:
+                    self.metrics.incr("api_bytes", len(json.dumps(ret, default=str)))
+                except (TypeError, ValueError):
+                    pass
+            return ret
+        return counted
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cycle_metrics
+
+
+class MockRunner:
+    
+    def call(self, args, stdin_data=None, timeout=None):
+        return "", "", 0
+
+
+class MockClustersAPI:
+    
+    def status(self, nodes=False):
+        return {"nodearrays": []}
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+        
+    def test_phases_and_counters(self):
+        metrics = cycle_metrics.CycleMetrics()
+        with metrics.phase("pbsnodes"):
+            pass
+        metrics.timed("qstat_queued", lambda: None)()
+        metrics.incr("jobs_seen", 10)
+        
+        cycle_metrics.CountingRunner(metrics, MockRunner()).call(["qstat"])
+        self.assertEquals({"nodearrays": []}, cycle_metrics.CountingClustersAPI(metrics, MockClustersAPI(), count_bytes=True).status(nodes=True))
+        cycle_metrics.CountingClustersAPI(metrics, MockClustersAPI()).status()
+        metrics.finish(True)
+        
+        status = metrics.to_dict()
+        self.assertEquals(cycle_metrics.PHASES, status["phases"].keys())
+        # an empty phase can take 0.0 seconds with a coarse clock
+        self.assertTrue(status["phases"]["pbsnodes"] >= 0)
+        self.assertEquals(10, status["counters"]["jobs_seen"])
+        self.assertEquals(1, status["counters"]["subprocess_forks"])
+        self.assertEquals(2, status["counters"]["api_calls"])
+        self.assertEquals(len('{"nodearrays": []}'), status["counters"]["api_bytes"])
+        
+        metrics.reset()
+        self.assertEquals(0, metrics.counters["jobs_seen"])
+        
+    def test_write(self):
+        metrics = cycle_metrics.CycleMetrics()
+        metrics.incr("unmatched_jobs", 2)
+        metrics.finish(False)
+        
+        json_path = os.path.join(self.tempdir, "autoscale_status.json")
+        textfile_path = os.path.join(self.tempdir, "autoscale.prom")
+        metrics.write_json(json_path)
+        metrics.write_textfile(textfile_path)
+        
+        with open(json_path) as fr:
+            self.assertEquals(False, json.load(fr)["success"])
+        
+        with open(textfile_path) as fr:
+            lines = fr.read().splitlines()
+        self.assertTrue("pbspro_autoscale_unmatched_jobs 2" in lines)
+        self.assertTrue("pbspro_autoscale_last_cycle_success 0" in lines)
+        self.assertTrue('pbspro_autoscale_phase_seconds{phase="scale_up"} 0.0' in lines)
+        self.assertEquals(["autoscale.prom", "autoscale_status.json"], sorted(os.listdir(self.tempdir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
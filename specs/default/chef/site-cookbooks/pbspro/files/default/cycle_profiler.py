@@ -0,0 +1,112 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Opt-in cProfile capture of autoscale cycles.
+
+The autoscale hook runs each cycle in a throwaway subprocess, so the profiler is configured through the environment, which
+autostart_hook fills in from the hook config (autostart_profile, autostart_profile_every...) the same way as
+autostart_log_level:
+
+    AUTOSTART_PROFILE                true to enable
+    AUTOSTART_PROFILE_DIR            where the .prof files go, the cyclecloud logs directory when run from the hook
+    AUTOSTART_PROFILE_EVERY          profile every Nth cycle (default 1)
+    AUTOSTART_PROFILE_SLOWER_THAN    only keep profiles of cycles that took longer than this many seconds (default 0)
+    AUTOSTART_PROFILE_MAX_FILES      keep at most this many .prof files (default 10)
+    AUTOSTART_PROFILE_MAX_MB         and at most this many megabytes of them (default 50)
+
+The oldest profiles are removed first. Load one with `python -m pstats autoscale-20180101-120000-3.2s.prof`.
+'''
+import cProfile
+import glob
+import os
+import time
+
+import pbscc
+
+
+_PREFIX = "autoscale-"
+
+
+class CycleProfiler:
+
+    def __init__(self, directory=None, enabled=True, every=1, slower_than=0, max_files=10, max_bytes=50 * 1024 * 1024):
+        self.directory = directory or os.getcwd()
+        self.enabled = enabled
+        self.every = max(1, every)
+        self.slower_than = slower_than
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        # the cycle count has to survive between hook invocations
+        self.counter_path = os.path.join(self.directory, ".%scycles" % _PREFIX)
+
+    def _next_cycle(self):
+        cycle = 0
+        try:
+            with open(self.counter_path) as fr:
+                cycle = int(fr.read().strip() or 0)
+        except (IOError, ValueError):
+            pass
+        cycle += 1
+        try:
+            with open(self.counter_path, "w") as fw:
+                fw.write(str(cycle))
+        except IOError as e:
+            pbscc.warn("Could not save profiler cycle count to %s: %s" % (self.counter_path, str(e)))
+        return cycle
+
+    def run(self, func, *args, **kwargs):
+        '''
+            Calls func(*args, **kwargs), under cProfile if this cycle is sampled, and returns its result.
+        '''
+        if not self.enabled or self._next_cycle() % self.every != 0:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        started = time.time()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            duration = time.time() - started
+            if duration >= self.slower_than:
+                self._dump(profile, started, duration)
+
+    def _dump(self, profile, started, duration):
+        path = os.path.join(self.directory, "%s%s-%.1fs.prof" % (_PREFIX, time.strftime("%Y%m%d-%H%M%S", time.localtime(started)), duration))
+        try:
+            profile.dump_stats(path)
+            pbscc.info("Wrote profile of autoscale cycle (%.1f seconds) to %s" % (duration, path))
+        except Exception as e:
+            pbscc.warn("Could not write profile %s: %s" % (path, str(e)))
+            return
+        self.rotate()
+
+    def rotate(self):
+        profiles = []
+        for path in glob.glob(os.path.join(self.directory, "%s*.prof" % _PREFIX)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            profiles.append((stat.st_mtime, path, stat.st_size))
+
+        # newest first, keep as many as fit within max_files and max_bytes, but always the newest one.
+        profiles.sort(reverse=True)
+        kept_bytes = 0
+        for n, (_, path, size) in enumerate(profiles):
+            kept_bytes += size
+            if n > 0 and (n >= self.max_files or kept_bytes > self.max_bytes):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    pbscc.warn("Could not remove old profile %s: %s" % (path, str(e)))
+
+
+def from_environment(environ=None):
+    environ = environ if environ is not None else os.environ
+    return CycleProfiler(directory=environ.get("AUTOSTART_PROFILE_DIR"),
+                         enabled=str(environ.get("AUTOSTART_PROFILE", "false")).lower() == "true",
+                         every=int(environ.get("AUTOSTART_PROFILE_EVERY") or 1),
+                         slower_than=float(environ.get("AUTOSTART_PROFILE_SLOWER_THAN") or 0),
+                         max_files=int(environ.get("AUTOSTART_PROFILE_MAX_FILES") or 10),
+                         max_bytes=int(float(environ.get("AUTOSTART_PROFILE_MAX_MB") or 50) * 1024 * 1024))
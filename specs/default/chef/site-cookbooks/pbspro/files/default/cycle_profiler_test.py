@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import glob
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cycle_profiler
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+        
+    def _profiles(self):
+        return glob.glob(os.path.join(self.tempdir, "*.prof"))
+        
+    def test_disabled(self):
+        profiler = cycle_profiler.from_environment({"AUTOSTART_PROFILE_DIR": self.tempdir})
+        self.assertEquals(3, profiler.run(lambda x: x + 1, 2))
+        self.assertEquals([], os.listdir(self.tempdir))
+        
+    def test_every_nth_cycle(self):
+        profiler = cycle_profiler.from_environment({"AUTOSTART_PROFILE": "true", "AUTOSTART_PROFILE_DIR": self.tempdir,
+                                                    "AUTOSTART_PROFILE_EVERY": "2"})
+        self.assertEquals("a", profiler.run(lambda: "a"))
+        self.assertEquals(0, len(self._profiles()))
+        # a new process picks up the cycle count where the last one left off.
+        profiler = cycle_profiler.from_environment({"AUTOSTART_PROFILE": "true", "AUTOSTART_PROFILE_DIR": self.tempdir,
+                                                    "AUTOSTART_PROFILE_EVERY": "2"})
+        profiler.run(lambda: "a")
+        self.assertEquals(1, len(self._profiles()))
+        
+    def test_slower_than(self):
+        profiler = cycle_profiler.CycleProfiler(self.tempdir, slower_than=.1)
+        profiler.run(lambda: None)
+        self.assertEquals(0, len(self._profiles()))
+        profiler.run(time.sleep, .2)
+        self.assertEquals(1, len(self._profiles()))
+        
+    def test_rotation(self):
+        profiler = cycle_profiler.CycleProfiler(self.tempdir, max_files=2)
+        for n in range(4):
+            with open(os.path.join(self.tempdir, "autoscale-%d.prof" % n), "w") as fw:
+                fw.write("x" * 100)
+            os.utime(os.path.join(self.tempdir, "autoscale-%d.prof" % n), (n, n))
+        
+        profiler.rotate()
+        self.assertEquals(["autoscale-2.prof", "autoscale-3.prof"], sorted([os.path.basename(x) for x in self._profiles()]))
+        
+        profiler.max_bytes = 150
+        profiler.rotate()
+        self.assertEquals(["autoscale-3.prof"], [os.path.basename(x) for x in self._profiles()])
+
+
+if __name__ == "__main__":
+    unittest.main()
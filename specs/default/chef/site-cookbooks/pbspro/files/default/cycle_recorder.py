@@ -0,0 +1,379 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Records what an autoscale cycle saw, and replays it offline.
+
+With pbspro.record_cycles set to a directory, _hook wraps the driver, the ClustersAPI, the config and PBSAutostart in
+recorders, and at the end of the cycle saves a gzipped JSON bundle with:
+
+    driver        the raw qstat output of running_jobs/queued_jobs, the decoded pbsnodes -F json, scheduler_config and
+                  resource_definitions
+    clusters_api  the result of every status()/nodes() call, in order
+    config        every config key the cycle read (and nothing else, so no credentials)
+    scale_down    whether the pass was a full cycle or, with pbspro.multi_rate, a scale up only one
+    actions       the set_offline/delete_host/create_hosts/add_nodes/shutdown calls the cycle made
+
+ReplayDriver and ReplayClustersAPI have the same interface as MockDriver and MockClustersAPI in autostart_mocks and feed a
+bundle back through PBSAutostart.autoscale(), with pbsnodes timestamps shifted so that idle times are the same as when the
+cycle was recorded:
+
+    python cycle_recorder.py replay cycle-20180611-182005-042.json.gz [--profile out.prof] [--output actions.json]
+
+The replayed actions are written as JSON, so two engine versions can be compared by diffing their outputs.
+'''
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+import pbscc
+
+
+BUNDLE_VERSION = 1
+
+_CONVERTER_NAMES = {"_from_qstat": "qstat", "loads": "json"}
+
+
+class Recorder:
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        # keys read while constructing PBSAutostart, and the scheduler config and resource definitions behind its resource
+        # schema, are only read once, so carry them over to the next pass.
+        config = OrderedDict()
+        driver = OrderedDict()
+        if hasattr(self, "bundle"):
+            config = self.bundle["config"]
+            for name in ["scheduler_config", "resource_definitions"]:
+                if name in self.bundle["driver"]:
+                    driver[name] = self.bundle["driver"][name]
+        self.bundle = OrderedDict([("version", BUNDLE_VERSION),
+                                   ("recorded", time.time()),
+                                   ("driver", driver),
+                                   ("clusters_api", OrderedDict()),
+                                   ("config", config),
+                                   ("scale_down", True),
+                                   ("actions", [])])
+
+    # outputs are copied as they are recorded, the cycle may still change them, e.g. the node dicts of pbsnodes.
+    def driver_output(self, name, value):
+        self.bundle["driver"][name] = deepcopy(value)
+
+    def api_output(self, name, kwargs, value):
+        self.bundle["clusters_api"].setdefault(name, []).append({"kwargs": kwargs, "result": deepcopy(value)})
+
+    def pass_mode(self, scale_down):
+        self.bundle["scale_down"] = scale_down
+
+    def action(self, name, *args):
+        self.bundle["actions"].append([name] + list(args))
+
+    def save(self, directory, keep=10):
+        recorded = self.bundle["recorded"]
+        path = os.path.join(directory, "cycle-%s-%03d.json.gz" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(recorded)), int(recorded * 1000) % 1000))
+        try:
+            with gzip.open(path + ".tmp", "wb") as fw:
+                json.dump(self.bundle, fw, default=str)
+            os.rename(path + ".tmp", path)
+            pbscc.info("Recorded autoscale cycle to %s", path)
+        except Exception as e:
+            pbscc.warn("Could not record autoscale cycle to %s: %s", path, str(e))
+            return None
+
+        for old_path in sorted(glob.glob(os.path.join(directory, "cycle-*.json.gz")))[:-keep]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        return path
+
+
+class RecordingDriver:
+    '''
+        Wraps a PBSDriver, recording its outputs and the actions taken on it.
+    '''
+
+    def __init__(self, driver, recorder):
+        self.driver = driver
+        self.recorder = recorder
+
+    def _jobs(self, name, output, converter):
+        converter_name = _CONVERTER_NAMES.get(getattr(converter, "__name__", None))
+        if converter_name:
+            self.recorder.driver_output(name, {"format": converter_name, "output": output})
+        else:
+            # the ifl backend returns records, not strings.
+            output = converter(output)
+            converter = list
+            self.recorder.driver_output(name, {"format": "records", "output": output})
+        return output, converter
+
+    def running_jobs(self):
+        return self._jobs("running_jobs", *self.driver.running_jobs())
+
+    def queued_jobs(self):
+        return self._jobs("queued_jobs", *self.driver.queued_jobs())
+
+    def pbsnodes(self, grouping=None):
+        ret = self.driver.pbsnodes(grouping)
+        if not grouping:
+            self.recorder.driver_output("pbsnodes", ret.get(None))
+        return ret
+
+    def scheduler_config(self):
+        ret = self.driver.scheduler_config()
+        self.recorder.driver_output("scheduler_config", ret)
+        return ret
+
+    def resource_definitions(self):
+        ret = self.driver.resource_definitions()
+        self.recorder.driver_output("resource_definitions", ret)
+        return ret
+
+    def set_offline(self, hostname):
+        self.recorder.action("set_offline", hostname)
+        return self.driver.set_offline(hostname)
+
+    def delete_host(self, hostname):
+        self.recorder.action("delete_host", hostname)
+        return self.driver.delete_host(hostname)
+
+    def create_hosts(self, hosts):
+        self.recorder.action("create_hosts", hosts)
+        return self.driver.create_hosts(hosts)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class RecordingClustersAPI:
+
+    def __init__(self, clusters_api, recorder):
+        self.clusters_api = clusters_api
+        self.recorder = recorder
+
+    def status(self, nodes=False):
+        ret = self.clusters_api.status(nodes=nodes)
+        self.recorder.api_output("status", {"nodes": nodes}, ret)
+        return ret
+
+    def nodes(self):
+        ret = self.clusters_api.nodes()
+        self.recorder.api_output("nodes", {}, ret)
+        return ret
+
+    def add_nodes(self, request):
+        self.recorder.action("add_nodes", request)
+        return self.clusters_api.add_nodes(request)
+
+    def shutdown(self, instance_ids):
+        instance_ids = list(instance_ids)
+        self.recorder.action("shutdown", instance_ids)
+        return self.clusters_api.shutdown(instance_ids)
+
+    def __getattr__(self, name):
+        return getattr(self.clusters_api, name)
+
+
+class RecordingConfig:
+    '''
+        Records every key the cycle reads, with the value it got.
+    '''
+
+    def __init__(self, cc_config, recorder):
+        self.cc_config = cc_config
+        self.recorder = recorder
+
+    def get(self, key, default=None):
+        value = self.cc_config.get(key, default)
+        self.recorder.bundle["config"][key] = value
+        return value
+
+
+class RecordingAutostart:
+    '''
+        Wraps a PBSAutostart, recording whether each pass scales down so that the replay runs it the same way.
+    '''
+
+    def __init__(self, autostart, recorder):
+        self.autostart = autostart
+        self.recorder = recorder
+
+    def autoscale(self, scale_down=True):
+        self.recorder.pass_mode(scale_down)
+        return self.autostart.autoscale(scale_down=scale_down)
+
+    def __getattr__(self, name):
+        return getattr(self.autostart, name)
+
+
+def load_bundle(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as fr:
+        bundle = json.load(fr, object_pairs_hook=OrderedDict)
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise RuntimeError("Unsupported bundle version %s in %s" % (bundle.get("version"), path))
+    return bundle
+
+
+def _converter(format_name):
+    if format_name == "qstat":
+        import pbs_driver
+        return pbs_driver._from_qstat
+    if format_name == "json":
+        return json.loads
+    return list
+
+
+class ReplayDriver:
+    '''
+        Same interface as autostart_mocks.MockDriver. The actions taken are kept in actions.
+    '''
+
+    def __init__(self, bundle, now=None):
+        self.bundle = bundle
+        self.actions = []
+        # shift the node timestamps so that idle times are the same as when recorded
+        self.time_shift = (now or time.time()) - bundle["recorded"]
+
+    def queues(self):
+        return ["workq"]
+
+    def _jobs(self, name):
+        recorded = self.bundle["driver"].get(name) or {"format": "records", "output": []}
+        return recorded["output"], _converter(recorded["format"])
+
+    def running_jobs(self):
+        return self._jobs("running_jobs")
+
+    def queued_jobs(self):
+        return self._jobs("queued_jobs")
+
+    def scheduler_config(self):
+        return self.bundle["driver"]["scheduler_config"]
+
+    def resource_definitions(self):
+        return self.bundle["driver"].get("resource_definitions", {})
+
+    def pbsnodes(self, grouping=None):
+        nodes = {}
+        for name, node in (self.bundle["driver"].get("pbsnodes") or {}).iteritems():
+            node = dict(node)
+            for key in ["last_state_change_time", "last_used_time"]:
+                if key in node:
+                    node[key] = node[key] + self.time_shift
+            nodes[name] = node
+
+        if not grouping:
+            return {None: nodes}
+
+        ret = {}
+        for name, node in nodes.iteritems():
+            ret.setdefault(node["resources_available"].get(grouping), {})[name] = node
+        return ret
+
+    def set_offline(self, hostname):
+        self.actions.append(["set_offline", hostname])
+
+    def delete_host(self, hostname):
+        self.actions.append(["delete_host", hostname])
+
+    def create_hosts(self, hosts):
+        self.actions.append(["create_hosts", hosts])
+        return []
+
+    def close(self):
+        pass
+
+
+class ReplayClustersAPI:
+    '''
+        Same interface as autostart_mocks.MockClustersAPI. Calls return the recorded results in order, repeating the last one
+        if the cycle makes more calls than were recorded.
+    '''
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.actions = []
+        self._calls = {}
+
+    def _next(self, name):
+        recorded = self.bundle["clusters_api"].get(name)
+        if not recorded:
+            raise RuntimeError("No %s calls were recorded" % name)
+        n = self._calls.get(name, 0)
+        self._calls[name] = n + 1
+        return recorded[min(n, len(recorded) - 1)]["result"]
+
+    def status(self, nodes=False):
+        return self._next("status")
+
+    def nodes(self):
+        return self._next("nodes")
+
+    def add_nodes(self, request):
+        self.actions.append(["add_nodes", request])
+
+    def shutdown(self, instance_ids):
+        self.actions.append(["shutdown", list(instance_ids)])
+
+
+def replay(bundle, profile_path=None):
+    '''
+        Runs a recorded cycle through PBSAutostart.autoscale(), as a full or scale up only pass like it was recorded, and
+        returns the actions it took.
+    '''
+    from autostart import PBSAutostart
+    from cyclecloud import autoscale_util
+
+    autoscale_util.set_uuid_func(autoscale_util.IncrementingUUID())
+    driver = ReplayDriver(bundle)
+    clusters_api = ReplayClustersAPI(bundle)
+    autostart = PBSAutostart(driver, clusters_api, dict(bundle["config"]))
+    # bundles recorded before the mode was recorded are full cycles
+    scale_down = bundle.get("scale_down", True)
+
+    if profile_path:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.runcall(autostart.autoscale, scale_down=scale_down)
+        profile.dump_stats(profile_path)
+    else:
+        autostart.autoscale(scale_down=scale_down)
+
+    return OrderedDict([("driver", driver.actions),
+                        ("clusters_api", clusters_api.actions),
+                        ("metrics", autostart.metrics.to_dict())])
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a recorded autoscale cycle")
+    subparsers = parser.add_subparsers(dest="command")
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("bundle")
+    replay_parser.add_argument("--profile", help="Write a cProfile of the replayed cycle to this path")
+    replay_parser.add_argument("--output", help="Write the actions taken as JSON to this path instead of stdout")
+    args = parser.parse_args(argv)
+
+    result = replay(load_bundle(args.bundle), args.profile)
+    # timings differ run to run, only the actions are meant to be diffed.
+    result.pop("metrics")
+    output = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as fw:
+            fw.write(output)
+    else:
+        print output
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cycle_recorder
+
+
+class FakeDriver:
+
+    def __init__(self):
+        self.offline = []
+
+    def running_jobs(self):
+        return '[{"job_id": "1"}]', json.loads
+
+    def queued_jobs(self):
+        # like the ifl backend, records rather than a string
+        return [{"job_id": "2"}], list
+
+    def pbsnodes(self, grouping=None):
+        return {None: {"ip-1": {"resources_available": {"group_id": "g1"}, "last_state_change_time": 1000}}}
+
+    def scheduler_config(self):
+        return {"resources": ["ncpus", "mem"]}
+
+    def set_offline(self, hostname):
+        self.offline.append(hostname)
+
+    def close(self):
+        pass
+
+
+class FakeClustersAPI:
+
+    def __init__(self):
+        self.status_calls = 0
+
+    def status(self, nodes=False):
+        self.status_calls += 1
+        return {"nodearrays": [], "call": self.status_calls}
+
+    def shutdown(self, instance_ids):
+        pass
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def test_record_and_replay(self):
+        recorder = cycle_recorder.Recorder()
+        driver = cycle_recorder.RecordingDriver(FakeDriver(), recorder)
+        clusters_api = cycle_recorder.RecordingClustersAPI(FakeClustersAPI(), recorder)
+        cc_config = cycle_recorder.RecordingConfig({"pbspro.compress_jobs": True, "cyclecloud.config.password": "secret"}, recorder)
+
+        output, converter = driver.running_jobs()
+        self.assertEquals([{"job_id": "1"}], converter(output))
+        output, converter = driver.queued_jobs()
+        self.assertEquals([{"job_id": "2"}], converter(output))
+        driver.pbsnodes()
+        driver.scheduler_config()
+        clusters_api.status(nodes=True)
+        clusters_api.status()
+        self.assertTrue(cc_config.get("pbspro.compress_jobs"))
+        self.assertEquals(300, cc_config.get("pbspro.remove_down_nodes", 300))
+        driver.set_offline("ip-1")
+        clusters_api.shutdown(iter(["i-1"]))
+        # unrecorded calls still go through
+        driver.close()
+
+        path = recorder.save(self.tempdir)
+        self.assertTrue(path.endswith(".json.gz"))
+        bundle = cycle_recorder.load_bundle(path)
+
+        # only the keys that were read
+        self.assertEquals({"pbspro.compress_jobs": True, "pbspro.remove_down_nodes": 300}, dict(bundle["config"]))
+        self.assertEquals([["set_offline", "ip-1"], ["shutdown", ["i-1"]]], bundle["actions"])
+
+        replay_driver = cycle_recorder.ReplayDriver(bundle, now=bundle["recorded"] + 60)
+        output, converter = replay_driver.running_jobs()
+        self.assertEquals([{"job_id": "1"}], converter(output))
+        output, converter = replay_driver.queued_jobs()
+        self.assertEquals([{"job_id": "2"}], converter(output))
+        self.assertEquals({"resources": ["ncpus", "mem"]}, replay_driver.scheduler_config())
+        # timestamps are shifted by however long ago the cycle was recorded
+        self.assertEquals(1060, replay_driver.pbsnodes()[None]["ip-1"]["last_state_change_time"])
+        self.assertEquals(["ip-1"], replay_driver.pbsnodes("group_id")["g1"].keys())
+
+        replay_api = cycle_recorder.ReplayClustersAPI(bundle)
+        self.assertEquals(1, replay_api.status(nodes=True)["call"])
+        self.assertEquals(2, replay_api.status()["call"])
+        # past the end of the recording, the last result repeats
+        self.assertEquals(2, replay_api.status()["call"])
+        self.assertRaises(RuntimeError, replay_api.nodes)
+
+        replay_driver.set_offline("ip-1")
+        replay_api.shutdown(["i-1"])
+        self.assertEquals([["set_offline", "ip-1"]], replay_driver.actions)
+        self.assertEquals([["shutdown", ["i-1"]]], replay_api.actions)
+
+    def test_config_survives_passes(self):
+        recorder = cycle_recorder.Recorder()
+        cc_config = cycle_recorder.RecordingConfig({"pbspro.memory_monitor": True}, recorder)
+        cc_config.get("pbspro.memory_monitor")
+        driver = cycle_recorder.RecordingDriver(FakeDriver(), recorder)
+        driver.scheduler_config()
+        driver.pbsnodes()
+        recorder.action("set_offline", "ip-1")
+        recorder.start()
+        self.assertEquals({"pbspro.memory_monitor": True}, dict(recorder.bundle["config"]))
+        self.assertEquals({"scheduler_config": {"resources": ["ncpus", "mem"]}}, dict(recorder.bundle["driver"]))
+        self.assertEquals([], recorder.bundle["actions"])
+
+    def test_pass_mode(self):
+        class FakeAutostart:
+            metrics = "metrics"
+
+            def autoscale(self, scale_down=True):
+                return scale_down
+
+        recorder = cycle_recorder.Recorder()
+        autostart = cycle_recorder.RecordingAutostart(FakeAutostart(), recorder)
+        self.assertEquals(True, recorder.bundle["scale_down"])
+        self.assertEquals(False, autostart.autoscale(scale_down=False))
+        self.assertEquals(False, recorder.bundle["scale_down"])
+        self.assertEquals("metrics", autostart.metrics)
+        recorder.start()
+        self.assertEquals(True, recorder.bundle["scale_down"])
+
+    def test_keep(self):
+        for n in range(5):
+            recorder = cycle_recorder.Recorder()
+            recorder.bundle["recorded"] = 1500000000 + n
+            recorder.save(self.tempdir, keep=3)
+        self.assertEquals(3, len(os.listdir(self.tempdir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Runs the parts of the autoscale cycle at different rates.
+
+A full cycle re-reads the nodearray definitions, pbsnodes and every job, scales up, and evaluates idle nodes, at one fixed
+cadence. With pbspro.multi_rate enabled it is split into three loops instead:
+
+    scale_up    queued demand only - stops after one qstat when nothing is queued, and does not scale down
+    scale_down  the full cycle, including idle detection, offlining and deletes
+    refresh     re-reads the nodearray definitions, which the other loops otherwise take from CachedStatusAPI
+
+Each loop is due every interval seconds. A loop that found nothing to do backs its interval off by backoff, up to
+max_interval, and drops straight back to interval once it is active again. A run that was triggered does not back off: the
+submit hook signals demand before the job is queued, so the triggered pass may well find nothing yet. The loops are kept on a timer heap ordered by when
+they are next due:
+
+    schedule = Schedule([Loop("scale_up", 15, 60), Loop("scale_down", 60, 300), Loop("refresh", 300)], path)
+    for name in schedule.due():
+        active = run(name)
+        schedule.done(name, active)
+    schedule.save()
+
+An autoscale process only lives for one hook firing, so the heap is saved to path between runs. autostart_hook.py reads
+next_due from the same file to decide whether to start a process at all.
+'''
+import heapq
+import json
+import os
+import time
+
+import pbscc
+
+
+class Loop:
+
+    def __init__(self, name, interval, max_interval=None, backoff=2.0):
+        self.name = name
+        self.interval = float(interval)
+        self.max_interval = float(max_interval or interval)
+        self.backoff = backoff
+        self.current_interval = self.interval
+        self.triggered = False
+
+
+class Schedule:
+    '''
+        A loop that has never run is due immediately.
+    '''
+
+    def __init__(self, loops, path=None, clock=time.time):
+        self.loops = dict([(loop.name, loop) for loop in loops])
+        self.path = path
+        self.clock = clock
+        now = clock()
+        # (due, name)
+        self._heap = [(now, loop.name) for loop in loops]
+        if path:
+            self._load()
+        heapq.heapify(self._heap)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fr:
+                persisted = json.load(fr).get("loops", {})
+        except Exception as e:
+            pbscc.warn("Could not load autoscale schedule %s, running every loop now. Error was %s" % (self.path, str(e)))
+            return
+
+        heap = []
+        for due, name in self._heap:
+            if name in persisted:
+                loop = self.loops[name]
+                # the intervals may have been reconfigured since
+                loop.current_interval = min(loop.max_interval, max(loop.interval, persisted[name]["interval"]))
+                due = min(persisted[name]["due"], self.clock() + loop.current_interval)
+            heap.append((due, name))
+        self._heap = heap
+
+    def due(self, now=None):
+        '''
+            Pops and returns the names of the loops that are due, soonest first. Each must be handed back with done().
+        '''
+        now = now or self.clock()
+        ret = []
+        while self._heap and self._heap[0][0] <= now:
+            ret.append(heapq.heappop(self._heap)[1])
+        return ret
+
+    def done(self, name, active, now=None):
+        loop = self.loops[name]
+        if active or loop.triggered:
+            loop.current_interval = loop.interval
+        else:
+            loop.current_interval = min(loop.max_interval, loop.current_interval * loop.backoff)
+        loop.triggered = False
+        self._push(name, (now or self.clock()) + loop.current_interval)
+
+    def trigger(self, name, now=None):
+        '''
+            Makes the loop due now, at its base interval, which it keeps after this run even if it was not active.
+        '''
+        self.loops[name].current_interval = self.loops[name].interval
+        self.loops[name].triggered = True
+        self._push(name, now or self.clock())
+
+    def _push(self, name, due):
+        self._heap = [x for x in self._heap if x[1] != name]
+        heapq.heapify(self._heap)
+        heapq.heappush(self._heap, (due, name))
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def save(self):
+        if not self.path:
+            return
+        loops = {}
+        for due, name in self._heap:
+            loops[name] = {"due": due, "interval": self.loops[name].current_interval}
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump({"next_due": self.next_due(), "loops": loops}, fw)
+            os.rename(tmp_path, self.path)
+        except Exception as e:
+            pbscc.warn("Could not save autoscale schedule %s. Error was %s" % (self.path, str(e)))
+
+
+class CachedStatusAPI:
+    '''
+        Serves the cluster status (without nodes), which is where the nodearray definitions come from, from path instead of
+        asking CycleCloud every cycle. Call refresh() to fetch and save it again. Everything else goes to clusters_api.
+    '''
+
+    def __init__(self, clusters_api, path):
+        self.clusters_api = clusters_api
+        self.path = path
+        self._stale = not os.path.exists(path)
+
+    def refresh(self):
+        self._stale = True
+
+    def status(self, nodes=False):
+        if nodes:
+            return self.clusters_api.status(nodes=True)
+
+        if not self._stale:
+            try:
+                with open(self.path) as fr:
+                    return json.load(fr)
+            except Exception as e:
+                pbscc.warn("Could not load cached cluster status %s, fetching it again. Error was %s" % (self.path, str(e)))
+
+        ret = self.clusters_api.status()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump(ret, fw)
+            os.rename(tmp_path, self.path)
+            self._stale = False
+        except Exception as e:
+            pbscc.warn("Could not cache cluster status %s. Error was %s" % (self.path, str(e)))
+        return ret
+
+    def __getattr__(self, name):
+        return getattr(self.clusters_api, name)
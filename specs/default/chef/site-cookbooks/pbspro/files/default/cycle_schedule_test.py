@@ -0,0 +1,114 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cycle_schedule
+
+
+class FakeClustersAPI:
+
+    def __init__(self):
+        self.calls = []
+
+    def status(self, nodes=False):
+        self.calls.append(nodes)
+        return {"nodearrays": [{"name": "execute"}], "call": len(self.calls)}
+
+    def shutdown(self, instance_ids):
+        return instance_ids
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.now = 1000.0
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def schedule(self, path=None):
+        return cycle_schedule.Schedule([cycle_schedule.Loop("scale_up", 15, 60),
+                                        cycle_schedule.Loop("scale_down", 60, 300),
+                                        cycle_schedule.Loop("refresh", 300)], path, clock=lambda: self.now)
+
+    def test_due_and_backoff(self):
+        schedule = self.schedule()
+        self.assertEquals(["refresh", "scale_down", "scale_up"], sorted(schedule.due()))
+        self.assertEquals([], schedule.due())
+        schedule.done("scale_up", False)
+        schedule.done("scale_down", True)
+        schedule.done("refresh", True)
+        # idle scale up backs off from 15 to 30 seconds
+        self.assertEquals(1030, schedule.next_due())
+
+        self.now = 1030
+        self.assertEquals(["scale_up"], schedule.due())
+        schedule.done("scale_up", False)
+        # capped at max_interval
+        self.assertEquals(60, schedule.loops["scale_up"].current_interval)
+        self.now = 1060
+        self.assertEquals(["scale_down"], schedule.due())
+        schedule.done("scale_down", False)
+        self.assertEquals(1090, schedule.next_due())
+
+        # demand brings it back to its base interval
+        schedule.trigger("scale_up")
+        self.assertEquals(["scale_up"], schedule.due())
+        schedule.done("scale_up", True)
+        self.assertEquals(1075, schedule.next_due())
+
+        # the job that triggered it may not be queued yet, so that does not count as idle
+        schedule.trigger("scale_up")
+        self.assertEquals(["scale_up"], schedule.due())
+        schedule.done("scale_up", False)
+        self.assertEquals(15, schedule.loops["scale_up"].current_interval)
+        # but the next run that finds nothing does
+        self.now = 1075
+        self.assertEquals(["scale_up"], schedule.due())
+        schedule.done("scale_up", False)
+        self.assertEquals(30, schedule.loops["scale_up"].current_interval)
+
+    def test_persisted(self):
+        path = os.path.join(self.tempdir, "schedule.json")
+        schedule = self.schedule(path)
+        for name in schedule.due():
+            schedule.done(name, name != "scale_up")
+        schedule.save()
+        self.assertEquals(1030, json.load(open(path))["next_due"])
+
+        self.now = 1031
+        schedule = self.schedule(path)
+        self.assertEquals(["scale_up"], schedule.due())
+        schedule.done("scale_up", False)
+        self.assertEquals(60, schedule.loops["scale_up"].current_interval)
+        schedule.save()
+
+        # a schedule saved with longer intervals than are now configured is pulled in
+        loops = cycle_schedule.Schedule([cycle_schedule.Loop("scale_up", 5, 10)], path, clock=lambda: self.now)
+        self.assertEquals(1041, loops.next_due())
+
+    def test_cached_status(self):
+        path = os.path.join(self.tempdir, "status.json")
+        clusters_api = FakeClustersAPI()
+        cached = cycle_schedule.CachedStatusAPI(clusters_api, path)
+        self.assertEquals(1, cached.status()["call"])
+        self.assertEquals(1, cached.status()["call"])
+        # served from the file in later processes too
+        self.assertEquals(1, cycle_schedule.CachedStatusAPI(clusters_api, path).status()["call"])
+        self.assertEquals(2, cached.status(nodes=True)["call"])
+        cached.refresh()
+        self.assertEquals(3, cached.status()["call"])
+        self.assertEquals([False, True, False], clusters_api.calls)
+        self.assertEquals(["i-1"], cached.shutdown(["i-1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Deadlines for the autoscale cycle.
+
+A CycleBudget is the wall clock time an autoscale cycle may take. Every PBS command run through a DeadlineRunner is
+killed once it exceeds min(its own timeout, what is left of the budget), and gather() runs several independent queries
+(qstat, pbsnodes, the nodearray definitions...) at once, waiting no longer than the budget allows.
+
+    budget = CycleBudget(120, reserve=30)
+    runner = DeadlineRunner(budget, timeout=60, max_concurrency=4)
+    driver = pbs_driver.PBSDriver(bin_dir, runner=runner)
+    results = gather(budget, [("running_jobs", driver.running_jobs), ("pbsnodes", driver.pbsnodes)])
+
+The last reserve seconds of the budget are held back until release_reserve() is called, so that a cycle whose queries
+ran out of time still has time left to scale down.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+import fork_server
+
+
+class DeadlineExceededError(RuntimeError):
+    pass
+
+
+class CycleBudget:
+    '''
+        seconds is the total budget for a cycle, None or 0 for no limit. Call reset() at the start of each cycle.
+    '''
+
+    def __init__(self, seconds=None, reserve=0):
+        self.seconds = seconds or None
+        self.reserve = min(reserve or 0, self.seconds or 0)
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.reserve_released = False
+
+    def limited(self):
+        return self.seconds is not None
+
+    def release_reserve(self):
+        self.reserve_released = True
+
+    def remaining(self):
+        '''
+            Seconds left in the budget, or None if it is unlimited.
+        '''
+        if self.seconds is None:
+            return None
+        held_back = 0 if self.reserve_released else self.reserve
+        return max(0, self.seconds - held_back - (time.time() - self.started))
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def timeout(self, timeout=None):
+        '''
+            The timeout to use for the next call - the smaller of timeout and the remaining budget.
+            Raises DeadlineExceededError if the budget is spent.
+        '''
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining == 0:
+            raise DeadlineExceededError("Cycle budget of %s seconds exceeded" % self.seconds)
+        if timeout:
+            return min(timeout, remaining)
+        return remaining
+
+
+class DeadlineRunner:
+    '''
+        Runs commands through runner (anything with call(args, stdin_data, timeout), defaults to running them directly),
+        with at most max_concurrency commands at a time. A command that hits its deadline is killed and
+        DeadlineExceededError is raised, rather than returning a timeout exit code that the caller would treat as a PBS error.
+    '''
+
+    def __init__(self, budget, runner=None, timeout=None, max_concurrency=4):
+        self.budget = budget
+        self.runner = runner or fork_server
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def call(self, args, stdin_data=None, timeout=None):
+        with self._slots:
+            timeout = self.budget.timeout(timeout or self.timeout)
+            started = time.time()
+            stdout, stderr, code = self.runner.call(args, stdin_data, timeout)
+            if code == fork_server.TIMEOUT_EXIT_CODE and timeout and time.time() - started >= timeout:
+                raise DeadlineExceededError("%s did not complete within %.1f seconds" % (args, timeout))
+            return stdout, stderr, code
+
+    def check_call(self, args, stdin_data=None, timeout=None):
+        stdout, stderr, code = self.call(args, stdin_data, timeout)
+        if code != 0:
+            raise RuntimeError("%s failed with exit code %s: %s" % (args, code, stderr))
+        return stdout
+
+    def close(self):
+        if hasattr(self.runner, "close"):
+            self.runner.close()
+
+
+class _Call(threading.Thread):
+
+    def __init__(self, func):
+        threading.Thread.__init__(self)
+        # a call we gave up on must not keep the process alive.
+        self.daemon = True
+        self.func = func
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func()
+        except BaseException as e:
+            # including SystemExit, e.g. from tandem_utils.error_and_exit, which the caller re-raises as it would have been.
+            self.error = e
+
+
+def gather(budget, calls, concurrent=True):
+    '''
+        Runs each (name, func) in calls and returns an OrderedDict of name -> (result, error), where error is the exception
+        func raised, or a DeadlineExceededError if it did not return before the budget ran out.
+
+        The funcs run in their own threads when concurrent is true. A thread still running at the deadline is abandoned;
+        any command it is running is killed by its DeadlineRunner timeout, so it will not outlive the deadline for long.
+    '''
+    results = OrderedDict()
+    if not concurrent:
+        for name, func in calls:
+            try:
+                budget.timeout()
+                results[name] = (func(), None)
+            except Exception as e:
+                results[name] = (None, e)
+        return results
+
+    threads = []
+    for name, func in calls:
+        thread = _Call(func)
+        thread.start()
+        threads.append((name, thread))
+
+    for name, thread in threads:
+        thread.join(budget.remaining())
+        if thread.is_alive():
+            results[name] = (None, DeadlineExceededError("%s did not complete within the cycle budget" % name))
+        else:
+            results[name] = (thread.result, thread.error)
+    return results
@@ -0,0 +1,232 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+A pre-forked helper process that runs commands (qstat, pbsnodes, qmgr, qalter...) on behalf of the autoscaler.
+
+Forking a process with a large heap is expensive, so the helper is forked once, early, while the parent is still small, and
+every later command is forked from the helper instead. Requests and responses are pickled messages over a pair of pipes;
+stdout and stderr are streamed back in chunks as the command produces them, followed by the exit code.
+
+    server = ForkServer(timeout=120)
+    stdout, stderr, code = server.call(["qstat", "-f"])
+
+call() has the same signature and return value as tandem_utils.call, so it can be used as a CLIBackend runner.
+
+The helper runs one command at a time, and call() holds a lock for the whole command, so commands issued concurrently
+(deadline.gather, or scale_up's worker threads if they ever run PBS commands) are serialized while a ForkServer is in use.
+'''
+import cPickle
+import errno
+import os
+import select
+import struct
+import subprocess
+import threading
+import time
+
+import pbscc
+
+
+# same exit code as coreutils' timeout
+TIMEOUT_EXIT_CODE = 124
+
+_HEADER = struct.Struct("!I")
+
+
+def _write_message(fd, message):
+    data = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+    data = _HEADER.pack(len(data)) + data
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _read_exactly(fd, size):
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
+def _read_message(fd):
+    header = _read_exactly(fd, _HEADER.size)
+    if header is None:
+        return None
+    data = _read_exactly(fd, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return cPickle.loads(data)
+
+
+def _run_command(args, stdin_data, timeout, emit):
+    '''
+        Runs args, calling emit(("out" | "err", chunk)) as output arrives and finally emit(("exit", code, message)).
+        The command is killed if it runs longer than timeout seconds.
+    '''
+    try:
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE if stdin_data else None, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True, shell=isinstance(args, basestring))
+    except OSError as e:
+        emit(("exit", 127, "Could not run %s: %s" % (args, str(e))))
+        return
+
+    deadline = time.time() + timeout if timeout else None
+    streams = {proc.stdout.fileno(): "out", proc.stderr.fileno(): "err"}
+    # stdin is written as the pipe has room, interleaved with reading the output, so that a command that writes more than a
+    # pipe's worth of output before it has read all of its input (i.e. qmgr running a long script) can not deadlock.
+    stdin_fds = [proc.stdin.fileno()] if stdin_data else []
+    stdin_offset = 0
+    timed_out = False
+
+    while streams or stdin_fds:
+        wait = None if deadline is None else max(0, deadline - time.time())
+        readable, writable, _ = select.select(list(streams), stdin_fds, [], wait)
+        if not readable and not writable:
+            timed_out = True
+            proc.kill()
+            break
+
+        if writable:
+            try:
+                # a pipe that selects as writable has room for at least PIPE_BUF bytes
+                stdin_offset += os.write(stdin_fds[0], stdin_data[stdin_offset:stdin_offset + select.PIPE_BUF])
+            except OSError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+                # the command exited without reading all of its input
+                stdin_offset = len(stdin_data)
+            if stdin_offset >= len(stdin_data):
+                proc.stdin.close()
+                stdin_fds = []
+
+        for fd in readable:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                streams.pop(fd)
+            else:
+                emit((streams[fd], chunk))
+
+    code = proc.wait()
+    if timed_out:
+        emit(("exit", TIMEOUT_EXIT_CODE, "%s timed out after %s seconds" % (args, timeout)))
+    else:
+        emit(("exit", code, None))
+
+
+def _serve(request_fd, response_fd):
+    while True:
+        request = _read_message(request_fd)
+        if request is None:
+            # the parent closed its end (or died), nothing left to do.
+            return
+        args, stdin_data, timeout = request
+        _run_command(args, stdin_data, timeout, lambda message: _write_message(response_fd, message))
+
+
+def _collect(messages):
+    stdout, stderr = [], []
+    code = None
+    for message in messages:
+        if message[0] == "out":
+            stdout.append(message[1])
+        elif message[0] == "err":
+            stderr.append(message[1])
+        else:
+            code = message[1]
+            if message[2]:
+                stderr.append(message[2])
+    return "".join(stdout), "".join(stderr), code
+
+
+def call(args, stdin_data=None, timeout=None):
+    '''
+        Runs args directly from this process, with the same return value as ForkServer.call.
+    '''
+    messages = []
+    _run_command(args, stdin_data, timeout, messages.append)
+    return _collect(messages)
+
+
+class ForkServer:
+    '''
+        Forks the helper on construction. timeout is the default per command timeout in seconds (None for no timeout).
+        If the helper has gone away, commands are run directly from this process instead.
+    '''
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.calls = 0
+
+        request_r, request_w = os.pipe()
+        response_r, response_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(request_w)
+                os.close(response_r)
+                _serve(request_r, response_w)
+            finally:
+                # never return into the parent's code (or run its atexit handlers) from the helper
+                os._exit(0)
+
+        os.close(request_r)
+        os.close(response_w)
+        self.pid = pid
+        self._request_fd = request_w
+        self._response_fd = response_r
+
+    def is_alive(self):
+        return self.pid is not None
+
+    def call(self, args, stdin_data=None, timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        with self._lock:
+            self.calls += 1
+            if self.is_alive():
+                try:
+                    _write_message(self._request_fd, (args, stdin_data, timeout))
+                    return _collect(self._responses())
+                except (OSError, IOError, EOFError) as e:
+                    pbscc.warn("Fork server is no longer available, running commands directly: %s" % str(e))
+                    self._reap()
+
+            return call(args, stdin_data, timeout)
+
+    def _responses(self):
+        while True:
+            message = _read_message(self._response_fd)
+            if message is None:
+                raise EOFError("fork server exited")
+            yield message
+            if message[0] == "exit":
+                return
+
+    def check_call(self, args, stdin_data=None, timeout=None):
+        stdout, stderr, code = self.call(args, stdin_data, timeout)
+        if code != 0:
+            raise RuntimeError("%s failed with exit code %s: %s" % (args, code, stderr))
+        return stdout
+
+    def _reap(self):
+        if self.pid is None:
+            return
+        for fd in [self._request_fd, self._response_fd]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = None
+
+    def close(self):
+        with self._lock:
+            self._reap()
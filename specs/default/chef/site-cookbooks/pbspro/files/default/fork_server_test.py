@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import unittest
+
+import fork_server
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.server = fork_server.ForkServer(timeout=10)
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.close()
+        
+    def test_call(self):
+        self.assertEquals(("hi\n", "", 0), self.server.call(["echo", "hi"]))
+        self.assertEquals(("", "err\n", 3), self.server.call("echo err 1>&2; exit 3"))
+        self.assertEquals(("abc", "", 0), self.server.call(["cat"], stdin_data="abc"))
+        self.assertEquals(1024 * 1024, len(self.server.call(["head", "-c", str(1024 * 1024), "/dev/zero"])[0]))
+        self.assertEquals(4, self.server.calls)
+        
+    def test_large_stdin_and_output(self):
+        # more than a pipe's worth each way, which cat starts echoing before it has read all of its input
+        data = "x" * (4 * 1024 * 1024)
+        self.assertEquals((data, "", 0), self.server.call(["cat"], stdin_data=data))
+        self.assertEquals(("", "", 0), self.server.call(["true"], stdin_data=data))
+        
+    def test_timeout(self):
+        stdout, stderr, code = self.server.call(["sleep", "5"], timeout=.1)
+        self.assertEquals(fork_server.TIMEOUT_EXIT_CODE, code)
+        self.assertTrue("timed out" in stderr)
+        # the helper is still usable afterwards
+        self.assertEquals(("hi\n", "", 0), self.server.call(["echo", "hi"]))
+        
+    def test_check_call(self):
+        self.assertEquals("hi\n", self.server.check_call(["echo", "hi"]))
+        self.assertRaises(RuntimeError, self.server.check_call, ["false"])
+        
+    def test_closed(self):
+        self.server.close()
+        self.assertFalse(self.server.is_alive())
+        self.assertEquals(("hi\n", "", 0), self.server.call(["echo", "hi"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,11 +3,17 @@
 #
 '''
 The purpose of this class is to call basicConfig before any other module does, specifically requests.
+
+Records are handed to a background thread through a queue, which formats and writes them, so the autoscale cycle does not
+wait on the log file. Set AUTOSTART_LOG_ASYNC=false to write them synchronously instead.
 '''
+import atexit
 import logging
 import logging.handlers
 import os
+import Queue
 import sys
+import threading
 
 
 log_level_name = os.getenv('AUTOSTART_LOG_LEVEL', "INFO")
@@ -35,6 +41,77 @@ log_file = logging.handlers.RotatingFileHandler(log_file, maxBytes=1024 * 1024 *
 log_file.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
 log_file.setLevel(log_file_level)
 
-logging.getLogger().addHandler(stderr)
-logging.getLogger().addHandler(log_file)
-logging.getLogger().setLevel(logging.DEBUG)
+
+class QueueHandler(logging.Handler):
+    '''
+        Puts records on a queue for a QueueListener, like logging.handlers.QueueHandler in python 3. Give it the lowest level
+        of the listener's handlers, so records none of them would write are dropped here instead of queued.
+    '''
+    
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        
+    def emit(self, record):
+        try:
+            # merge the arguments now, they may have changed by the time the listener gets to the record.
+            if record.args:
+                record.msg = record.getMessage()
+                record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener:
+    '''
+        Background thread that passes records from the queue on to handlers, each of which still applies its own level.
+    '''
+    
+    _STOP = None
+    
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = threading.Thread(target=self._run, name="log-writer")
+        self._thread.daemon = True
+        
+    def start(self):
+        self._thread.start()
+        
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                return
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+                    
+    def stop(self):
+        '''
+            Writes out everything still on the queue.
+        '''
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join()
+
+
+# the root logger only creates records that at least one handler will write, logger.isEnabledFor() is false for the rest.
+handler_level = min(stderr.level, log_file.level)
+
+if os.getenv("AUTOSTART_LOG_ASYNC", "true").lower() == "true":
+    log_queue = Queue.Queue()
+    listener = QueueListener(log_queue, stderr, log_file)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(handler_level)
+    logging.getLogger().addHandler(queue_handler)
+else:
+    logging.getLogger().addHandler(stderr)
+    logging.getLogger().addHandler(log_file)
+logging.getLogger().setLevel(handler_level)
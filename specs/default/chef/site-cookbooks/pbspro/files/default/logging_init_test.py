@@ -0,0 +1,80 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import logging
+import os
+import Queue
+import tempfile
+import unittest
+
+# logging_init opens its log file on import, keep it out of the working directory
+os.environ["AUTOSTART_LOG_FILE"] = os.path.join(tempfile.mkdtemp(), "autoscale.log")
+import logging_init  # noqa
+
+
+class CapturingHandler(logging.Handler):
+    
+    def __init__(self, level):
+        logging.Handler.__init__(self, level)
+        self.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        self.lines = []
+        
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.queue = Queue.Queue()
+        self.logger = logging.getLogger("logging_init_test")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = logging_init.QueueHandler(self.queue)
+        self.logger.addHandler(self.handler)
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.logger.removeHandler(self.handler)
+    
+    def test_queue_listener(self):
+        info = CapturingHandler(logging.INFO)
+        debug = CapturingHandler(logging.DEBUG)
+        listener = logging_init.QueueListener(self.queue, info, debug)
+        listener.start()
+        
+        # the arguments are merged when the record is queued, not when it is written
+        hosts = ["ip-1"]
+        self.logger.info("hosts %s", hosts)
+        hosts.append("ip-2")
+        self.logger.debug("debug only")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            self.logger.exception("failed")
+        for n in range(1000):
+            self.logger.info("line %d", n)
+        
+        # stop writes out everything still on the queue
+        listener.stop()
+        self.assertTrue(self.queue.empty())
+        self.assertEquals("INFO: hosts ['ip-1']", info.lines[0])
+        self.assertTrue(info.lines[1].startswith("ERROR: failed\nTraceback"))
+        self.assertTrue(info.lines[1].endswith("ValueError: bad"))
+        self.assertEquals("INFO: line 999", info.lines[-1])
+        self.assertEquals(1002, len(info.lines))
+        self.assertEquals(1003, len(debug.lines))
+        self.assertEquals("DEBUG: debug only", debug.lines[1])
+        listener.stop()
+        
+    def test_queue_handler_level(self):
+        self.handler.setLevel(logging.INFO)
+        self.logger.debug("dropped")
+        self.assertTrue(self.queue.empty())
+        self.logger.info("kept")
+        self.assertEquals("kept", self.queue.get_nowait().getMessage())
+        
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Optional per cycle memory tracking, enabled with pbspro.memory_monitor.
+
+For every cycle it records the resident set size before and after the cycle (retained memory), the peak, and a summary of
+what is allocated: the amount per allocation site. Each summary is compared to the oldest of the last N cycles, and the
+allocation sites that grew the most are logged and reported with the rest of the cycle's metrics (see cycle_metrics), which
+is how a job or node cache that keeps growing shows up.
+
+The autoscale hook runs every cycle in a new process, so when given a path the summaries of the last N cycles are saved
+there and loaded again by the next run.
+
+tracemalloc is used when it is available (python 3), in which case allocation sites are file:line and growth is in bytes.
+The jetpack python is 2.7, which has no tracemalloc, so there the sites are the types of the objects tracked by the garbage
+collector and growth is in number of objects.
+'''
+import collections
+import gc
+import json
+import os
+import resource
+
+import pbscc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# with tracemalloc only the largest sites are kept in the saved summaries
+_MAX_SITES = 1000
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as fr:
+            return int(fr.read().split()[1]) * resource.getpagesize()
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_bytes():
+    # linux reports ru_maxrss in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _type_counts():
+    counts = collections.defaultdict(int)
+    for obj in gc.get_objects():
+        # __class__ rather than type(), which is just "instance" for old style classes
+        obj_type = getattr(obj, "__class__", type(obj))
+        counts["%s.%s" % (obj_type.__module__, obj_type.__name__)] += 1
+    return counts
+
+
+class MemoryMonitor:
+
+    def __init__(self, history=5, top=10, path=None):
+        self.history = collections.deque(maxlen=max(1, history))
+        self.top = top
+        self.path = path
+        self._rss_at_start = None
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if path:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fr:
+                persisted = json.load(fr)
+        except Exception as e:
+            pbscc.warn("Could not load memory history %s, ignoring it. Error was %s" % (self.path, str(e)))
+            return
+        # summaries of the other kind, e.g. written by a python with tracemalloc, can not be compared
+        unit = "bytes" if tracemalloc else "objects"
+        self.history.extend([x for x in persisted.get("cycles", []) if x.get("unit") == unit])
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump({"cycles": list(self.history)}, fw)
+            os.rename(tmp_path, self.path)
+        except Exception as e:
+            pbscc.warn("Could not save memory history %s. Error was %s" % (self.path, str(e)))
+
+    def _summary(self):
+        gc.collect()
+        if tracemalloc:
+            stats = tracemalloc.take_snapshot().statistics("lineno")[:_MAX_SITES]
+            sites = dict([(str(stat.traceback), stat.size) for stat in stats])
+        else:
+            sites = _type_counts()
+        return {"unit": "bytes" if tracemalloc else "objects", "rss_bytes": _rss_bytes(), "sites": sites}
+
+    def _growth(self, summary, baseline):
+        growth = [(site, amount - baseline["sites"].get(site, 0)) for site, amount in summary["sites"].items()]
+        growth = [x for x in growth if x[1] > 0]
+        growth.sort(key=lambda x: -x[1])
+        return growth[:self.top]
+
+    def start_cycle(self):
+        if not self.history:
+            self.history.append(self._summary())
+        self._rss_at_start = _rss_bytes()
+
+    def end_cycle(self):
+        '''
+            Returns this cycle's memory statistics as a dict.
+        '''
+        summary = self._summary()
+        rss = summary["rss_bytes"]
+        baseline = self.history[0]
+        growth = self._growth(summary, baseline)
+        compared_cycles = len(self.history)
+        self.history.append(summary)
+        if self.path:
+            self._save()
+
+        stats = collections.OrderedDict()
+        stats["rss_bytes"] = rss
+        stats["retained_bytes"] = rss - self._rss_at_start if rss is not None and self._rss_at_start is not None else None
+        stats["rss_growth_bytes"] = rss - baseline["rss_bytes"] if rss is not None and baseline["rss_bytes"] is not None else None
+        if tracemalloc:
+            stats["traced_bytes"], stats["peak_bytes"] = tracemalloc.get_traced_memory()
+        else:
+            # ru_maxrss lags behind statm slightly, don't report a peak below the current rss
+            stats["peak_bytes"] = max(_peak_rss_bytes(), rss or 0)
+            stats["objects"] = sum(summary["sites"].itervalues())
+        stats["growth_unit"] = "bytes" if tracemalloc else "objects"
+        stats["compared_cycles"] = compared_cycles
+        stats["top_growth"] = [{"site": site, "growth": size} for site, size in growth]
+
+        if growth:
+            pbscc.info("Top memory growth over the last %d cycles (%s): %s" % (stats["compared_cycles"], stats["growth_unit"],
+                                                                                ", ".join(["%s +%s" % x for x in growth])))
+        return stats
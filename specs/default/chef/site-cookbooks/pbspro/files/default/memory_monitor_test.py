@@ -0,0 +1,60 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import memory_monitor
+
+
+class LeakyCacheEntry:
+    pass
+
+
+class Test(unittest.TestCase):
+    
+    def test_growth(self):
+        monitor = memory_monitor.MemoryMonitor(history=2, top=3)
+        cache = []
+        
+        for cycle in range(3):
+            monitor.start_cycle()
+            cache.extend([LeakyCacheEntry() for _ in range(1000)])
+            stats = monitor.end_cycle()
+        
+        self.assertEquals(2, stats["compared_cycles"])
+        self.assertTrue(stats["rss_bytes"] > 0)
+        self.assertTrue(stats["peak_bytes"] >= stats["rss_bytes"])
+        top_site = stats["top_growth"][0]
+        if stats["growth_unit"] == "objects":
+            # compared to two cycles ago
+            self.assertTrue(top_site["site"].endswith(".LeakyCacheEntry"))
+            self.assertEquals(2000, top_site["growth"])
+        else:
+            self.assertTrue("memory_monitor_test.py" in top_site["site"])
+    
+    def test_history_survives_runs(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "memory_history.json")
+            cache = []
+            # every autoscale run is a new process with a new monitor
+            for cycle in range(3):
+                monitor = memory_monitor.MemoryMonitor(history=2, top=3, path=path)
+                monitor.start_cycle()
+                cache.extend([LeakyCacheEntry() for _ in range(1000)])
+                stats = monitor.end_cycle()
+            
+            self.assertEquals(2, stats["compared_cycles"])
+            self.assertEquals(2, len(monitor.history))
+            self.assertTrue(stats["rss_growth_bytes"] is not None)
+            if stats["growth_unit"] == "objects":
+                self.assertEquals(2000, stats["top_growth"][0]["growth"])
+        finally:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
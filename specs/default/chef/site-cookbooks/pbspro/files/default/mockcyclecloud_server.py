@@ -0,0 +1,425 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Local HTTP stand-in for the parts of the CycleCloud REST api the autoscaler uses, so that ClustersAPI can be exercised
+over real HTTP (serialization, payload size, latency, throttling) instead of MockClustersAPI's in-process fake.
+
+    GET  /clusters/<cluster>/status[?nodes=true]    nodearrays and their buckets, optionally with the nodes
+    GET  /clusters/<cluster>/nodes                  the nodes
+    POST /clusters/<cluster>/nodes/create           {"requestId", "sets": [...]}, repeated requestIds are not applied twice
+    POST /clusters/<cluster>/nodes/shutdown         {"ids": [...]} or {"names": [...]}
+    GET  /_stats                                    request, byte and throttling counts of this server
+
+Every request waits latency (+/- jitter) seconds. Requests beyond rate_limit per second (with a burst of the same size),
+and a random error_rate fraction of all requests, get a 429 with a Retry-After header. node_attribute_bytes pads each
+node record, real ones carry the node's whole configuration.
+
+    python mockcyclecloud_server.py serve --port 8080 --nodes 10000 --latency 0.05 --rate-limit 20
+    python mockcyclecloud_server.py bench --jobs 100000 --nodes 5000 --cycles 5 --latency 0.05
+
+bench runs full autoscale cycles, each in its own process the way the hook does, against this server and
+mockpbs_server, and reports per cycle time, CycleCloud calls and bytes (from the status file, see cycle_metrics) and
+what the server saw, including how many requests it throttled.
+'''
+import BaseHTTPServer
+import json
+import math
+import os
+import random
+import re
+import shutil
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+import uuid
+from collections import OrderedDict
+
+
+_ROUTES = [("GET", re.compile(r"^/clusters/([^/]+)/status$"), "status"),
+           ("GET", re.compile(r"^/clusters/([^/]+)/nodes$"), "nodes"),
+           ("POST", re.compile(r"^/clusters/([^/]+)/nodes/create$"), "create"),
+           ("POST", re.compile(r"^/clusters/([^/]+)/nodes/shutdown$"), "shutdown")]
+
+
+class CycleCloudState:
+    '''
+        The nodearrays and nodes of one cluster. hostname_delay is how long after creation a node gets its hostname and
+        becomes Ready.
+    '''
+
+    def __init__(self, cluster_name="pbs", node_attribute_bytes=0, hostname_delay=0):
+        self.cluster_name = cluster_name
+        self.node_attribute_bytes = node_attribute_bytes
+        self.hostname_delay = hostname_delay
+        self.nodearrays = OrderedDict()
+        # NodeId -> node
+        self.nodes = OrderedDict()
+        # requestId -> response, so that a retried create is not applied twice
+        self.create_requests = {}
+        self.lock = threading.Lock()
+        self._next_node = 1
+
+    def add_nodearray(self, name, machinetype, vcpus, memory_gb, max_count, placement_groups=None):
+        bucket = OrderedDict([("bucketId", str(uuid.uuid4())),
+                              ("definition", {"machineType": machinetype}),
+                              ("maxCount", max_count),
+                              ("maxCoreCount", max_count * vcpus),
+                              ("activeCount", 0),
+                              ("availableCount", max_count),
+                              ("virtualMachine", OrderedDict([("vcpuCount", vcpus),
+                                                              ("memory", memory_gb),
+                                                              ("gpuCount", 0),
+                                                              ("infiniband", False)]))])
+        if name not in self.nodearrays:
+            self.nodearrays[name] = OrderedDict([("name", name),
+                                                 ("maxCount", max_count),
+                                                 ("maxCoreCount", max_count * vcpus),
+                                                 ("nodearray", OrderedDict([("Configuration", {"pbspro": {"slot_type": name}})])),
+                                                 ("placementGroups", placement_groups or []),
+                                                 ("buckets", [])])
+        self.nodearrays[name]["buckets"].append(bucket)
+
+    def add_node(self, nodearray, machinetype, hostname=None, instance_id=None, placement_group_id=None, created=None):
+        node_id = str(self._next_node)
+        self._next_node += 1
+        node = OrderedDict([("Name", "%s-%s" % (nodearray, node_id)),
+                            ("NodeId", node_id),
+                            ("InstanceId", instance_id or "i-%s" % uuid.uuid4().hex[:16]),
+                            ("Template", nodearray),
+                            ("MachineType", machinetype),
+                            ("Status", "Ready" if hostname else "Allocation"),
+                            ("TargetState", "Started"),
+                            ("hostname", hostname),
+                            ("PlacementGroupId", placement_group_id),
+                            ("placementGroupId", placement_group_id),
+                            ("Created", created or time.time())])
+        if self.node_attribute_bytes:
+            node["Configuration"] = {"cyclecloud": {"padding": "x" * self.node_attribute_bytes}}
+        self.nodes[node_id] = node
+        return node
+
+    def _converge(self):
+        now = time.time()
+        for node in self.nodes.itervalues():
+            if not node["hostname"] and now - node["Created"] >= self.hostname_delay:
+                node["hostname"] = "ip-%08x" % int(node["NodeId"])
+                node["Status"] = "Ready"
+
+    def status(self, nodes=False):
+        self._converge()
+        counts = {}
+        for node in self.nodes.itervalues():
+            key = (node["Template"], node["MachineType"])
+            counts[key] = counts.get(key, 0) + 1
+
+        nodearrays = []
+        for nodearray in self.nodearrays.itervalues():
+            nodearray = OrderedDict(nodearray)
+            buckets = []
+            for bucket in nodearray["buckets"]:
+                bucket = OrderedDict(bucket)
+                bucket["activeCount"] = counts.get((nodearray["name"], bucket["definition"]["machineType"]), 0)
+                bucket["availableCount"] = max(0, bucket["maxCount"] - bucket["activeCount"])
+                buckets.append(bucket)
+            nodearray["buckets"] = buckets
+            nodearrays.append(nodearray)
+
+        ret = OrderedDict([("state", "Started"), ("targetState", "Started"), ("nodearrays", nodearrays)])
+        if nodes:
+            ret["nodes"] = self.nodes.values()
+        return ret
+
+    def list_nodes(self):
+        self._converge()
+        return {"nodes": self.nodes.values()}
+
+    def create(self, request):
+        request_id = request.get("requestId")
+        if request_id and request_id in self.create_requests:
+            return self.create_requests[request_id]
+
+        sets = []
+        for request_set in request.get("sets", []):
+            nodearray = self.nodearrays.get(request_set.get("nodearray"))
+            machinetype = request_set.get("definition", {}).get("machineType")
+            if not nodearray or machinetype not in [b["definition"]["machineType"] for b in nodearray["buckets"]]:
+                sets.append({"added": 0, "message": "Unknown nodearray or machine type"})
+                continue
+            node_ids = []
+            for _ in range(int(request_set.get("count", 0))):
+                node = self.add_node(nodearray["name"], machinetype, placement_group_id=request_set.get("placementGroupId"))
+                node_ids.append(node["NodeId"])
+            sets.append({"added": len(node_ids), "nodeIds": node_ids})
+
+        response = {"operationId": str(uuid.uuid4()), "sets": sets}
+        if request_id:
+            self.create_requests[request_id] = response
+        return response
+
+    def shutdown(self, request):
+        ids = set(request.get("ids") or [])
+        names = set(request.get("names") or [])
+        removed = []
+        for node_id, node in self.nodes.items():
+            if node["InstanceId"] in ids or node["NodeId"] in ids or node["Name"] in names:
+                self.nodes.pop(node_id)
+                removed.append({"id": node["NodeId"], "name": node["Name"], "status": "OK"})
+        return {"operationId": str(uuid.uuid4()), "nodes": removed}
+
+
+class _TokenBucket:
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        '''
+            Returns 0 if a request may go ahead, otherwise how many seconds until one may.
+        '''
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, like the requests session ClustersAPI holds
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _respond(self, code, body, headers=None):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).iteritems():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count("bytes_out", len(data))
+        self.server.count("status_%d" % code)
+
+    def _dispatch(self, method):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader("Content-Length") or 0)
+        body = self.rfile.read(length) if length else ""
+        server.count("requests")
+        server.count("bytes_in", len(body))
+
+        if url.path == "/_stats":
+            return self._respond(200, server.snapshot())
+
+        for route_method, pattern, name in _ROUTES:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            return self._respond(404, {"error": "Not found: %s %s" % (method, url.path)})
+
+        server.count("requests_" + name)
+        wait = server.throttle()
+        if wait:
+            server.count("throttled")
+            return self._respond(429, {"error": "Too many requests"}, {"Retry-After": str(int(math.ceil(wait)))})
+
+        if server.latency or server.jitter:
+            time.sleep(max(0, server.latency + server.random.uniform(-server.jitter, server.jitter)))
+
+        state = server.state
+        if match.group(1) != state.cluster_name:
+            return self._respond(404, {"error": "Unknown cluster %s" % match.group(1)})
+
+        try:
+            request = json.loads(body) if body else {}
+        except ValueError:
+            return self._respond(400, {"error": "Invalid JSON"})
+
+        with state.lock:
+            if name == "status":
+                query = urlparse.parse_qs(url.query)
+                response = state.status(nodes=query.get("nodes", ["false"])[0].lower() == "true")
+            elif name == "nodes":
+                response = state.list_nodes()
+            elif name == "create":
+                response = state.create(request)
+            else:
+                response = state.shutdown(request)
+        self._respond(200, response)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def throttle(self):
+        wait = self.bucket.take() if self.bucket else 0
+        if not wait and self.error_rate and self.random.random() < self.error_rate:
+            wait = 1
+        return wait
+
+
+def start(state, port=0, latency=0, jitter=0, rate_limit=0, error_rate=0, seed=0):
+    '''
+        Serves state on 127.0.0.1:port (0 for any free port) from a background thread. Returns the server, whose url is
+        server.url. Call shutdown() on it when done.
+    '''
+    server = _Server(("127.0.0.1", port), _Handler)
+    server.state = state
+    server.latency = latency
+    server.jitter = jitter
+    server.bucket = _TokenBucket(rate_limit) if rate_limit else None
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    server.stats = {}
+    server._stats_lock = threading.Lock()
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def new_state(cluster_name, num_nodes, node_attribute_bytes=0, pbs_state=None):
+    '''
+        One execute nodearray with num_nodes Ready nodes, matching the hosts of pbs_state if given (see
+        mockpbs_server.populate).
+    '''
+    state = CycleCloudState(cluster_name, node_attribute_bytes)
+    state.add_nodearray("execute", "Standard_D16_v3", 16, 64, max(num_nodes * 2, 100))
+    if pbs_state:
+        for name, node in pbs_state.nodes.iteritems():
+            state.add_node("execute", "Standard_D16_v3", hostname=name, instance_id=node["resources_available"].get("instance_id"))
+    else:
+        for n in range(num_nodes):
+            state.add_node("execute", "Standard_D16_v3", hostname="ip-%08x" % n, instance_id="i-%d" % n)
+    return state
+
+
+def bench(num_jobs, num_nodes, cycles=3, latency=0, jitter=0, rate_limit=0, error_rate=0, node_attribute_bytes=0, log=sys.stderr):
+    import mockpbs_server
+
+    tempdir = tempfile.mkdtemp()
+    pbs_dir = os.path.join(tempdir, "pbs")
+    bin_dir = os.path.join(tempdir, "bin")
+    os.makedirs(pbs_dir)
+
+    pbs_state = mockpbs_server.PBSState()
+    mockpbs_server.populate(pbs_state, num_jobs, num_nodes)
+    pbs_server = mockpbs_server.start(pbs_state, os.path.join(tempdir, "pbs.sock"), bin_dir)
+    server = start(new_state("bench", num_nodes, node_attribute_bytes, pbs_state), latency=latency, jitter=jitter,
+                   rate_limit=rate_limit, error_rate=error_rate)
+
+    status_file = os.path.join(tempdir, "autoscale_status.json")
+    # _run_cycle reads these overrides from $CYCLECLOUD_BOOTSTRAP/pbs/config.json
+    with open(os.path.join(pbs_dir, "config.json"), "w") as fw:
+        json.dump({"cyclecloud.config.web_server": server.url,
+                   "cyclecloud.config.username": "bench",
+                   "cyclecloud.config.password": "bench",
+                   "cyclecloud.cluster.name": "bench",
+                   "pbspro.status_file": status_file}, fw)
+
+    env = dict(os.environ)
+    env.update({"AUTOSTART_HOOK": "1",
+                "CYCLECLOUD_BOOTSTRAP": tempdir,
+                "AUTOSTART_LOG_LEVEL": "WARN",
+                "AUTOSTART_LOG_FILE": os.path.join(tempdir, "autoscale.log")})
+    autostart_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autostart.py")
+
+    results = []
+    try:
+        for cycle in range(cycles):
+            stats_before = server.snapshot()
+            started = time.time()
+            # like the hook, a fresh process per cycle. The second argument is where the PBS commands are.
+            code = subprocess.call([sys.executable, autostart_path, "hook", bin_dir], env=env, cwd=tempdir)
+            elapsed = time.time() - started
+            stats = server.snapshot()
+            result = OrderedDict([("seconds", elapsed), ("exit_code", code)])
+            try:
+                with open(status_file) as fr:
+                    status = json.load(fr)
+                result["api_calls"] = status["counters"]["api_calls"]
+                result["phases"] = status["phases"]
+            except (IOError, ValueError, KeyError):
+                pass
+            for key in ["requests", "bytes_out", "throttled"]:
+                result["server_" + key] = stats.get(key, 0) - stats_before.get(key, 0)
+            results.append(result)
+            log.write("cycle %d: %.3fs exit %d, %d requests, %.1fKB, %d throttled\n" % (cycle, elapsed, code, result["server_requests"],
+                                                                                         result["server_bytes_out"] / 1024., result["server_throttled"]))
+        return results
+    finally:
+        server.shutdown()
+        pbs_server.shutdown()
+        shutil.rmtree(tempdir)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for the CycleCloud REST api")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--cluster", default="pbs")
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("--jobs", type=int, default=10000)
+    bench_parser.add_argument("--cycles", type=int, default=3)
+    bench_parser.add_argument("--output", help="Write the results as JSON to this path")
+    for subparser in [serve_parser, bench_parser]:
+        subparser.add_argument("--nodes", type=int, default=1000)
+        subparser.add_argument("--latency", type=float, default=0, help="Seconds added to every request")
+        subparser.add_argument("--jitter", type=float, default=0)
+        subparser.add_argument("--rate-limit", type=float, default=0, help="Requests per second before 429s, 0 for none")
+        subparser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests that randomly get a 429")
+        subparser.add_argument("--node-attribute-bytes", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        results = bench(args.jobs, args.nodes, args.cycles, args.latency, args.jitter, args.rate_limit, args.error_rate,
+                        args.node_attribute_bytes)
+        if args.output:
+            with open(args.output, "w") as fw:
+                json.dump({"recorded": time.time(), "jobs": args.jobs, "nodes": args.nodes, "cycles": results}, fw, indent=2)
+        return 0 if all([x["exit_code"] == 0 for x in results]) else 1
+
+    server = start(new_state(args.cluster, args.nodes, args.node_attribute_bytes), args.port, args.latency, args.jitter,
+                   args.rate_limit, args.error_rate)
+    sys.stderr.write("Serving cluster %s with %d nodes on %s\n" % (args.cluster, args.nodes, server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
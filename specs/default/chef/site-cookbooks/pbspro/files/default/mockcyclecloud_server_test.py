@@ -0,0 +1,88 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import unittest
+import urllib2
+
+import mockcyclecloud_server
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.state = mockcyclecloud_server.new_state("pbs", 3, node_attribute_bytes=100)
+        self.server = None
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _start(self, **kwargs):
+        self.server = mockcyclecloud_server.start(self.state, **kwargs)
+
+    def _request(self, path, body=None):
+        data = json.dumps(body) if body is not None else None
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.server.url + path, data, {"Content-Type": "application/json"}))
+            return response.getcode(), json.loads(response.read()), response.info()
+        except urllib2.HTTPError as e:
+            return e.code, json.loads(e.read()), e.info()
+
+    def test_status_and_nodes(self):
+        self._start()
+        code, status, _ = self._request("/clusters/pbs/status")
+        self.assertEquals(200, code)
+        self.assertFalse("nodes" in status)
+        bucket = status["nodearrays"][0]["buckets"][0]
+        self.assertEquals("Standard_D16_v3", bucket["definition"]["machineType"])
+        self.assertEquals(3, bucket["activeCount"])
+        self.assertEquals(16, bucket["virtualMachine"]["vcpuCount"])
+
+        _, status, _ = self._request("/clusters/pbs/status?nodes=true")
+        self.assertEquals(["ip-00000000", "ip-00000001", "ip-00000002"], [x["hostname"] for x in status["nodes"]])
+        self.assertEquals(100, len(status["nodes"][0]["Configuration"]["cyclecloud"]["padding"]))
+
+        _, nodes, _ = self._request("/clusters/pbs/nodes")
+        self.assertEquals(3, len(nodes["nodes"]))
+
+        self.assertEquals(404, self._request("/clusters/other/nodes")[0])
+        self.assertEquals(404, self._request("/clusters/pbs/unknown")[0])
+
+    def test_create_is_idempotent(self):
+        self._start()
+        request = {"requestId": "r1", "sets": [{"nodearray": "execute", "count": 2, "definition": {"machineType": "Standard_D16_v3"},
+                                                "placementGroupId": "pg1"}]}
+        _, first, _ = self._request("/clusters/pbs/nodes/create", request)
+        _, retried, _ = self._request("/clusters/pbs/nodes/create", request)
+        self.assertEquals(first, retried)
+        self.assertEquals(2, first["sets"][0]["added"])
+        self.assertEquals(5, len(self.state.nodes))
+        new_node = self.state.nodes[first["sets"][0]["nodeIds"][0]]
+        self.assertEquals("pg1", new_node["placementGroupId"])
+        # hostname_delay is 0, so it has a hostname as soon as it is read
+        _, nodes, _ = self._request("/clusters/pbs/nodes")
+        self.assertTrue(all([x["hostname"] for x in nodes["nodes"]]))
+
+        _, shutdown, _ = self._request("/clusters/pbs/nodes/shutdown", {"ids": ["i-0", new_node["InstanceId"]]})
+        self.assertEquals(2, len(shutdown["nodes"]))
+        self.assertEquals(3, len(self.state.nodes))
+
+    def test_throttling(self):
+        self._start(rate_limit=2)
+        codes = [self._request("/clusters/pbs/status")[0] for _ in range(4)]
+        self.assertEquals([200, 200, 429, 429], codes)
+        _, body, headers = self._request("/clusters/pbs/status")
+        self.assertEquals("Too many requests", body["error"])
+        self.assertEquals("1", headers.getheader("Retry-After"))
+
+        _, stats, _ = self._request("/_stats")
+        self.assertEquals(3, stats["throttled"])
+        self.assertEquals(5, stats["requests_status"])
+
+
+if __name__ == "__main__":
+    unittest.main()
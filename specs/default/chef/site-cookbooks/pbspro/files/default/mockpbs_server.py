@@ -0,0 +1,865 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Stand-in PBS command line tools backed by an in-memory server, so that PBSDriver can be run end to end (fork, pipe,
+qstat/pbsnodes/qmgr output parsing) without a PBS install. mockpbs stands in for the hook side pbs module, this stands in
+for pbs_server.
+
+    python mockpbs_server.py serve --bin-dir /tmp/fakepbs/bin --jobs 100000 --nodes 5000
+    python mockpbs_server.py bench --jobs 100000 --nodes 5000
+
+serve writes qstat, pbsnodes, qmgr, qalter, qrls, qhold, qselect, qsub, qrun and qdel into bin_dir, each a small client
+that sends its arguments (and stdin, for qmgr and qsub scripts) over a unix socket to the server and prints what it gets
+back, so PBSDriver(bin_dir=...) can be pointed at them. The output follows PBS 18: qstat -f (-w), pbsnodes -a -F json,
+qmgr -c 'list resource' and friends, along with the exit codes the driver checks for (153 for unknown jobs, 1 and
+"Server has no node list" for pbsnodes on an empty cluster).
+
+bench populates a server, then times the calls autostart makes through PBSDriver and the cli backend, split into the
+command itself (fork, exec, socket round trip) and parsing its output. The clients are python, not C, so their
+startup is an upper bound for the real commands.
+'''
+import getopt
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+PBS_VERSION = "18.1.4"
+
+COMMANDS = ["qstat", "pbsnodes", "qmgr", "qalter", "qrls", "qhold", "qselect", "qsub", "qrun", "qdel"]
+
+_PBS_NOT_FOUND = 153
+
+_QSTAT_STATES = {"running": ["R", "S"], "queued": ["Q", "H", "W"]}
+
+_QMGR_VERBS = {"c": "create", "d": "delete", "s": "set", "u": "unset", "l": "list", "p": "print"}
+
+_QMGR_OBJECTS = {"n": "node", "r": "resource", "s": "server", "q": "queue"}
+
+_EXEC_VNODE_CHUNK = re.compile(r"\(([^:)]+)((?::[^:)]+)*)\)")
+
+
+class PBSError(Exception):
+
+    def __init__(self, message, code=1):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def _parse_exec_vnode(expr):
+    '''
+        "(vnode1:ncpus=4)+(vnode2:ncpus=4:mem=1gb)" -> [("vnode1", {"ncpus": "4"}), ("vnode2", {"ncpus": "4", "mem": "1gb"})]
+    '''
+    chunks = []
+    for match in _EXEC_VNODE_CHUNK.finditer(expr):
+        resources = OrderedDict()
+        for kv in match.group(2).split(":")[1:]:
+            key, value = kv.split("=", 1)
+            resources[key] = value
+        chunks.append((match.group(1), resources))
+    return chunks
+
+
+def _parse_resource_args(expr):
+    '''
+        -l arguments, comma or colon separated. select and place keep their colons.
+    '''
+    resources = OrderedDict()
+    for part in expr.split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        if key in ["select", "place"]:
+            resources[key] = value
+            continue
+        for kv in part.split(":"):
+            if "=" in kv:
+                key, value = kv.split("=", 1)
+                resources[key] = value
+    return resources
+
+
+class PBSState:
+    '''
+        Jobs, nodes, custom resources and server attributes, and the commands that read and change them. run(argv, stdin)
+        returns (stdout, stderr, exit code) like the real command would. Not thread safe, see lock.
+        
+        Each command returns its stdout, or (stdout, stderr, exit code), and raises PBSError to fail.
+    '''
+
+    def __init__(self, server_name="pbsserver"):
+        self.server_name = server_name
+        # job id -> attributes in qstat -f order. Keys starting with _ are internal.
+        self.jobs = OrderedDict()
+        # node name -> pbsnodes -F json node
+        self.nodes = OrderedDict()
+        # custom resource name -> {"type": ..., "flag": ...}
+        self.resources = OrderedDict()
+        self.server = OrderedDict([("scheduling", "True"), ("default_queue", "workq")])
+        self.next_job_id = 1
+        self.lock = threading.Lock()
+
+    def run(self, argv, stdin_data=""):
+        command = os.path.basename(argv[0])
+        if command not in COMMANDS:
+            return "", "%s: command not found\n" % command, 127
+        try:
+            ret = getattr(self, "_" + command)(argv[1:], stdin_data) or ""
+            return ret if isinstance(ret, tuple) else (ret, "", 0)
+        except PBSError as e:
+            return "", "%s: %s\n" % (command, str(e)), e.code
+        except getopt.GetoptError as e:
+            return "", "%s: %s\n" % (command, str(e)), 2
+
+    # state helpers, also used directly to populate a server
+
+    def qsub(self, select="1:ncpus=1", place="pack", name="STDIN", owner="hpcuser", queue="workq", hold=False, array_range=None,
+             **resources):
+        job_id = "%d%s.%s" % (self.next_job_id, "[]" if array_range else "", self.server_name)
+        self.next_job_id += 1
+        now = time.ctime()
+
+        resource_list = OrderedDict()
+        ncpus = 0
+        nodect = 0
+        for chunk in select.split("+"):
+            toks = chunk.split(":")
+            count = int(toks[0]) if toks[0].isdigit() else 1
+            chunk_resources = dict([x.split("=", 1) for x in toks if "=" in x])
+            ncpus += count * int(chunk_resources.get("ncpus", 1))
+            nodect += count
+        resource_list["ncpus"] = str(ncpus)
+        resource_list["nodect"] = str(nodect)
+        resource_list["place"] = place
+        resource_list["select"] = select
+        resource_list.update(resources)
+
+        job = OrderedDict()
+        job["Job_Name"] = name
+        job["Job_Owner"] = "%s@%s" % (owner, self.server_name)
+        job["job_state"] = "H" if hold else "Q"
+        job["queue"] = queue
+        job["server"] = self.server_name
+        job["Checkpoint"] = "u"
+        job["ctime"] = now
+        job["Error_Path"] = "%s:/shared/home/%s/%s.e%s" % (self.server_name, owner, name, job_id.split(".")[0])
+        job["Hold_Types"] = "u" if hold else "n"
+        job["Join_Path"] = "n"
+        job["Keep_Files"] = "n"
+        job["Mail_Points"] = "a"
+        job["mtime"] = now
+        job["Output_Path"] = "%s:/shared/home/%s/%s.o%s" % (self.server_name, owner, name, job_id.split(".")[0])
+        job["Priority"] = "0"
+        job["qtime"] = now
+        job["Rerunable"] = "True"
+        job["Resource_List"] = resource_list
+        job["substate"] = "20" if hold else "10"
+        job["Variable_List"] = "PBS_O_HOME=/shared/home/%s,PBS_O_LOGNAME=%s,PBS_O_QUEUE=%s,PBS_O_HOST=%s" % (owner, owner, queue, self.server_name)
+        job["etime"] = now
+        if array_range:
+            first, last = [int(x) for x in array_range.split("-")]
+            job["array"] = "True"
+            job["array_indices_submitted"] = array_range
+            job["_array_range"] = (first, last)
+            # index -> state, for the subjobs that are no longer queued
+            job["_subjob_states"] = {}
+            self._update_array(job)
+        job["Submit_arguments"] = "-l select=%s -l place=%s" % (select, place)
+        job["project"] = "_pbs_project_default"
+        self.jobs[job_id] = job
+        return job_id
+
+    def add_node(self, name, state="free", **resources_available):
+        resources = OrderedDict([("arch", "linux"), ("host", name), ("mem", "4gb"), ("ncpus", 1), ("vnode", name)])
+        resources.update(resources_available)
+        self.nodes[name] = OrderedDict([("Mom", name),
+                                        ("Port", 15002),
+                                        ("pbs_version", PBS_VERSION),
+                                        ("ntype", "PBS"),
+                                        ("state", state),
+                                        ("pcpus", int(resources["ncpus"])),
+                                        ("resources_available", resources),
+                                        ("resources_assigned", OrderedDict()),
+                                        ("resv_enable", "True"),
+                                        ("sharing", "default_shared"),
+                                        ("last_state_change_time", int(time.time()))])
+        return self.nodes[name]
+
+    def qrun(self, job_id, exec_vnode):
+        job, subjob_index = self._find_job(job_id)
+        chunks = _parse_exec_vnode(exec_vnode)
+        for vnode, _ in chunks:
+            if vnode not in self.nodes:
+                raise PBSError("Unknown node %s" % vnode, _PBS_NOT_FOUND)
+
+        if subjob_index is not None:
+            job["_subjob_states"][subjob_index] = "R"
+            self._update_array(job)
+            job = job.setdefault("_running_subjobs", OrderedDict()).setdefault(subjob_index, OrderedDict())
+            job_id = self._subjob_id(self._canonical_id(job_id), subjob_index)
+
+        job["job_state"] = "R"
+        job["exec_host"] = "+".join(["%s/0*%s" % (vnode, resources.get("ncpus", 1)) for vnode, resources in chunks])
+        job["exec_vnode"] = exec_vnode
+        job["stime"] = time.ctime()
+        job["substate"] = "42"
+
+        now = int(time.time())
+        for vnode, resources in chunks:
+            node = self.nodes[vnode]
+            assigned = node["resources_assigned"]
+            ncpus = int(resources.get("ncpus", 1))
+            assigned["ncpus"] = assigned.get("ncpus", 0) + ncpus
+            jobs = node.setdefault("jobs", [])
+            jobs.extend(["%s/%d" % (job_id, n) for n in range(len(jobs), len(jobs) + ncpus)])
+            self._set_busy(node, now)
+
+    def qdel(self, job_id):
+        job, subjob_index = self._find_job(job_id)
+        canonical = self._canonical_id(job_id)
+        if subjob_index is not None:
+            running = job.get("_running_subjobs", {}).pop(subjob_index, None)
+            job["_subjob_states"][subjob_index] = "X"
+            self._update_array(job)
+            if running:
+                self._release(self._subjob_id(canonical, subjob_index), running)
+            return
+
+        for index, running in job.pop("_running_subjobs", {}).items():
+            self._release(self._subjob_id(canonical, index), running)
+        if job.get("exec_vnode"):
+            self._release(canonical, job)
+        self.jobs.pop(canonical)
+
+    def _release(self, job_id, job):
+        now = int(time.time())
+        for vnode, resources in _parse_exec_vnode(job.get("exec_vnode", "")):
+            node = self.nodes.get(vnode)
+            if not node:
+                continue
+            node["resources_assigned"]["ncpus"] = max(0, node["resources_assigned"].get("ncpus", 0) - int(resources.get("ncpus", 1)))
+            node["jobs"] = [x for x in node.get("jobs", []) if x.split("/")[0] != job_id]
+            if not node["jobs"]:
+                node.pop("jobs")
+                node["last_used_time"] = now
+            self._set_busy(node, now)
+
+    def _set_busy(self, node, now):
+        states = [x for x in node["state"].split(",") if x not in ["free", "job-busy"]]
+        busy = node["resources_assigned"].get("ncpus", 0) >= int(node["resources_available"].get("ncpus", 1))
+        states.insert(0, "job-busy" if busy else "free")
+        if "free" in states and len(states) > 1:
+            states.remove("free")
+        state = ",".join(states)
+        if state != node["state"]:
+            node["state"] = state
+            node["last_state_change_time"] = now
+
+    def _canonical_id(self, job_id):
+        return job_id if "." in job_id else "%s.%s" % (job_id, self.server_name)
+
+    def _subjob_id(self, array_id, index):
+        return array_id.replace("[]", "[%s]" % index)
+
+    def _find_job(self, job_id):
+        '''
+            Returns (job, subjob index or None)
+        '''
+        job_id = self._canonical_id(job_id)
+        match = re.match(r"^(\d+)\[(\d*)\](\..+)$", job_id)
+        if match:
+            job = self.jobs.get("%s[]%s" % (match.group(1), match.group(3)))
+            index = match.group(2) or None
+            if job is not None and (index is None or job["_array_range"][0] <= int(index) <= job["_array_range"][1]):
+                return job, index
+        elif job_id in self.jobs:
+            return self.jobs[job_id], None
+        raise PBSError("Unknown Job Id %s" % job_id, _PBS_NOT_FOUND)
+
+    def _update_array(self, job):
+        states = job["_subjob_states"].values()
+        queued = job["_array_range"][1] - job["_array_range"][0] + 1 - len(states)
+        job["array_state_count"] = "Queued:%d Running:%d Exiting:0 Expired:%d " % (queued, states.count("R"), states.count("X"))
+        if job["job_state"] in ["Q", "B"]:
+            job["job_state"] = "B" if states else "Q"
+
+    def _expand(self, job_id, job, subjobs, states=None):
+        '''
+            Yields the job and, if subjobs, its array subjobs, limited to those in states.
+        '''
+        if not states or job["job_state"] in states:
+            yield job_id, job
+        if not subjobs or "_array_range" not in job:
+            return
+        running = job.get("_running_subjobs", {})
+        subjob_states = job["_subjob_states"]
+        if states and "Q" not in states:
+            # only the subjobs that have left the queue can match
+            indices = sorted([int(x) for x in subjob_states])
+        else:
+            indices = xrange(job["_array_range"][0], job["_array_range"][1] + 1)
+        for n in indices:
+            index = str(n)
+            state = subjob_states.get(index, "Q")
+            if states and state not in states:
+                continue
+            subjob = OrderedDict([(k, v) for k, v in job.iteritems() if k not in ["array", "array_state_count", "array_indices_submitted"]])
+            subjob["job_state"] = state
+            subjob["array_id"] = job_id
+            subjob["array_index"] = index
+            subjob.update(running.get(index, {}))
+            yield self._subjob_id(job_id, index), subjob
+
+    # commands
+
+    def _qstat(self, args, stdin_data):
+        opts, job_ids = getopt.gnu_getopt(args, "fwtriQxF:")
+        opts = dict(opts)
+        if "-Q" in opts:
+            return self._qstat_queues()
+
+        states = None
+        if "-r" in opts:
+            states = _QSTAT_STATES["running"]
+        elif "-i" in opts:
+            states = _QSTAT_STATES["queued"]
+
+        if job_ids:
+            selected = []
+            for job_id in job_ids:
+                job, index = self._find_job(job_id)
+                canonical = self._canonical_id(job_id)
+                if index is None:
+                    if not states or job["job_state"] in states:
+                        selected.append((canonical, job))
+                else:
+                    selected.extend([x for x in self._expand(self._canonical_id(job_id.split("[")[0] + "[]"), job, True, states) if x[0] == canonical])
+        else:
+            selected = [x for job_id, job in self.jobs.iteritems() for x in self._expand(job_id, job, "-t" in opts, states)]
+
+        if "-f" not in opts:
+            return self._qstat_table(selected)
+
+        buf = []
+        for job_id, job in selected:
+            buf.append("Job Id: %s\n" % job_id)
+            for key, value in job.iteritems():
+                if key.startswith("_"):
+                    continue
+                if isinstance(value, dict):
+                    for sub_key, sub_value in value.iteritems():
+                        buf.append(self._qstat_line("%s.%s" % (key, sub_key), sub_value, "-w" in opts))
+                else:
+                    buf.append(self._qstat_line(key, value, "-w" in opts))
+            buf.append("\n")
+        return "".join(buf)
+
+    def _qstat_line(self, key, value, wide):
+        line = "    %s = %s" % (key, value)
+        if wide or len(line) <= 79:
+            return line + "\n"
+        # without -w, qstat -f folds long values onto tab indented continuation lines
+        folded = [line[:79]]
+        rest = line[79:]
+        while rest:
+            folded.append("\t" + rest[:71])
+            rest = rest[71:]
+        return "\n".join(folded) + "\n"
+
+    def _qstat_table(self, selected):
+        lines = ["Job id            Name             User              Time Use S Queue",
+                 "----------------  ---------------- ----------------  -------- - -----"]
+        for job_id, job in selected:
+            lines.append("%-17s %-16s %-17s %8s %s %s" % (job_id[:17], job["Job_Name"][:16], job["Job_Owner"].split("@")[0][:16], "0",
+                                                         job["job_state"], job["queue"]))
+        return "\n".join(lines) + "\n" if selected else ""
+
+    def _qstat_queues(self):
+        states = [job["job_state"] for job in self.jobs.itervalues()]
+        lines = ["Queue              Max   Tot Ena Str   Que   Run   Hld   Wat   Trn   Ext Type",
+                 "---------------- ----- ----- --- --- ----- ----- ----- ----- ----- ----- ----",
+                 "%-16s %5d %5d yes yes %5d %5d %5d %5d %5d %5d Exec" % ("workq", 0, len(states), states.count("Q"), states.count("R"),
+                                                                        states.count("H"), states.count("W"), states.count("T"),
+                                                                        states.count("E"))]
+        return "\n".join(lines) + "\n"
+
+    def _pbsnodes(self, args, stdin_data):
+        opts, names = getopt.gnu_getopt(args, "aorlF:vSj")
+        opts = dict(opts)
+        if "-o" in opts or "-r" in opts:
+            now = int(time.time())
+            for name in names:
+                node = self._node(name)
+                states = [x for x in node["state"].split(",") if x != "offline"]
+                if "-o" in opts:
+                    states.append("offline")
+                state = ",".join([x for x in states if x != "free" or len(states) == 1]) or "free"
+                if state != node["state"]:
+                    node["state"] = state
+                    node["last_state_change_time"] = now
+            return ""
+
+        nodes = [(name, self._node(name)) for name in names] if names else self.nodes.items()
+        if not nodes:
+            raise PBSError("Server has no node list")
+
+        if opts.get("-F") == "json":
+            return json.dumps(OrderedDict([("timestamp", int(time.time())),
+                                           ("pbs_version", PBS_VERSION),
+                                           ("pbs_server", self.server_name),
+                                           ("nodes", OrderedDict(nodes))]), indent=4, separators=(",", ":")) + "\n"
+
+        buf = []
+        for name, node in nodes:
+            buf.append("%s\n" % name)
+            for key, value in node.iteritems():
+                if isinstance(value, dict):
+                    for sub_key, sub_value in value.iteritems():
+                        buf.append("     %s.%s = %s\n" % (key, sub_key, sub_value))
+                elif isinstance(value, list):
+                    buf.append("     %s = %s\n" % (key, ", ".join(value)))
+                else:
+                    buf.append("     %s = %s\n" % (key, value))
+            buf.append("\n")
+        return "".join(buf)
+
+    def _node(self, name):
+        if name not in self.nodes:
+            raise PBSError("Unknown node  %s" % name)
+        return self.nodes[name]
+
+    def _qmgr(self, args, stdin_data):
+        if args == ["--version"]:
+            return "pbs_version = %s\n" % PBS_VERSION
+        opts, _ = getopt.gnu_getopt(args, "c:aenz")
+        opts = dict(opts)
+        script = opts["-c"] if "-c" in opts else stdin_data
+
+        # like qmgr reading a script, every directive is attempted and the exit code reflects the last failure.
+        out = []
+        errors = []
+        code = 0
+        for line in script.split("\n"):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                out.append(self._qmgr_directive(line) or "")
+            except PBSError as e:
+                toks = line.split()
+                errors.append("qmgr obj=%s svr=default: %s\n" % (toks[2] if len(toks) > 2 else "", str(e)))
+                code = e.code
+        return "".join(out), "".join(errors), code
+
+    def _qmgr_directive(self, line):
+        toks = line.split(None, 3)
+        if len(toks) < 2:
+            raise PBSError("Illegal directive %s" % line)
+        verb = _QMGR_VERBS.get(toks[0][0].lower())
+        obj = _QMGR_OBJECTS.get(toks[1][0].lower())
+        if not verb or not obj:
+            raise PBSError("Illegal directive %s" % line)
+
+        if obj == "server":
+            attrs = " ".join(toks[2:])
+            if verb in ["list", "print"]:
+                return "Server %s\n%s\n" % (self.server_name, "".join(["    %s = %s\n" % x for x in self.server.iteritems()]))
+            for key, value in self._qmgr_attributes(attrs).iteritems():
+                if verb == "unset":
+                    self.server.pop(key, None)
+                else:
+                    self.server[key] = value
+            return
+
+        if obj == "queue":
+            return
+
+        name = toks[2] if len(toks) > 2 else None
+        attrs = self._qmgr_attributes(toks[3] if len(toks) > 3 else "")
+
+        if obj == "resource":
+            if verb == "list" or verb == "print":
+                names = [name] if name else self.resources.keys()
+                buf = []
+                for resource_name in names:
+                    if resource_name not in self.resources:
+                        raise PBSError("Unknown resource")
+                    buf.append("Resource %s\n" % resource_name)
+                    buf.extend(["    %s = %s\n" % x for x in self.resources[resource_name].iteritems()])
+                    buf.append("\n")
+                return "".join(buf)
+            if verb == "create":
+                if name in self.resources:
+                    raise PBSError("Duplicate entry in list")
+                self.resources[name] = OrderedDict([("type", attrs.get("type", "long")), ("flag", attrs.get("flag", ""))])
+            elif verb == "delete":
+                if self.resources.pop(name, None) is None:
+                    raise PBSError("Unknown resource")
+            return
+
+        # nodes
+        if verb == "create":
+            if name in self.nodes:
+                raise PBSError("Node name already exists")
+            # until its mom reports in
+            node = self.add_node(name, state="state-unknown,down")
+            self._qmgr_set_node(node, attrs)
+        elif verb == "delete":
+            node = self._node(name)
+            if node.get("jobs"):
+                raise PBSError("Request invalid for state of node")
+            self.nodes.pop(name)
+        elif verb == "set":
+            self._qmgr_set_node(self._node(name), attrs)
+        elif verb == "unset":
+            node = self._node(name)
+            for key in attrs:
+                if key.startswith("resources_available."):
+                    node["resources_available"].pop(key.split(".", 1)[1], None)
+                else:
+                    node.pop(key, None)
+        else:
+            names = [name] if name else self.nodes.keys()
+            buf = []
+            for node_name in names:
+                node = self._node(node_name)
+                buf.append("Node %s\n" % node_name)
+                for key, value in node.iteritems():
+                    if isinstance(value, dict):
+                        buf.extend(["    %s.%s = %s\n" % (key, k, v) for k, v in value.iteritems()])
+                    elif not isinstance(value, list):
+                        buf.append("    %s = %s\n" % (key, value))
+                buf.append("\n")
+            return "".join(buf)
+
+    def _qmgr_attributes(self, expr):
+        '''
+            'resources_available.ncpus = 4, comment = "a, b"' or 'type=string,flag=h' -> OrderedDict
+        '''
+        attrs = OrderedDict()
+        for match in re.finditer(r'\s*([\w.]+)\s*[+-]?=\s*("[^"]*"|[^,]*)\s*,?', expr):
+            attrs[match.group(1)] = match.group(2).strip().strip('"')
+        if expr.strip() and not attrs:
+            # unset takes bare names
+            for key in expr.split(","):
+                attrs[key.strip()] = None
+        return attrs
+
+    def _qmgr_set_node(self, node, attrs):
+        for key, value in attrs.iteritems():
+            if key.startswith("resources_available."):
+                resource = key.split(".", 1)[1]
+                if resource == "ncpus":
+                    value = int(value)
+                    node["pcpus"] = value
+                node["resources_available"][resource] = value
+            elif key == "state":
+                node["state"] = value
+                node["last_state_change_time"] = int(time.time())
+            else:
+                node[key] = value
+
+    def _qalter(self, args, stdin_data):
+        opts, job_ids = getopt.gnu_getopt(args, "l:N:W:h:")
+        resources = OrderedDict()
+        name = None
+        for opt, value in opts:
+            if opt == "-l":
+                resources.update(_parse_resource_args(value))
+            elif opt == "-N":
+                name = value
+        for job_id in [x for arg in job_ids for x in arg.split(",") if x]:
+            job, _ = self._find_job(job_id)
+            job["Resource_List"].update(resources)
+            if name:
+                job["Job_Name"] = name
+            job["mtime"] = time.ctime()
+
+    def _qrls(self, args, stdin_data):
+        _, job_ids = getopt.gnu_getopt(args, "h:")
+        for job_id in job_ids:
+            job, _ = self._find_job(job_id)
+            if job["job_state"] == "H":
+                job["job_state"] = "Q"
+                job["Hold_Types"] = "n"
+                job["substate"] = "10"
+
+    def _qhold(self, args, stdin_data):
+        _, job_ids = getopt.gnu_getopt(args, "h:")
+        for job_id in job_ids:
+            job, _ = self._find_job(job_id)
+            if job["job_state"] == "Q":
+                job["job_state"] = "H"
+                job["Hold_Types"] = "u"
+                job["substate"] = "20"
+
+    def _qselect(self, args, stdin_data):
+        opts, _ = getopt.gnu_getopt(args, "s:q:N:u:l:JT")
+        selected = [x for job_id, job in self.jobs.iteritems() for x in self._expand(job_id, job, ("-T", "") in opts)]
+        if ("-T", "") in opts:
+            selected = [x for x in selected if "array_index" in x[1]]
+        for opt, value in opts:
+            if opt == "-s":
+                selected = [x for x in selected if x[1]["job_state"] in value]
+            elif opt == "-q":
+                selected = [x for x in selected if x[1]["queue"] == value]
+            elif opt == "-N":
+                selected = [x for x in selected if x[1]["Job_Name"] == value]
+            elif opt == "-u":
+                selected = [x for x in selected if x[1]["Job_Owner"].split("@")[0] in value.split(",")]
+            elif opt == "-J":
+                selected = [x for x in selected if x[1].get("array") == "True"]
+            elif opt == "-l":
+                for expr in value.split(","):
+                    selected = [x for x in selected if self._qselect_matches(x[1], expr)]
+        return "".join(["%s\n" % job_id for job_id, _ in selected])
+
+    def _qselect_matches(self, job, expr):
+        # ncpus.gt.4
+        resource, op, expected = expr.split(".", 2)
+        actual = job["Resource_List"].get(resource)
+        if actual is None:
+            return False
+        try:
+            actual, expected = float(actual), float(expected)
+        except ValueError:
+            pass
+        return {"eq": actual == expected, "ne": actual != expected, "lt": actual < expected, "le": actual <= expected,
+                "gt": actual > expected, "ge": actual >= expected}[op]
+
+    def _qsub(self, args, stdin_data):
+        opts, _ = getopt.gnu_getopt(args, "l:N:J:q:hW:")
+        resources = OrderedDict()
+        kwargs = {}
+        for opt, value in opts:
+            if opt == "-l":
+                resources.update(_parse_resource_args(value))
+            elif opt == "-N":
+                kwargs["name"] = value
+            elif opt == "-J":
+                kwargs["array_range"] = value
+            elif opt == "-q":
+                kwargs["queue"] = value
+            elif opt == "-h":
+                kwargs["hold"] = True
+        kwargs["select"] = resources.pop("select", "1:ncpus=%s" % resources.get("ncpus", 1))
+        kwargs["place"] = resources.pop("place", "pack")
+        kwargs.update(resources)
+        return self.qsub(**kwargs) + "\n"
+
+    def _qrun(self, args, stdin_data):
+        opts, job_ids = getopt.gnu_getopt(args, "H:a")
+        opts = dict(opts)
+        if "-H" not in opts:
+            raise PBSError("this server has no scheduler, -H is required")
+        exec_vnode = opts["-H"]
+        if not exec_vnode.startswith("("):
+            exec_vnode = "+".join(["(%s)" % x for x in exec_vnode.split("+")])
+        for job_id in job_ids:
+            self.qrun(job_id, exec_vnode)
+
+    def _qdel(self, args, stdin_data):
+        _, job_ids = getopt.gnu_getopt(args, "Wx")
+        for job_id in job_ids:
+            self.qdel(job_id)
+
+
+def populate(state, num_jobs, num_nodes, ncpus=16, seed=0):
+    '''
+        Adds num_nodes hosts and num_jobs jobs, one running on each of 80% of the hosts and the rest queued, along with the
+        custom resources the cyclecloud cookbook defines.
+    '''
+    rand = random.Random(seed)
+    for name, flag in [("slot_type", "h"), ("group_id", "h"), ("ungrouped", "h"), ("instance_id", "h"), ("machinetype", "h"),
+                       ("nodearray", "h")]:
+        state.resources[name] = OrderedDict([("type", "string"), ("flag", flag)])
+
+    busy_nodes = int(num_nodes * .8)
+    for n in range(num_nodes):
+        name = "ip-%08x" % n
+        state.add_node(name, ncpus=ncpus, mem="%dgb" % (ncpus * 4), slot_type="execute", nodearray="execute", machinetype="Standard_D16_v3",
+                       group_id="group-%d" % (n % 10), ungrouped="false", instance_id="i-%d" % n)
+        if n < busy_nodes and n < num_jobs:
+            job_id = state.qsub(select="1:ncpus=%d" % ncpus, place="excl")
+            state.qrun(job_id, "(%s:ncpus=%d)" % (name, ncpus))
+
+    mix = [(.4, lambda: state.qsub(select="1:ncpus=1", array_range="1-%d" % rand.choice([10, 100]))),
+           (.2, lambda: state.qsub(select="%d:ncpus=%d+1:ncpus=4" % (rand.choice([2, 4, 8]), ncpus), place="scatter:excl:group=group_id")),
+           (.2, lambda: state.qsub(select="1:ncpus=%d" % rand.choice([8, 16]), place="excl")),
+           (.2, lambda: state.qsub(select="1:ncpus=%d:mem=%dgb" % (rand.choice([1, 2, 4]), rand.choice([1, 4, 8])), hold=rand.random() < .1))]
+    for _ in range(max(0, num_jobs - busy_nodes)):
+        r = rand.random()
+        for fraction, qsub in mix:
+            r -= fraction
+            if r <= 0:
+                break
+        qsub()
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        stdin_data = self.rfile.read(request["stdin"]) if request["stdin"] else ""
+        state = self.server.state
+        with state.lock:
+            stdout, stderr, code = state.run(request["argv"], stdin_data)
+        self.wfile.write("%d %d %d\n" % (code, len(stdout), len(stderr)))
+        self.wfile.write(stdout)
+        self.wfile.write(stderr)
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+# The commands themselves, kept to the standard library and run with -S so that they start as quickly as python can.
+_CLIENT = '''#!%(python)s -S
+import json, os, socket, sys
+argv = ["%(command)s"] + sys.argv[1:]
+reads_stdin = (argv[0] == "qmgr" and "-c" not in argv and "--version" not in argv) or (argv[0] == "qsub" and len(argv) == 1)
+stdin_data = sys.stdin.read() if reads_stdin else ""
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+sock.connect(os.environ.get("MOCKPBS_SOCKET", "%(socket_path)s"))
+sock.sendall(json.dumps({"argv": argv, "stdin": len(stdin_data)}) + "\\n" + stdin_data)
+fr = sock.makefile("rb")
+code, stdout_len, stderr_len = [int(x) for x in fr.readline().split()]
+sys.stdout.write(fr.read(stdout_len))
+sys.stderr.write(fr.read(stderr_len))
+sys.exit(code)
+'''
+
+
+def install(bin_dir, socket_path):
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    for command in COMMANDS:
+        path = os.path.join(bin_dir, command)
+        with open(path, "w") as fw:
+            fw.write(_CLIENT % {"python": sys.executable, "command": command, "socket_path": socket_path})
+        os.chmod(path, 0755)
+
+
+def start(state, socket_path, bin_dir=None):
+    '''
+        Serves state on socket_path from a background thread, installing the commands into bin_dir if given.
+        Returns the server, call shutdown() on it when done.
+    '''
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _Server(socket_path, _Handler)
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    if bin_dir:
+        install(bin_dir, socket_path)
+    return server
+
+
+def _timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        result = func()
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench(num_jobs, num_nodes, repeat=3, log=sys.stderr):
+    import fork_server
+    import pbs_driver
+
+    state = PBSState()
+    populate(state, num_jobs, num_nodes)
+    tempdir = tempfile.mkdtemp()
+    server = start(state, os.path.join(tempdir, "pbs.sock"), os.path.join(tempdir, "bin"))
+    runner = fork_server.ForkServer()
+    try:
+        backend = pbs_driver.CLIBackend(os.path.join(tempdir, "bin"), runner)
+        results = OrderedDict()
+        # like autostart, which still holds the parsed jobs while it parses pbsnodes
+        parsed_outputs = []
+        for name, args, parse in [("qstat_running", [backend._bin("qstat"), "-f", "-w", "-t", "-r"], pbs_driver._from_qstat),
+                                  ("qstat_queued", [backend._bin("qstat"), "-f", "-w", "-i"], pbs_driver._from_qstat),
+                                  ("pbsnodes", [backend._bin("pbsnodes"), "-a", "-F", "json"], pbs_driver._from_pbsnodes_json),
+                                  ("qmgr_list_resource", [backend._bin("qmgr"), "-c", "list resource"], pbs_driver._from_qmgr_list_resource)]:
+            call_seconds, (stdout, stderr, code) = _timed(lambda: runner.call(args), repeat)
+            if code != 0:
+                raise RuntimeError("%s failed (%d): %s" % (" ".join(args), code, stderr))
+            parse_seconds, parsed = _timed(lambda: parse(stdout), repeat)
+            parsed_outputs.append(parsed)
+            results[name] = OrderedDict([("call_seconds", call_seconds),
+                                         ("parse_seconds", parse_seconds),
+                                         ("output_bytes", len(stdout)),
+                                         ("records", len(parsed))])
+            log.write("%-20s %8.3fs call %8.3fs parse %10d bytes %8d records\n" % (name, call_seconds, parse_seconds, len(stdout), len(parsed)))
+            if name == "pbsnodes":
+                pbsnodes_stdout = stdout
+
+        # against what _from_pbsnodes_json replaced. Interleaved, as the difference is within the drift between runs.
+        timings = {"_from_pbsnodes_json": [], "json.loads": []}
+        for _ in range(max(5, repeat)):
+            for name, parse in [("_from_pbsnodes_json", pbs_driver._from_pbsnodes_json), ("json.loads", json.loads)]:
+                started = time.time()
+                parse(pbsnodes_stdout)
+                timings[name].append(time.time() - started)
+        for name, seconds in sorted(timings.iteritems()):
+            median = sorted(seconds)[len(seconds) / 2]
+            results["pbsnodes_parse_" + name] = OrderedDict([("median_seconds", median)])
+            log.write("%-20s %8.3fs median parse of pbsnodes\n" % (name, median))
+        return results
+    finally:
+        runner.close()
+        server.shutdown()
+        shutil.rmtree(tempdir)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="In-memory stand-in for pbs_server and the PBS commands")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--bin-dir", required=True, help="Where to install qstat, pbsnodes etc.")
+    serve_parser.add_argument("--socket", help="Defaults to bin_dir/../pbs.sock")
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("--repeat", type=int, default=3)
+    bench_parser.add_argument("--output", help="Write the results as JSON to this path")
+    for subparser in [serve_parser, bench_parser]:
+        subparser.add_argument("--jobs", type=int, default=0)
+        subparser.add_argument("--nodes", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        results = bench(args.jobs or 10000, args.nodes or 1000, args.repeat)
+        if args.output:
+            with open(args.output, "w") as fw:
+                json.dump({"recorded": time.time(), "jobs": args.jobs, "nodes": args.nodes, "commands": results}, fw, indent=2)
+        return 0
+
+    state = PBSState()
+    populate(state, args.jobs, args.nodes)
+    socket_path = args.socket or os.path.join(os.path.dirname(os.path.abspath(args.bin_dir)), "pbs.sock")
+    server = start(state, socket_path, args.bin_dir)
+    sys.stderr.write("Serving %d jobs and %d nodes on %s, commands are in %s\n" % (len(state.jobs), len(state.nodes), socket_path, args.bin_dir))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
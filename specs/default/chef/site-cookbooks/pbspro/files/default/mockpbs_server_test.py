@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import mockpbs_server
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.state = mockpbs_server.PBSState()
+        self.state.add_node("ip-1", ncpus=4, group_id="g1")
+        self.state.add_node("ip-2", ncpus=4, group_id="g1")
+
+    def _run(self, *argv, **kwargs):
+        return self.state.run(list(argv), kwargs.get("stdin_data", ""))
+
+    def test_qstat(self):
+        self.assertEquals(("", "", 0), self._run("qstat", "-f", "-w", "-i"))
+
+        queued = self.state.qsub(select="2:ncpus=2", place="scatter")
+        running = self.state.qsub(select="1:ncpus=4")
+        self.state.qrun(running, "(ip-1:ncpus=4)")
+
+        stdout, _, code = self._run("/opt/pbs/bin/qstat", "-f", "-w", "-i")
+        self.assertEquals(0, code)
+        self.assertTrue(stdout.startswith("Job Id: %s\n    Job_Name = STDIN\n" % queued))
+        self.assertTrue("    Resource_List.select = 2:ncpus=2\n" in stdout)
+        self.assertTrue("    Resource_List.ncpus = 4\n" in stdout)
+        self.assertFalse(running in stdout)
+        self.assertTrue(stdout.endswith("\n\n"))
+
+        stdout, _, _ = self._run("qstat", "-f", "-w", "-t", "-r")
+        self.assertTrue(stdout.startswith("Job Id: %s\n" % running))
+        self.assertTrue("    exec_vnode = (ip-1:ncpus=4)\n" in stdout)
+
+        self.assertEquals(("", "qstat: Unknown Job Id 99.pbsserver\n", 153), self._run("qstat", "-f", "99"))
+
+        stdout, _, _ = self._run("qstat", "-Q")
+        self.assertEquals(["workq"], [x.split()[0] for x in stdout.split("\n")[2:] if x.strip()])
+
+    def test_qstat_folds_without_w(self):
+        self.state.qsub(select="1:ncpus=1:" + ":".join(["r%d=%d" % (n, n) for n in range(30)]))
+        stdout, _, _ = self._run("qstat", "-f")
+        self.assertTrue("\n\t" in stdout)
+        self.assertTrue(max([len(x) for x in stdout.split("\n")]) <= 79)
+
+    def test_arrays(self):
+        array_id = self.state.qsub(array_range="1-3")
+        self.assertEquals("1[].pbsserver", array_id)
+        self.state.qrun("1[2]", "(ip-2:ncpus=1)")
+
+        stdout, _, _ = self._run("qstat", "-f", "-w", "-t", "-r")
+        self.assertEquals(["Job Id: 1[2].pbsserver"], [x for x in stdout.split("\n") if x.startswith("Job Id")])
+        self.assertTrue("    array_id = 1[].pbsserver\n" in stdout)
+
+        # without -t the subjobs are not reported, the array job is begun (B)
+        stdout, _, _ = self._run("qstat", "-f", "-w", "-i")
+        self.assertEquals("", stdout)
+        stdout, _, _ = self._run("qstat", "-f", "-w")
+        self.assertTrue("    array_state_count = Queued:2 Running:1 Exiting:0 Expired:0 \n" in stdout)
+
+        self._run("qdel", "1[2]")
+        self.assertEquals("free", self.state.nodes["ip-2"]["state"])
+        self.assertTrue("last_used_time" in self.state.nodes["ip-2"])
+
+    def test_pbsnodes(self):
+        stdout, _, code = self._run("pbsnodes", "-a", "-F", "json")
+        self.assertEquals(0, code)
+        nodes = json.loads(stdout)["nodes"]
+        self.assertEquals(["ip-1", "ip-2"], sorted(nodes.keys()))
+        self.assertEquals(4, nodes["ip-1"]["resources_available"]["ncpus"])
+        self.assertEquals("free", nodes["ip-1"]["state"])
+
+        job_id = self.state.qsub(select="1:ncpus=4")
+        self.state.qrun(job_id, "(ip-1:ncpus=4)")
+        self._run("pbsnodes", "-o", "ip-1")
+        self.assertEquals("job-busy,offline", self.state.nodes["ip-1"]["state"])
+        self.assertEquals(["1.pbsserver/%d" % n for n in range(4)], self.state.nodes["ip-1"]["jobs"])
+        self._run("qdel", job_id)
+        self.assertEquals("offline", self.state.nodes["ip-1"]["state"])
+        self._run("pbsnodes", "-r", "ip-1")
+        self.assertEquals("free", self.state.nodes["ip-1"]["state"])
+
+        self.state.nodes.clear()
+        stdout, stderr, code = self._run("pbsnodes", "-a", "-F", "json")
+        self.assertEquals(1, code)
+        self.assertTrue("Server has no node list" in stderr)
+
+    def test_qmgr(self):
+        self.assertEquals(("pbs_version = 18.1.4\n", "", 0), self._run("qmgr", "--version"))
+
+        script = "\n".join(["create resource slot_type type=string,flag=h",
+                            "c n ip-3",
+                            "s n ip-3 resources_available.ncpus = 16",
+                            "set node ip-3 resources_available.slot_type = execute",
+                            "delete node ip-404"])
+        stdout, stderr, code = self._run("qmgr", stdin_data=script)
+        self.assertEquals(1, code)
+        self.assertEquals("qmgr obj=ip-404 svr=default: Unknown node  ip-404\n", stderr)
+        # the directives before the failure were applied
+        node = self.state.nodes["ip-3"]
+        self.assertEquals("state-unknown,down", node["state"])
+        self.assertEquals(16, node["resources_available"]["ncpus"])
+        self.assertEquals("execute", node["resources_available"]["slot_type"])
+
+        stdout, _, _ = self._run("qmgr", "-c", "list resource")
+        self.assertEquals("Resource slot_type\n    type = string\n    flag = h\n\n", stdout)
+
+        self.assertEquals(0, self._run("qmgr", "-c", "delete node ip-3")[2])
+        self.assertFalse("ip-3" in self.state.nodes)
+
+    def test_qalter_qrls_qselect(self):
+        first = self.state.qsub(select="1:ncpus=1", hold=True)
+        second = self.state.qsub(select="1:ncpus=8")
+
+        # the form PBSDriver.alter uses
+        self.assertEquals(0, self._run("qalter", "%s,%s" % (first, second), "-l", "slot_type=execute:group_id=g1")[2])
+        self.assertEquals("g1", self.state.jobs[second]["Resource_List"]["group_id"])
+
+        self.assertEquals(first + "\n", self._run("qselect", "-s", "H")[0])
+        self.assertEquals(second + "\n", self._run("qselect", "-l", "ncpus.gt.4")[0])
+        self._run("qrls", first)
+        self.assertEquals("%s\n%s\n" % (first, second), self._run("qselect", "-s", "Q")[0])
+
+    def test_commands(self):
+        tempdir = tempfile.mkdtemp()
+        server = mockpbs_server.start(self.state, os.path.join(tempdir, "pbs.sock"), os.path.join(tempdir, "bin"))
+        try:
+            qsub = subprocess.Popen([os.path.join(tempdir, "bin", "qsub"), "-l", "select=1:ncpus=2", "-N", "job"],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            stdout, _ = qsub.communicate("sleep 10\n")
+            self.assertEquals("1.pbsserver\n", stdout)
+
+            qstat = subprocess.Popen([os.path.join(tempdir, "bin", "qstat"), "-f", "-w", "2"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = qstat.communicate()
+            self.assertEquals(153, qstat.returncode)
+            self.assertEquals("qstat: Unknown Job Id 2.pbsserver\n", stderr)
+
+            qmgr = subprocess.Popen([os.path.join(tempdir, "bin", "qmgr")], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            qmgr.communicate("c n ip-3\n")
+            self.assertEquals(0, qmgr.returncode)
+            self.assertTrue("ip-3" in self.state.nodes)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Registers execute nodes with pbs_server in batches.
+
+Every execute node used to add itself during converge with its own chain of qmgr calls against the master (create node,
+then one call per resource, then pbsnodes -r), so a burst of nodes joining at once queued up on pbs_server. Instead, a node
+hands a join record to the registrar running on the master:
+
+    {"hostname": "ip-0A000004", "ncpus": 16, "slot_type": "execute", "group_id": "pg0", "ungrouped": "false",
+     "instance_id": "...", "resources": {"disk": "100G"}}
+
+as spool/pending/<hostname>.json, the spool being a directory the execute nodes share with the master (see execute.rb).
+The registrar waits window seconds after the first record of a batch for more to arrive, registers the whole batch with
+one pbsnodes, one qmgr script and one pbsnodes -r, then acknowledges each node with
+{"hostname": ..., "status": "ok" or "failed", "error": ...} as spool/acks/<hostname>.json.
+
+    python node_registrar.py serve --spool /sched/pbs/registrar --window 2
+'''
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import fork_server
+import pbscc
+
+
+_NAME = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+# the attributes of a join record that become resources_available, besides the custom resources
+_RESOURCES = ["ncpus", "slot_type", "group_id", "ungrouped", "instance_id"]
+
+
+def parse_join(data):
+    '''
+        Validates a join record (a dict or its JSON) and returns it as {"hostname": ..., "resources": OrderedDict}. Raises
+        ValueError for anything that can not safely be written into a qmgr script.
+    '''
+    record = json.loads(data) if isinstance(data, basestring) else data
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object, got %r" % record)
+
+    hostname = str(record.get("hostname") or "").split(".")[0]
+    if not _NAME.match(hostname):
+        raise ValueError("Invalid hostname %r" % record.get("hostname"))
+
+    resources = OrderedDict()
+    for key in _RESOURCES:
+        if record.get(key) not in [None, ""]:
+            resources[key] = record[key]
+    for key, value in sorted((record.get("resources") or {}).iteritems()):
+        resources[key] = value
+
+    for key, value in resources.items():
+        value = str(value).lower() if isinstance(value, bool) else str(value)
+        if not _NAME.match(key) or '"' in value or "\n" in value:
+            raise ValueError("Invalid resource %s=%r for %s" % (key, value, hostname))
+        resources[key] = value
+
+    return {"hostname": hostname, "resources": resources}
+
+
+def qmgr_script(records, existing):
+    '''
+        One script for the whole batch. Nodes that are not in existing are created first.
+    '''
+    lines = []
+    for record in records:
+        hostname = record["hostname"]
+        if hostname.lower() not in existing:
+            lines.append("create node %s" % hostname)
+        for key, value in record["resources"].iteritems():
+            lines.append('set node %s resources_available.%s = "%s"' % (hostname, key, value))
+    return "\n".join(lines) + "\n"
+
+
+class Registrar:
+    '''
+        Collects join records from any number of threads and registers them in batches of at most max_batch, from its own
+        thread. runner runs the PBS commands, anything with call(args, stdin_data) returning (stdout, stderr, returncode),
+        fork_server by default.
+    '''
+
+    def __init__(self, bin_dir="/opt/pbs/bin", runner=None, window=2.0, max_batch=500):
+        self.bin_dir = bin_dir
+        self.runner = runner or fork_server
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.batches = 0
+        self.registered = 0
+
+    def _bin(self, name):
+        return os.path.join(self.bin_dir, name) if self.bin_dir else name
+
+    def submit(self, record, callback):
+        '''
+            Queues a parse_join'ed record. callback(ack) is called from the registrar's thread once the batch it ends up in
+            has been registered.
+        '''
+        with self._condition:
+            self._pending.append((record, callback))
+            self._condition.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped and not self._pending:
+                    return
+
+            # let the rest of a burst arrive
+            deadline = time.time() + self.window
+            with self._condition:
+                while len(self._pending) < self.max_batch and not self._stopped and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+
+            try:
+                acks = self.register([record for record, _ in batch])
+            except Exception as e:
+                pbscc.error("Could not register %d nodes: %s" % (len(batch), str(e)))
+                acks = dict([(record["hostname"], {"hostname": record["hostname"], "status": "failed", "error": str(e)})
+                             for record, _ in batch])
+
+            for record, callback in batch:
+                try:
+                    callback(acks[record["hostname"]])
+                except Exception as e:
+                    pbscc.warn("Could not acknowledge %s: %s" % (record["hostname"], str(e)))
+
+    def register(self, records):
+        '''
+            Registers records with pbs_server and returns {hostname: ack}. A hostname that appears more than once in a batch is
+            registered once, with its last record.
+        '''
+        by_hostname = OrderedDict([(record["hostname"], record) for record in records])
+        records = by_hostname.values()
+
+        stdout, stderr, code = self.runner.call([self._bin("pbsnodes"), "-a", "-F", "json"])
+        if code == 0:
+            nodes = json.loads(stdout).get("nodes", {})
+        elif code == 1 and "Server has no node list" in stderr:
+            nodes = {}
+        else:
+            raise RuntimeError("pbsnodes failed with exit code %s: %s" % (code, stderr))
+        existing = dict([(name.lower(), node) for name, node in nodes.iteritems()])
+
+        errors = {}
+        stdout, stderr, code = self.runner.call([self._bin("qmgr")], qmgr_script(records, existing))
+        if code != 0:
+            # qmgr carries on past a failed directive, and reports each one as qmgr obj=<node> svr=default: <error>
+            for line in stderr.splitlines():
+                match = re.match(r"qmgr obj=(\S+) svr=\S+: (.*)", line)
+                if match:
+                    errors.setdefault(match.group(1), match.group(2).strip())
+            if not errors:
+                raise RuntimeError("qmgr failed with exit code %s: %s" % (code, stderr))
+
+        # a host name can be reused by a new instance while its old node is still offline
+        offline = [record["hostname"] for record in records if record["hostname"] not in errors and
+                   "offline" in existing.get(record["hostname"].lower(), {}).get("state", "").split(",")]
+        if offline:
+            stdout, stderr, code = self.runner.call([self._bin("pbsnodes"), "-r"] + offline)
+            if code != 0:
+                pbscc.warn("Could not clear offline from %s: %s" % (offline, stderr))
+
+        acks = {}
+        for record in records:
+            hostname = record["hostname"]
+            error = errors.get(hostname)
+            acks[hostname] = {"hostname": hostname, "status": "failed" if error else "ok", "error": error}
+
+        self.batches += 1
+        self.registered += len(records) - len(errors)
+        pbscc.info("Registered %d nodes in one batch, %d failed" % (len(records) - len(errors), len(errors)))
+        return acks
+
+
+class SpoolWatcher:
+    '''
+        Picks up pending/<hostname>.json join records, writing them as *.json.tmp and renaming them is enough to make
+        them visible atomically. Acknowledgements go to acks/<hostname>.json. A record that can not be parsed is acknowledged
+        as failed right away.
+    '''
+
+    def __init__(self, registrar, directory, poll_interval=0.5):
+        self.registrar = registrar
+        self.pending_dir = os.path.join(directory, "pending")
+        self.processing_dir = os.path.join(directory, "processing")
+        self.acks_dir = os.path.join(directory, "acks")
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+        for path in [self.pending_dir, self.processing_dir, self.acks_dir]:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def scan(self):
+        '''
+            Submits every pending record and returns how many were found.
+        '''
+        found = 0
+        for file_name in sorted(os.listdir(self.pending_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            processing_path = os.path.join(self.processing_dir, file_name)
+            try:
+                # so that a second scan does not submit it again
+                os.rename(os.path.join(self.pending_dir, file_name), processing_path)
+            except OSError:
+                continue
+            found += 1
+
+            hostname = file_name[:-len(".json")]
+            try:
+                with open(processing_path) as fr:
+                    record = parse_join(fr.read())
+            except Exception as e:
+                pbscc.warn("Invalid join record %s: %s" % (file_name, str(e)))
+                self._ack(processing_path, hostname, {"hostname": hostname, "status": "failed", "error": str(e)})
+                continue
+
+            self.registrar.submit(record, lambda ack, processing_path=processing_path, hostname=hostname:
+                                  self._ack(processing_path, hostname, ack))
+        return found
+
+    def _ack(self, processing_path, hostname, ack):
+        tmp_path = os.path.join(self.acks_dir, hostname + ".json.tmp")
+        with open(tmp_path, "w") as fw:
+            json.dump(ack, fw)
+        os.rename(tmp_path, os.path.join(self.acks_dir, hostname + ".json"))
+        if os.path.exists(processing_path):
+            os.remove(processing_path)
+
+    def start(self):
+        # records left in processing by a registrar that was stopped mid batch
+        for file_name in os.listdir(self.processing_dir):
+            os.rename(os.path.join(self.processing_dir, file_name), os.path.join(self.pending_dir, file_name))
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    self.scan()
+                except Exception as e:
+                    pbscc.error("Could not scan %s: %s" % (self.pending_dir, str(e)))
+                self._stopped.wait(self.poll_interval)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def main(argv):
+    import argparse
+    import logging
+    parser = argparse.ArgumentParser(description="Registers execute nodes with pbs_server in batches")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--spool", required=True, help="Directory shared with the execute nodes, see SpoolWatcher")
+    serve_parser.add_argument("--bin-dir", default="/opt/pbs/bin")
+    serve_parser.add_argument("--window", type=float, default=2.0, help="Seconds to wait for more nodes before registering")
+    serve_parser.add_argument("--max-batch", type=int, default=500)
+    serve_parser.add_argument("--poll-interval", type=float, default=0.5)
+    serve_parser.add_argument("--log-file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    pbscc.set_application_name("node_registrar")
+
+    registrar = Registrar(args.bin_dir, window=args.window, max_batch=args.max_batch)
+    registrar.start()
+    SpoolWatcher(registrar, args.spool, args.poll_interval).start()
+    pbscc.info("Registering nodes from %s" % args.spool)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        registrar.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mockpbs_server
+import node_registrar
+
+
+class MockRunner:
+
+    def __init__(self, state, qmgr_errors=None):
+        self.state = state
+        self.qmgr_errors = qmgr_errors
+        self.calls = []
+
+    def call(self, args, stdin_data=None, timeout=None):
+        self.calls.append((os.path.basename(args[0]), args[1:], stdin_data))
+        stdout, stderr, code = self.state.run(args, stdin_data or "")
+        if self.qmgr_errors and os.path.basename(args[0]) == "qmgr":
+            return stdout, self.qmgr_errors, 1
+        return stdout, stderr, code
+
+
+def join(hostname, **attrs):
+    record = {"hostname": hostname, "ncpus": 4, "slot_type": "execute", "group_id": "pg0", "ungrouped": False,
+              "instance_id": "i-" + hostname}
+    record.update(attrs)
+    return record
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.state = mockpbs_server.PBSState()
+        self.runner = MockRunner(self.state)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def test_register_batch(self):
+        self.state.add_node("ip-2", state="offline", ncpus=4)
+        registrar = node_registrar.Registrar(bin_dir=None, runner=self.runner)
+        records = [node_registrar.parse_join(join("ip-1.cluster.local", resources={"disk": "100G"})),
+                   node_registrar.parse_join(join("ip-2"))]
+        acks = registrar.register(records)
+
+        self.assertEquals("ok", acks["ip-1"]["status"])
+        self.assertEquals("ok", acks["ip-2"]["status"])
+        # one pbsnodes, one qmgr and one pbsnodes -r for the whole batch
+        self.assertEquals([("pbsnodes", ["-a", "-F", "json"]), ("qmgr", []), ("pbsnodes", ["-r", "ip-2"])],
+                          [(x[0], x[1]) for x in self.runner.calls])
+        self.assertEquals(1, self.runner.calls[1][2].count("create node"))
+
+        ip1 = self.state.nodes["ip-1"]["resources_available"]
+        self.assertEquals(4, ip1["ncpus"])
+        self.assertEquals("false", ip1["ungrouped"])
+        self.assertEquals("100G", ip1["disk"])
+        self.assertEquals("i-ip-2", self.state.nodes["ip-2"]["resources_available"]["instance_id"])
+        self.assertEquals("free", self.state.nodes["ip-2"]["state"])
+
+    def test_failed_hosts(self):
+        runner = MockRunner(self.state, "qmgr obj=ip-2 svr=default: Unauthorized Request\n")
+        registrar = node_registrar.Registrar(bin_dir=None, runner=runner)
+        acks = registrar.register([node_registrar.parse_join(join("ip-1")), node_registrar.parse_join(join("ip-2"))])
+        self.assertEquals("ok", acks["ip-1"]["status"])
+        self.assertEquals("failed", acks["ip-2"]["status"])
+        self.assertEquals("Unauthorized Request", acks["ip-2"]["error"])
+        self.assertEquals(1, registrar.registered)
+
+    def test_parse_join(self):
+        self.assertEquals("ip-1", node_registrar.parse_join('{"hostname": "ip-1.internal"}')["hostname"])
+        for bad in [join("ip-1; delete node ip-3"), join("ip-1", slot_type='execute"\nset server scheduling = false'),
+                    join("ip-1", resources={"a b": "1"}), join(""), "[]"]:
+            self.assertRaises(ValueError, node_registrar.parse_join, bad)
+
+    def test_batching(self):
+        registrar = node_registrar.Registrar(bin_dir=None, runner=self.runner, window=0.2)
+        acks = []
+        done = threading.Event()
+
+        def callback(ack):
+            acks.append(ack)
+            if len(acks) == 20:
+                done.set()
+
+        registrar.start()
+        try:
+            for n in range(20):
+                registrar.submit(node_registrar.parse_join(join("ip-%d" % n)), callback)
+            self.assertTrue(done.wait(5))
+        finally:
+            registrar.stop()
+        self.assertEquals(1, registrar.batches)
+        self.assertEquals(["ok"] * 20, [x["status"] for x in acks])
+        self.assertEquals(20, len(self.state.nodes))
+
+    def test_spool(self):
+        spool = os.path.join(self.tempdir, "spool")
+        registrar = node_registrar.Registrar(bin_dir=None, runner=self.runner, window=0)
+        watcher = node_registrar.SpoolWatcher(registrar, spool)
+        with open(os.path.join(spool, "pending", "ip-1.json"), "w") as fw:
+            json.dump(join("ip-1"), fw)
+        with open(os.path.join(spool, "pending", "ip-2.json"), "w") as fw:
+            fw.write("{not json")
+
+        registrar.start()
+        try:
+            self.assertEquals(2, watcher.scan())
+            self.assertEquals(0, watcher.scan())
+            ack_path = os.path.join(spool, "acks", "ip-1.json")
+            for _ in range(50):
+                if os.path.exists(ack_path):
+                    break
+                time.sleep(0.1)
+        finally:
+            registrar.stop()
+
+        with open(ack_path) as fr:
+            self.assertEquals("ok", json.load(fr)["status"])
+        with open(os.path.join(spool, "acks", "ip-2.json")) as fr:
+            self.assertEquals("failed", json.load(fr)["status"])
+        self.assertEquals([], os.listdir(os.path.join(spool, "processing")))
+        self.assertEquals(["ip-1"], self.state.nodes.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,7 @@
 # Licensed under the MIT License.
 #
 import cStringIO
+import gc
 from collections import OrderedDict
 
 import tandem_utils
@@ -43,12 +44,176 @@ JOB_STATE_WAITING = "W"
 JOB_STATE_EXPIRED = "X"
 
 
+# The per node attributes of `pbsnodes -a -F json` that are kept, everything else (resv, pcpus, sharing etc) is dropped while decoding.
+PBSNODES_FIELDS = ("state", "jobs", "resources_available", "resources_assigned", "last_state_change_time", "last_used_time",
+                   "comment")
+
+RUNNING_JOB_STATES = [JOB_STATE_RUNNING, JOB_STATE_SUSPEND]
+QUEUED_JOB_STATES = [JOB_STATE_QUEUED, JOB_STATE_HELD, JOB_STATE_WAITING]
+
+
+class CLIBackend:
+    '''
+        Backend that runs the PBS command line tools and parses their output.
+        
+        A backend provides running_jobs() and queued_jobs(), which return (raw, converter) such that converter(raw) is a list
+        of jobs in the form produced by _from_qstat, pbsnodes(fields), which returns {node_name: node} limited to the given
+        fields, set_offline(hostname), delete_host(hostname), create_hosts(hosts) and close(), which releases anything held for
+        the current cycle.
+        
+        runner, if given, runs the commands instead of tandem_utils - e.g. fork_server.ForkServer. It must have call(args),
+        returning (stdout, stderr, returncode), and check_call(args).
+    '''
+    
+    def __init__(self, bin_dir=None, runner=None):
+        self.bin_dir = bin_dir
+        self.runner = runner or tandem_utils
+    
+    def _bin(self, name):
+        return name if self.bin_dir is None else os.path.join(self.bin_dir, name)
+    
+    def running_jobs(self):
+        return self._get_jobs([self._bin("qstat"), "-f", "-w", "-t", "-r"])
+    
+    def queued_jobs(self):
+        return self._get_jobs([self._bin("qstat"), "-f", "-w", "-i"])
+    
+    def _get_jobs(self, args):
+        stdout, stderr, code = self.runner.call(args)
+        if code == 0:
+            return stdout, _from_qstat
+        elif code == _PBS_NOT_FOUND:
+            return "[]", json.loads
+        else:
+            tandem_utils.error_and_exit(stderr)
+    
+    def pbsnodes(self, fields=PBSNODES_FIELDS):
+        stdout, stderr, ret = self.runner.call([self._bin("pbsnodes"), "-a", "-F", "json"])
+        
+        if ret == 1 and 'Server has no node list' in stderr:
+            return {}
+        
+        if ret != 0:
+            raise RuntimeError(stderr)
+        
+        return _from_pbsnodes_json(stdout, fields)
+    
+    def set_offline(self, hostname):
+        self.runner.check_call([self._bin("pbsnodes"), "-o", hostname])
+        
+    def delete_host(self, hostname):
+        self.runner.check_call([self._bin("qmgr"), "-c", "delete node %s" % hostname])
+    
+    def create_hosts(self, hosts):
+        '''
+            Creates a vnode for each (hostname, attributes) in hosts, where attributes are node attributes like
+            {"resources_available.slot_type": "execute"}, in a single qmgr session. qmgr carries on past a directive that fails,
+            e.g. because a hostname does not resolve yet, so the other nodes are still created. Returns the hostnames that failed.
+        '''
+        if not hosts:
+            return []
+        
+        script = []
+        for hostname, attributes in hosts:
+            script.append("create node %s" % hostname)
+            for key, value in attributes.iteritems():
+                script.append('set node %s %s = "%s"' % (hostname, key, value))
+        stdout, stderr, code = self.runner.call([self._bin("qmgr")], "\n".join(script) + "\n")
+        if code == 0:
+            return []
+        
+        # qmgr obj=ip-0A000004 svr=default: Unknown node
+        failed = set(re.findall(r"qmgr obj=(\S+)", stderr))
+        ret = [hostname for hostname, _ in hosts if hostname in failed]
+        if not ret:
+            raise RuntimeError("qmgr failed with exit code %s: %s" % (code, stderr))
+        return ret
+    
+    def close(self):
+        pass
+
+
+class FakeBackend:
+    '''
+        In-process backend over plain job and node dicts, in the same form the other backends produce. Jobs are a list of
+        _from_qstat style dicts and nodes are {node_name: pbsnode}. Intended for tests and benchmarks of PBSDriver and
+        everything above it without a PBS server.
+    '''
+    
+    def __init__(self, jobs=None, nodes=None):
+        self.jobs = jobs if jobs is not None else []
+        self.nodes = nodes if nodes is not None else {}
+    
+    def running_jobs(self):
+        return [x for x in self.jobs if x["job_state"] in RUNNING_JOB_STATES], list
+    
+    def queued_jobs(self):
+        # like qstat -i without -t, array subjobs are not reported
+        return [x for x in self.jobs if x["job_state"] in QUEUED_JOB_STATES and not _is_subjob(x["job_id"])], list
+    
+    def pbsnodes(self, fields=PBSNODES_FIELDS):
+        return dict([(name, dict([(k, v) for k, v in node.iteritems() if k in fields])) for name, node in self.nodes.iteritems()])
+    
+    def set_offline(self, hostname):
+        node = self.nodes[hostname]
+        if "offline" not in node["state"].split(","):
+            node["state"] = "offline" if node["state"] == "free" else node["state"] + ",offline"
+    
+    def delete_host(self, hostname):
+        self.nodes.pop(hostname, None)
+    
+    def create_hosts(self, hosts):
+        for hostname, attributes in hosts:
+            node = {"state": "state-unknown,down", "jobs": [], "resources_assigned": {},
+                    "resources_available": {"host": hostname, "vnode": hostname}}
+            for key, value in attributes.iteritems():
+                if key.startswith("resources_available."):
+                    node["resources_available"][key.split(".", 1)[1]] = value
+                else:
+                    node[key] = value
+            self.nodes[hostname] = node
+        return []
+    
+    def close(self):
+        pass
+
+
+def _is_subjob(job_id):
+    # 1[2].server is a subjob of the array job 1[].server
+    return "[" in job_id and "[]" not in job_id
+
+
+def new_backend(name, bin_dir=None, runner=None):
+    '''
+        name is one of cli (default), ifl or fake. If the IFL library can not be loaded, falls back to the cli backend.
+        runner is passed on to the cli backend, see CLIBackend.
+    '''
+    name = (name or "cli").lower()
+    if name == "cli":
+        return CLIBackend(bin_dir, runner)
+    if name == "fake":
+        return FakeBackend()
+    if name == "ifl":
+        try:
+            import pbs_ifl
+            return pbs_ifl.IFLBackend(bin_dir, runner=runner)
+        except (ImportError, OSError) as e:
+            pbscc.warn("Could not load the PBS IFL library, falling back to the cli backend: %s" % str(e))
+            return CLIBackend(bin_dir, runner)
+    raise ValueError("Unknown PBS backend %s, expected one of cli, ifl or fake" % name)
+
+
 class PBSDriver(TandemDriver):
 
-    def __init__(self, bin_dir=None, version=None):
+    def __init__(self, bin_dir=None, version=None, backend=None, runner=None):
         TandemDriver.__init__(self)
         self.bin_dir = bin_dir
+        self.runner = runner or tandem_utils
         self.version = version if version else self._version()
+        self._resource_definitions = None
+        if backend is None or isinstance(backend, basestring):
+            backend = new_backend(backend, bin_dir, runner)
+        self.backend = backend
         
     def capabilities(self):
         return {
@@ -100,6 +265,20 @@ class PBSDriver(TandemDriver):
         # just return default values
         return {"resources": ["ncpus", "mem", "arch", "host", "vnode", "aoe", "slot_type", "group_id", "ungrouped", "instance_id", "ipv4", "disk"]}
             
+    def resource_definitions(self):
+        '''
+            Returns the types of the custom resources, e.g. {"disk": "size", "slot_type": "string"}, as reported by
+            `qmgr -c 'list resource'`. The result is cached for the lifetime of the driver.
+        '''
+        if self._resource_definitions is None:
+            stdout, stderr, code = self.runner.call([self._bin("qmgr"), "-c", "list resource"])
+            if code != 0:
+                pbscc.error("Could not list resources, falling back to untyped resource conversion. Error was %s" % stderr)
+                # don't cache the failure, we will try again next time.
+                return {}
+            self._resource_definitions = _from_qmgr_list_resource(stdout)
+        return self._resource_definitions
+            
     def _jobstatus(self, local_job_id_query=None):
         stdout, stderr, code = tandem_utils.call(self.qstat_args(local_job_id_query))
         return stdout, stderr, code, _from_qstat
@@ -152,48 +331,35 @@ class PBSDriver(TandemDriver):
         return [self._bin("qstat"), "-f", "-w"] + ([jobid] if jobid else [])
     
     def running_jobs(self):
-        return self._get_jobs([self._bin("qstat"), "-f", "-w", "-t", "-r"])
+        return self.backend.running_jobs()
     
     def queued_jobs(self):
-        return self._get_jobs([self._bin("qstat"), "-f", "-w", "-i"])
+        return self.backend.queued_jobs()
     
-    def _get_jobs(self, args):
-        stdout, stderr, code = tandem_utils.call(args)
-        if code == 0:
-            return stdout, _from_qstat
-        elif code == _PBS_NOT_FOUND:
-            return "[]", json.loads
-        else:
-            tandem_utils.error_and_exit(stderr)
+    def close(self):
+        '''
+            Releases anything the backend holds for the current cycle, i.e. the IFL connection.
+        '''
+        self.backend.close()
     
     def hosts(self, grouping=None, keyformatter=lambda x: x):
         return self.pbsnodes(grouping, keyformatter)
 
     def pbsnodes(self, grouping=None, keyformatter=lambda x: x):
-        stdout, stderr, ret = tandem_utils.call([self._bin("pbsnodes"), "-a", "-F", "json"])
-        
-        if ret == 1 and 'Server has no node list' in stderr:
-            return {None: {}}
-        
-        if ret != 0:
-            raise RuntimeError(stderr)
+        if isinstance(grouping, basestring):
+            grouping = (grouping, )
         
-        nodes = json.loads(stdout)["nodes"]
+        # only decode what the autoscaler (and the grouping) actually reads
+        nodes = self.backend.pbsnodes(PBSNODES_FIELDS + tuple(grouping or ()))
         
         if not grouping:
             return {None: nodes}
         
-        if isinstance(grouping, basestring):
-            grouping = (grouping, )
-        
         grouped = OrderedDict()
-        for _node_name, node in nodes.iteritems():
+        for node in nodes.itervalues():
             res_avail = node["resources_available"]
-            
-            def flat_get(node, g):
-                return res_avail.get(g, node.get(g))
-            
-            key = keyformatter(tuple([flat_get(node, g) for g in grouping]))
+            # resources_available takes precedence over the top level node attributes
+            key = keyformatter(tuple([res_avail[g] if g in res_avail else node.get(g) for g in grouping]))
             if key not in grouped:
                 grouped[key] = []
             grouped[key].append(node)
@@ -201,10 +367,16 @@ class PBSDriver(TandemDriver):
         return grouped
     
     def set_offline(self, hostname):
-        tandem_utils.check_call([self._bin("pbsnodes"), "-o", hostname])
+        self.backend.set_offline(hostname)
         
     def delete_host(self, hostname):
-        tandem_utils.check_call([self._bin("qmgr"), "-c", "delete node %s" % hostname])
+        self.backend.delete_host(hostname)
+    
+    def create_hosts(self, hosts):
+        '''
+            hosts is a list of (hostname, {attribute: value}). Returns the hostnames that could not be created.
+        '''
+        return self.backend.create_hosts(hosts)
 
     def alter(self, jobs):
         resources = {}
@@ -214,7 +386,7 @@ class PBSDriver(TandemDriver):
                 resources[resource_arg] = []
             resources[resource_arg].append(job["job_id"])
         for resource_arg, job_ids in resources.iteritems():
-            tandem_utils.check_call(". /etc/cluster-setup.sh && qalter %s -l %s" % (",".join([str(j) for j in job_ids]), resource_arg))
+            self.runner.check_call(". /etc/cluster-setup.sh && qalter %s -l %s" % (",".join([str(j) for j in job_ids]), resource_arg))
 
     def parse_select(self, job):
         # Need to detect when slot_type is specified with `-l select=1:slot_type`
@@ -269,6 +441,51 @@ def _to_jobad(job, stream):
     stream.write("queue\n")
 
 
+def _from_pbsnodes_json(stdout, fields=PBSNODES_FIELDS):
+    '''
+    Decodes the "nodes" object of `pbsnodes -a -F json` into {node_name: {field: value}}, keeping only the given fields.
+    The object_hook swaps each node for a copy holding just those fields as soon as it is decoded, so the attributes that
+    are dropped (Mom, Port, pcpus, sharing, topology_info etc) do not outlive their node.
+    
+    Decoding only creates new, acyclic containers, so the cyclic gc is paused for it rather than walking the heap every
+    few hundred nodes. See `mockpbs_server.py bench` for a comparison with plain json.loads.
+    '''
+    fields = tuple(fields)
+    
+    def keep_fields(obj):
+        # resources_available is only ever an attribute of a node
+        if "resources_available" in obj:
+            return dict([(k, obj[k]) for k in fields if k in obj])
+        return obj
+    
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return json.loads(stdout, object_hook=keep_fields).get("nodes", {})
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _from_qmgr_list_resource(stdout):
+    '''
+    Resource slot_type
+        type = string
+        flag = h
+    '''
+    resource_types = {}
+    resource_name = None
+    for line in stdout.split("\n"):
+        line = line.strip()
+        if line.startswith("Resource "):
+            resource_name = line.split(None, 1)[1].strip()
+        elif resource_name and "=" in line:
+            key, value = [x.strip() for x in line.split("=", 1)]
+            if key == "type":
+                resource_types[resource_name] = value
+    return resource_types
+
+
 def _from_qstat(stdout, clz=OrderedDict):
     ads = [clz()]
     delim = ":"
@@ -0,0 +1,136 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import sys
+import threading
+import time
+import unittest
+
+import mockpbs_server
+import pbs_driver
+
+
+class MockRunner:
+    '''
+        Runs the PBS commands against a mockpbs_server.PBSState, like fork_server or tandem_utils would run the real ones.
+    '''
+
+    def __init__(self, state):
+        self.state = state
+
+    def call(self, args, stdin_data=None, timeout=None):
+        return self.state.run(args, stdin_data or "")
+
+    def check_call(self, args, stdin_data=None):
+        stdout, stderr, code = self.call(args, stdin_data)
+        if code != 0:
+            raise RuntimeError(stderr)
+        return stdout
+
+
+def _job(job_id, job_state):
+    return {"job_id": job_id, "job_state": job_state, "resource_list": {"select": "1:ncpus=1"}}
+
+
+def _node(name, state="free", **resources_available):
+    resources_available.update({"host": name, "vnode": name})
+    return {"state": state, "jobs": [], "resources_available": resources_available, "resources_assigned": {}, "pcpus": 4}
+
+
+class Test(unittest.TestCase):
+
+    def test_fake_backend(self):
+        jobs = [_job("1.pbsserver", "R"), _job("2.pbsserver", "Q"), _job("3[].pbsserver", "Q"), _job("3[1].pbsserver", "Q"),
+                _job("4.pbsserver", "H"), _job("5.pbsserver", "F")]
+        nodes = {"ip-1": _node("ip-1", group_id="g1"), "ip-2": _node("ip-2", group_id="g2"), "ip-3": _node("ip-3", group_id="g1")}
+        driver = pbs_driver.PBSDriver(version="18.1.4", backend=pbs_driver.FakeBackend(jobs, nodes))
+
+        raw, converter = driver.running_jobs()
+        self.assertEquals(["1.pbsserver"], [x["job_id"] for x in converter(raw)])
+        raw, converter = driver.queued_jobs()
+        self.assertEquals(["2.pbsserver", "3[].pbsserver", "4.pbsserver"], [x["job_id"] for x in converter(raw)])
+
+        # fields outside of PBSNODES_FIELDS are dropped, like the other backends do
+        self.assertNotIn("pcpus", driver.pbsnodes()[None]["ip-1"])
+        grouped = driver.pbsnodes("group_id")
+        self.assertEquals(["ip-1", "ip-3"], sorted([x["resources_available"]["vnode"] for x in grouped[("g1",)]]))
+
+        driver.set_offline("ip-1")
+        driver.set_offline("ip-1")
+        self.assertEquals("offline", nodes["ip-1"]["state"])
+        driver.delete_host("ip-2")
+        self.assertEquals([], driver.create_hosts([("ip-4", {"resources_available.slot_type": "execute", "comment": "new"})]))
+        self.assertEquals(["ip-1", "ip-3", "ip-4"], sorted(driver.pbsnodes()[None].keys()))
+        self.assertEquals("execute", nodes["ip-4"]["resources_available"]["slot_type"])
+        driver.close()
+
+    def test_cli_backend_matches_fake(self):
+        state = mockpbs_server.PBSState()
+        state.add_node("ip-1", ncpus=4, group_id="g1")
+        state.add_node("ip-2", ncpus=4, group_id="g2")
+        cli = pbs_driver.CLIBackend(runner=MockRunner(state))
+        fake = pbs_driver.FakeBackend(nodes=dict([(name, dict(node)) for name, node in state.nodes.iteritems()]))
+
+        self.assertEquals(fake.pbsnodes(), cli.pbsnodes())
+        for backend in [cli, fake]:
+            backend.set_offline("ip-1")
+            backend.delete_host("ip-2")
+            self.assertEquals([], backend.create_hosts([("ip-3", {"resources_available.slot_type": "execute"})]))
+        self.assertEquals(sorted(fake.pbsnodes().keys()), sorted(cli.pbsnodes().keys()))
+        self.assertEquals("offline", cli.pbsnodes()["ip-1"]["state"])
+        self.assertEquals("execute", cli.pbsnodes()["ip-3"]["resources_available"]["slot_type"])
+
+        raw, converter = cli.queued_jobs()
+        self.assertEquals([], converter(raw))
+
+    def test_new_backend(self):
+        self.assertTrue(isinstance(pbs_driver.new_backend(None), pbs_driver.CLIBackend))
+        self.assertTrue(isinstance(pbs_driver.new_backend("CLI"), pbs_driver.CLIBackend))
+        self.assertTrue(isinstance(pbs_driver.new_backend("fake"), pbs_driver.FakeBackend))
+        self.assertRaises(ValueError, pbs_driver.new_backend, "drmaa")
+
+        # falls back to the cli backend when the IFL binding, or libpbs, can not be loaded
+        pbs_ifl = sys.modules.get("pbs_ifl")
+        sys.modules["pbs_ifl"] = None
+        try:
+            backend = pbs_driver.new_backend("ifl", bin_dir="/opt/pbs/bin")
+            self.assertTrue(isinstance(backend, pbs_driver.CLIBackend))
+            self.assertEquals("/opt/pbs/bin", backend.bin_dir)
+        finally:
+            if pbs_ifl is None:
+                sys.modules.pop("pbs_ifl")
+            else:
+                sys.modules["pbs_ifl"] = pbs_ifl
+
+    def test_ifl_close_does_not_wait_on_a_wedged_call(self):
+        import pbs_ifl
+
+        class FakeLib:
+            disconnected = []
+
+            def pbs_disconnect(self, connection):
+                self.disconnected.append(connection)
+
+        load_library = pbs_ifl.load_library
+        pbs_ifl.load_library = lambda bin_dir, library_path: FakeLib()
+        try:
+            backend = pbs_ifl.IFLBackend(close_timeout=0.1)
+        finally:
+            pbs_ifl.load_library = load_library
+
+        backend.connection = 3
+        # a pbs_statjob that never returns
+        backend._lock.acquire()
+        started = time.time()
+        backend.close()
+        self.assertTrue(time.time() - started < 5)
+        self.assertEquals([], FakeLib.disconnected)
+
+        threading.Timer(0.05, backend._lock.release).start()
+        backend.close()
+        self.assertEquals([3], FakeLib.disconnected)
+        self.assertEquals(None, backend.connection)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+ctypes binding of the PBS IFL (libpbs) job and vnode status calls, used as a PBSDriver backend.
+
+Jobs and vnodes are requested over a single pbs_connect handle, which is opened on first use and held until close() is
+called at the end of the cycle, and only the attributes the autoscaler reads are requested. Anything else, i.e. setting nodes
+offline or deleting them, is delegated to the cli backend.
+
+The IFL returns every value as a string, so the records it produces have the same shape as qstat -f and pbsnodes -F json
+but numbers like resources_available.ncpus are strings. They are converted along with everything else by the resource schema.
+'''
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pbs_driver
+import pbscc
+
+
+class _Attrl(ctypes.Structure):
+    pass
+
+
+_Attrl._fields_ = [("next", ctypes.POINTER(_Attrl)),
+                   ("name", ctypes.c_char_p),
+                   ("resource", ctypes.c_char_p),
+                   ("value", ctypes.c_char_p),
+                   ("op", ctypes.c_int)]
+
+
+class _BatchStatus(ctypes.Structure):
+    pass
+
+
+_BatchStatus._fields_ = [("next", ctypes.POINTER(_BatchStatus)),
+                         ("name", ctypes.c_char_p),
+                         ("attribs", ctypes.POINTER(_Attrl)),
+                         ("text", ctypes.c_char_p)]
+
+
+JOB_ATTRIBUTES = ["job_state", "exec_vnode", "Resource_List", "array", "array_state_count", "queue"]
+
+
+def load_library(bin_dir=None, path=None):
+    '''
+        Looks for libpbs.so next to the PBS bin directory, then on the default library path. Raises OSError if it is not found.
+    '''
+    candidates = []
+    if path:
+        candidates.append(path)
+    if bin_dir:
+        candidates.append(os.path.join(os.path.dirname(os.path.abspath(bin_dir)), "lib", "libpbs.so"))
+    candidates.append(ctypes.util.find_library("pbs"))
+
+    for candidate in candidates:
+        if candidate and (os.path.exists(candidate) or not os.path.isabs(candidate)):
+            lib = ctypes.CDLL(candidate)
+            break
+    else:
+        raise OSError("libpbs.so not found, tried %s" % [x for x in candidates if x])
+
+    lib.pbs_connect.argtypes = [ctypes.c_char_p]
+    lib.pbs_connect.restype = ctypes.c_int
+    lib.pbs_disconnect.argtypes = [ctypes.c_int]
+    lib.pbs_disconnect.restype = ctypes.c_int
+    for stat_func in [lib.pbs_statjob, lib.pbs_statvnode]:
+        stat_func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(_Attrl), ctypes.c_char_p]
+        stat_func.restype = ctypes.POINTER(_BatchStatus)
+    lib.pbs_statfree.argtypes = [ctypes.POINTER(_BatchStatus)]
+    lib.pbs_statfree.restype = None
+    lib.pbs_geterrmsg.argtypes = [ctypes.c_int]
+    lib.pbs_geterrmsg.restype = ctypes.c_char_p
+    return lib
+
+
+def _attrl_list(names):
+    '''
+        Returns the head of a linked attrl list, along with the nodes so that they are not garbage collected before the call.
+    '''
+    nodes = [_Attrl(name=name) for name in names]
+    for n in range(len(nodes) - 1):
+        nodes[n].next = ctypes.pointer(nodes[n + 1])
+    return ctypes.pointer(nodes[0]), nodes
+
+
+def _iter_status(status):
+    while status:
+        yield status.contents
+        status = status.contents.next
+
+
+def _iter_attribs(attribs):
+    while attribs:
+        yield attribs.contents
+        attribs = attribs.contents.next
+
+
+def _fmt_key(key):
+    # same as _from_qstat
+    return key.replace(" ", "_").lower()
+
+
+def _to_job(batch_status):
+    job = OrderedDict()
+    job["job_id"] = batch_status.name
+    for attr in _iter_attribs(batch_status.attribs):
+        key = _fmt_key(attr.name)
+        if attr.resource:
+            if key not in job:
+                job[key] = OrderedDict()
+            job[key][_fmt_key(attr.resource)] = attr.value
+        else:
+            job[key] = attr.value
+    return job
+
+
+def _to_vnode(batch_status):
+    node = {}
+    for attr in _iter_attribs(batch_status.attribs):
+        if attr.resource:
+            if attr.name not in node:
+                node[attr.name] = {}
+            node[attr.name][attr.resource] = attr.value
+        elif attr.name in ["last_state_change_time", "last_used_time"]:
+            node[attr.name] = int(attr.value)
+        elif attr.name == "jobs":
+            node[attr.name] = [x.strip() for x in attr.value.split(",") if x.strip()]
+        else:
+            node[attr.name] = attr.value
+    return node
+
+
+class IFLBackend:
+    '''
+        See pbs_driver.CLIBackend for the backend interface.
+    '''
+
+    def __init__(self, bin_dir=None, server=None, library_path=None, runner=None, close_timeout=5.0):
+        self.lib = load_library(bin_dir, library_path)
+        self.close_timeout = close_timeout
+        self.server = server
+        self.connection = None
+        # the connection is shared, and the driver's calls may be made from several threads (see deadline.gather)
+        self._lock = threading.Lock()
+        self.cli = pbs_driver.CLIBackend(bin_dir, runner)
+
+    def _connect(self):
+        if self.connection is None:
+            connection = self.lib.pbs_connect(self.server)
+            if connection < 0:
+                raise RuntimeError("pbs_connect(%s) failed" % (self.server or "default server"))
+            self.connection = connection
+        return self.connection
+
+    def _stat_jobs(self, extend, states):
+        with self._lock:
+            return self._stat_jobs_locked(extend, states)
+
+    def _stat_jobs_locked(self, extend, states):
+        connection = self._connect()
+        head, _keepalive = _attrl_list(JOB_ATTRIBUTES)
+        status = self.lib.pbs_statjob(connection, None, head, extend)
+        if not status:
+            errmsg = self.lib.pbs_geterrmsg(connection)
+            if errmsg:
+                raise RuntimeError(errmsg)
+            return []
+        try:
+            jobs = [_to_job(x) for x in _iter_status(status)]
+        finally:
+            self.lib.pbs_statfree(status)
+        return [x for x in jobs if x.get("job_state") in states]
+
+    def running_jobs(self):
+        # like qstat -t -r, include array subjobs
+        return self._stat_jobs("t", pbs_driver.RUNNING_JOB_STATES), list
+
+    def queued_jobs(self):
+        # like qstat -i
+        return self._stat_jobs(None, pbs_driver.QUEUED_JOB_STATES), list
+
+    def pbsnodes(self, fields=pbs_driver.PBSNODES_FIELDS):
+        with self._lock:
+            return self._pbsnodes_locked(fields)
+
+    def _pbsnodes_locked(self, fields):
+        connection = self._connect()
+        head, _keepalive = _attrl_list(list(fields))
+        status = self.lib.pbs_statvnode(connection, "", head, None)
+        if not status:
+            errmsg = self.lib.pbs_geterrmsg(connection)
+            if errmsg and "Server has no node list" not in errmsg:
+                raise RuntimeError(errmsg)
+            return {}
+        try:
+            nodes = {}
+            for batch_status in _iter_status(status):
+                nodes[batch_status.name] = _to_vnode(batch_status)
+        finally:
+            self.lib.pbs_statfree(status)
+        return nodes
+
+    def set_offline(self, hostname):
+        self.cli.set_offline(hostname)
+
+    def delete_host(self, hostname):
+        self.cli.delete_host(hostname)
+
+    def create_hosts(self, hosts):
+        return self.cli.create_hosts(hosts)
+
+    def close(self):
+        # pbs_statjob and pbs_statvnode have no timeout, and deadline.gather leaves a wedged one behind holding the lock. Rather
+        # than wait on it forever, leave the connection to be dropped when the process exits.
+        give_up_at = time.time() + self.close_timeout
+        while not self._lock.acquire(False):
+            if time.time() >= give_up_at:
+                pbscc.warn("A PBS IFL call is still in progress after %s seconds, not disconnecting." % self.close_timeout)
+                return
+            time.sleep(0.05)
+        try:
+            self._disconnect()
+        finally:
+            self._lock.release()
+
+    def _disconnect(self):
+        if self.connection is not None:
+            try:
+                self.lib.pbs_disconnect(self.connection)
+            except Exception as e:
+                pbscc.warn("pbs_disconnect failed: %s" % str(e))
+            self.connection = None
@@ -91,26 +91,132 @@ def parse_place(place):
     return placement
 
 
-def parse_exec_vnode(expr):
+def parse_exec_vnode(expr, schema=None):
     '''
     Example:  "(ip-0A030008:ncpus=1)"
     '''
+    convert = schema.convert if schema else convert_untyped
     expr = expr[1:-1]
     host, resource_expr = expr.split(":", 1)
     resources = {}
     for res_sub_expr in resource_expr.split(":"):
         attr, value = res_sub_expr.split("=", 1)
-        try:
-            value = parse_gb_size(attr, value)
-        except InvalidSizeExpressionError:
-            if value.lower() in ["true", "false"]:
-                value = value.lower() == "true"
-            
-        resources[attr] = value
+        resources[attr] = convert(attr, value)
     resources["hostname"] = host
     return resources
 
 
+# Types of the resources built into PBS, which `qmgr -c 'list resource'` does not report. Custom resources (see doqmgr.sh)
+# are merged on top of these by the driver.
+BUILTIN_RESOURCE_TYPES = {
+    "ncpus": "long",
+    "mem": "size",
+    "vmem": "size",
+    "pmem": "size",
+    "pvmem": "size",
+    "mpiprocs": "long",
+    "ompthreads": "long",
+    "nodect": "long",
+    "naccelerators": "long",
+    "accelerator_memory": "size",
+    "arch": "string",
+    "host": "string",
+    "vnode": "string",
+    "aoe": "string",
+    "hostname": "string"
+}
+
+_BOOLEAN_STRINGS = {"true": True, "false": False}
+_TRUE_STRINGS = set(["true", "t", "yes", "y", "1"])
+
+
+def _convert_size(attr, value):
+    return parse_gb_size(attr, value)
+
+
+def _convert_long(attr, value):
+    if isinstance(value, numbers.Number):
+        return value
+    return int(value)
+
+
+def _convert_float(attr, value):
+    if isinstance(value, numbers.Number):
+        return value
+    return float(value)
+
+
+def _convert_boolean(attr, value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in _TRUE_STRINGS
+
+
+def _convert_string(attr, value):
+    if not isinstance(value, basestring):
+        return value
+    # pbs 18 reports host level booleans, like ungrouped, as strings.
+    return _BOOLEAN_STRINGS.get(value.lower(), value)
+
+
+def convert_untyped(attr, value):
+    '''
+    Conversion for a resource whose type is unknown - probe it as a size and fall back to a boolean or the raw value.
+    '''
+    try:
+        return parse_gb_size(attr, value)
+    except InvalidSizeExpressionError:
+        return _convert_string(attr, value)
+
+
+RESOURCE_CONVERTERS = {
+    "size": _convert_size,
+    "long": _convert_long,
+    "float": _convert_float,
+    "boolean": _convert_boolean,
+    "string": _convert_string,
+    "string_array": _convert_string
+}
+
+
+def is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+class ResourceSchema:
+    '''
+    Compiled form of the scheduler's resource list (resources: in sched_config), kept as a set so that membership checks
+    are a hash lookup instead of a list scan.
+    
+    resource_types maps resource name -> PBS type (size, long, float, boolean, string, string_array) and is used to pick
+    a converter per resource up front. Resources without a known type are converted with convert_untyped.
+    '''
+
+    def __init__(self, resources, resource_types=None):
+        self.resources = frozenset(resources)
+        self.types = dict(resource_types or {})
+        self.converters = {}
+        for name, resource_type in self.types.iteritems():
+            self.converters[name] = RESOURCE_CONVERTERS.get(resource_type, convert_untyped)
+
+    def convert(self, attr, value):
+        converter = self.converters.get(attr, convert_untyped)
+        if converter is convert_untyped:
+            return convert_untyped(attr, value)
+        try:
+            return converter(attr, value)
+        except (ValueError, InvalidSizeExpressionError):
+            # a value that does not match its declared type, don't fail the whole cycle over it.
+            warn("Resource %s is declared as %s but has value %s" % (attr, self.types[attr], value))
+            return convert_untyped(attr, value)
+
+    def __contains__(self, name):
+        return name in self.resources
+
+    def __repr__(self):
+        return "ResourceSchema(%s)" % sorted(self.resources)
+
+
 class InvalidSizeExpressionError(RuntimeError):
     pass
 
@@ -156,13 +262,15 @@ __INFO = 2
 __WARN = 3
 __ERROR = 4
 
-__log_level = {
+__log_level_by_name = {
     "fine": __FINE,
     "debug": __DEBUG,
     "info": __INFO,
     "warn": __WARN,
     "error": __ERROR
-}.get(os.environ.get("AUTOSTART_LOG_LEVEL", "WARN").lower(), __WARN)
+}
+
+__log_level = __log_level_by_name.get(os.environ.get("AUTOSTART_LOG_LEVEL", "WARN").lower(), __WARN)
 
 
 __log_level_names = {
@@ -182,8 +290,11 @@ def set_application_name(value):
     __application_name = value
 
 
-def __log(level, msg):
+def __log(level, msg, args=None):
     if __log_level <= level:
+        # msg is only formatted here, so that filtered out messages cost next to nothing, e.g. debug("Found %s", job.name)
+        if args:
+            msg = msg % args
         pbs_msg = "%s:%s - %s" % (__application_name, __log_level_names[__log_level], msg)
         if level >= __ERROR:
             pbs_level = pbs.LOG_ERROR
@@ -200,21 +311,53 @@ def is_fine():
     return __log_level == __FINE
 
 
-def fine(msg):
-    __log(__FINE, msg)
+def fine(msg, *args):
+    __log(__FINE, msg, args)
 
 
-def debug(msg):
-    __log(__DEBUG, msg)
+def debug(msg, *args):
+    __log(__DEBUG, msg, args)
 
 
-def info(msg):
-    __log(__INFO, msg)
+def info(msg, *args):
+    __log(__INFO, msg, args)
     
 
-def warn(msg):
-    __log(__WARN, msg)
+def warn(msg, *args):
+    __log(__WARN, msg, args)
+
+
+def error(msg, *args):
+    __log(__WARN, msg, args)
 
 
-def error(msg):
-    __log(__WARN, msg)
+__aggregates = collections.OrderedDict()
+__MAX_EXAMPLES = 3
+
+
+def aggregate(level, summary, example=None, count=1):
+    '''
+    For messages that would otherwise be logged once per job or node. Instead of a line each, they are counted per summary and
+    logged once by flush_aggregates() at the end of the cycle, along with the first few examples, e.g.
+        aggregate("info", "Can not match job", job.name)
+    becomes "Can not match job: 1200 (e.g. 1.pbs, 2.pbs, 3.pbs)".
+    '''
+    level = __log_level_by_name[level]
+    if __log_level > level:
+        return
+    key = (level, summary)
+    entry = __aggregates.get(key)
+    if entry is None:
+        entry = __aggregates[key] = [0, []]
+    entry[0] += count
+    if example is not None and len(entry[1]) < __MAX_EXAMPLES:
+        entry[1].append(example)
+
+
+def flush_aggregates():
+    for (level, summary), (count, examples) in __aggregates.iteritems():
+        if examples:
+            __log(level, "%s: %d (e.g. %s)", (summary, count, ", ".join([str(x) for x in examples])))
+        else:
+            __log(level, "%s: %d", (summary, count))
+    __aggregates.clear()
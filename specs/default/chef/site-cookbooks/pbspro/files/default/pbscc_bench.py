@@ -0,0 +1,182 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Microbenchmarks for the expression parsers that run for every job and node in every cycle: pbscc.parse_select,
+format_select, parse_place, parse_exec_vnode and parse_gb_size, as well as pbs_driver._from_qstat.
+
+Each parser runs over a fixed corpus of real world expressions and a qstat -f dump, and reports ns/op (best of several
+repeats). Where tracemalloc is available it also reports bytes/op, the memory each operation's result holds on to.
+
+    python pbscc_bench.py
+    python pbscc_bench.py --save-baseline pbscc_bench_baseline.json
+    python pbscc_bench.py --baseline pbscc_bench_baseline.json --tolerance 0.2
+
+With --baseline, the exit code is 1 if any parser is more than tolerance slower, or holds on to more than tolerance more
+memory, than its baseline. Timings are only comparable on the machine the baseline was recorded on, see autostart_bench.
+'''
+import gc
+import sys
+import time
+from collections import OrderedDict
+
+import bench_baseline
+import pbscc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+SELECT_CORPUS = ["1:ncpus=1",
+                 "2:ncpus=16:mpiprocs=16",
+                 "1:ncpus=4:mem=8gb+4:ncpus=16:mem=64gb:slot_type=execute",
+                 "10:ncpus=2:ngpus=1:slot_type=gpu",
+                 "1:ncpus=44:mem=350gb:mpiprocs=44:ompthreads=1",
+                 "4:ncpus=32:mpiprocs=32:mem=120gb:group_id=single:ungrouped=false",
+                 "1:ncpus=1:mem=2gb:slot_type=execute:nodearray=execute:machinetype=Standard_D2_v3",
+                 "1:ncpus=8+2:ncpus=8+1:ncpus=1"]
+
+PLACE_CORPUS = ["scatter:excl:group=group_id", "pack", "free:shared", "vscatter:exclhost", "scatter", "pack:excl", "", None]
+
+EXEC_VNODE_CORPUS = ["(ip-0A030008:ncpus=1)",
+                     "(ip-0A03000A:ncpus=16:mem=64gb)",
+                     "(ip-0A03000B:ncpus=4:mem=16777216kb:ngpus=1)",
+                     "(execute-12:ncpus=44:mem=350gb:mpiprocs=44:ompthreads=1)"]
+
+SIZE_CORPUS = ["1gb", "512mb", "4k", "100", "1.5g", "1048576kb", "100b", "64", "2pb", "350GB", "16777216kb", "0.5m"]
+
+QSTAT_JOB = '''Job Id: %(job_id)s.pbsserver
+    Job_Name = mpi_run
+    Job_Owner = hpcuser@pbsserver
+    job_state = %(job_state)s
+    queue = workq
+    server = pbsserver
+    Checkpoint = u
+    ctime = Mon Jun 11 18:20:05 2018
+    Error_Path = pbsserver:/shared/home/hpcuser/mpi_run.e%(job_id)s
+    Hold_Types = n
+    Join_Path = n
+    Keep_Files = n
+    Mail_Points = a
+    mtime = Mon Jun 11 18:20:05 2018
+    Output_Path = pbsserver:/shared/home/hpcuser/mpi_run.o%(job_id)s
+    Priority = 0
+    qtime = Mon Jun 11 18:20:05 2018
+    Rerunable = True
+    Resource_List.mem = 128gb
+    Resource_List.mpiprocs = 64
+    Resource_List.ncpus = 64
+    Resource_List.nodect = 4
+    Resource_List.place = scatter:excl:group=group_id
+    Resource_List.select = 4:ncpus=16:mpiprocs=16:mem=32gb
+    Resource_List.slot_type = execute
+    substate = 10
+    Variable_List = PBS_O_HOME=/shared/home/hpcuser,PBS_O_LANG=en_US.UTF-8,
+\tPBS_O_LOGNAME=hpcuser,PBS_O_PATH=/usr/local/bin:/usr/bin:/opt/pbs/bin,
+\tPBS_O_SHELL=/bin/bash,PBS_O_WORKDIR=/shared/home/hpcuser,PBS_O_SYSTEM=Linux,
+\tPBS_O_QUEUE=workq,PBS_O_HOST=pbsserver
+    comment = Not Running: Insufficient amount of resource: ncpus
+    etime = Mon Jun 11 18:20:05 2018
+    Submit_arguments = -l select=4:ncpus=16:mpiprocs=16:mem=32gb -l place=scatter:excl:group=group_id mpi_run.sh
+    project = _pbs_project_default
+'''
+
+QSTAT_DUMP = "\n".join([QSTAT_JOB % {"job_id": n, "job_state": "Q" if n % 4 else "R"} for n in range(100)])
+
+
+def _benchmarks():
+    selects = [{"resource_list": {"select": x}} for x in SELECT_CORPUS]
+    chunks = [chunk for x in selects for chunk in pbscc.parse_select(x)]
+    schema = pbscc.ResourceSchema(["ncpus", "mem", "ngpus", "mpiprocs", "ompthreads"], pbscc.BUILTIN_RESOURCE_TYPES)
+
+    benchmarks = OrderedDict()
+    benchmarks["parse_select"] = (lambda: [pbscc.parse_select(x) for x in selects], len(selects))
+    benchmarks["format_select"] = (lambda: [pbscc.format_select(x) for x in chunks], len(chunks))
+    benchmarks["parse_place"] = (lambda: [pbscc.parse_place(x) for x in PLACE_CORPUS], len(PLACE_CORPUS))
+    benchmarks["parse_exec_vnode"] = (lambda: [pbscc.parse_exec_vnode(x) for x in EXEC_VNODE_CORPUS], len(EXEC_VNODE_CORPUS))
+    benchmarks["parse_exec_vnode_typed"] = (lambda: [pbscc.parse_exec_vnode(x, schema) for x in EXEC_VNODE_CORPUS], len(EXEC_VNODE_CORPUS))
+    benchmarks["parse_gb_size"] = (lambda: [pbscc.parse_gb_size("mem", x) for x in SIZE_CORPUS], len(SIZE_CORPUS))
+
+    try:
+        import pbs_driver
+    except ImportError as e:
+        sys.stderr.write("Skipping _from_qstat, pbs_driver could not be imported: %s\n" % str(e))
+    else:
+        benchmarks["_from_qstat"] = (lambda: pbs_driver._from_qstat(QSTAT_DUMP), 100)
+    return benchmarks
+
+
+def measure(func, ops_per_call, min_time=0.2, repeat=5):
+    '''
+        Returns (ns/op, bytes/op) for func, which performs ops_per_call operations per call. bytes/op is None without
+        tracemalloc.
+    '''
+    calls = 1
+    while True:
+        started = time.time()
+        for _ in xrange(calls):
+            func()
+        elapsed = time.time() - started
+        if elapsed >= min_time:
+            break
+        calls *= 2
+
+    best = elapsed
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat - 1):
+            started = time.time()
+            for _ in xrange(calls):
+                func()
+            best = min(best, time.time() - started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    bytes_per_op = None
+    if tracemalloc:
+        # hold on to the results so that what they allocated is still traced when it is counted.
+        gc.collect()
+        tracemalloc.start()
+        try:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            results = [func() for _ in xrange(10)]
+            bytes_per_op = (tracemalloc.get_traced_memory()[0] - traced_before) / float(10 * ops_per_call)
+            del results
+        finally:
+            tracemalloc.stop()
+
+    return best * 1e9 / (calls * ops_per_call), bytes_per_op
+
+
+def run(names=None, log=sys.stderr):
+    results = OrderedDict()
+    for name, (func, ops_per_call) in _benchmarks().iteritems():
+        if names and name not in names:
+            continue
+        ns_per_op, bytes_per_op = measure(func, ops_per_call)
+        results[name] = OrderedDict([("ns_per_op", ns_per_op)])
+        if bytes_per_op is None:
+            log.write("%-24s %12.1f ns/op\n" % (name, ns_per_op))
+        else:
+            results[name]["bytes_per_op"] = bytes_per_op
+            log.write("%-24s %12.1f ns/op %10.1f bytes/op\n" % (name, ns_per_op, bytes_per_op))
+    return results
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the pbscc and qstat parsers")
+    parser.add_argument("--only", action="append", help="Only run this benchmark, may be repeated")
+    bench_baseline.add_arguments(parser, tolerance=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.only)
+    return bench_baseline.finish(args, results, ["ns_per_op", "bytes_per_op"])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,47 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import unittest
+
+import pbscc
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.logged = []
+        self.logmsg = pbscc.pbs.logmsg
+        self.log_level = getattr(pbscc, "__log_level")
+        pbscc.pbs.logmsg = lambda level, msg: self.logged.append((level, msg))
+        setattr(pbscc, "__log_level", getattr(pbscc, "__DEBUG"))
+        
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        pbscc.pbs.logmsg = self.logmsg
+        setattr(pbscc, "__log_level", self.log_level)
+        pbscc.flush_aggregates()
+    
+    def test_aggregate(self):
+        for n in range(5):
+            pbscc.aggregate("info", "Can not match job", "%d.pbs" % n)
+        pbscc.aggregate("debug", "Compressed identical jobs matching job ids", "6.pbs", count=10)
+        pbscc.aggregate("debug", "Compressed identical jobs matching job ids", "7.pbs", count=20)
+        pbscc.aggregate("debug", "machinetype is not defined")
+        pbscc.aggregate("fine", "filtered out", "8.pbs")
+        self.assertEquals([], self.logged)
+        
+        pbscc.flush_aggregates()
+        self.assertEquals([pbscc.pbs_LOG_INFO, pbscc.pbs.LOG_DEBUG, pbscc.pbs.LOG_DEBUG], [x[0] for x in self.logged])
+        messages = [x[1].split(" - ", 1)[1] for x in self.logged]
+        self.assertEquals(["Can not match job: 5 (e.g. 0.pbs, 1.pbs, 2.pbs)",
+                           "Compressed identical jobs matching job ids: 30 (e.g. 6.pbs, 7.pbs)",
+                           "machinetype is not defined: 1"], messages)
+        
+        # each key is flushed once
+        pbscc.flush_aggregates()
+        self.assertEquals(3, len(self.logged))
+        
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+'''
+Concurrent, rate limited scale up.
+
+autoscale_util.scale_up sends every set of an autoscale request to CycleCloud in one synchronous call, so a slow or
+throttled nodearray holds up all the others and a single error loses the whole request. ScaleUpDispatcher splits the
+request into one request per set (a nodearray, machine type and placement group), submits them from up to concurrency
+threads at no more than rate requests per second, and retries failed sets with jittered exponential backoff for as long as
+the cycle budget allows. A set keeps its requestId across retries, so retrying a request that did reach CycleCloud does
+not allocate its nodes twice. The same goes across cycles: a set that was sent but not acknowledged, because it failed or
+was still in flight at the end of the budget, is remembered in history_path, and the same nodearray, machine type,
+placement group and count is sent with the same requestId for the next in_flight_ttl seconds.
+
+    dispatcher = ScaleUpDispatcher(clusters_api, budget, concurrency=4, rate=5, history_path=path)
+    for outcome in dispatcher.dispatch(autoscale_request):
+        print outcome["nodearray"], outcome["status"]
+
+A set that still fails is recorded in history_path, and the same nodearray, machine type and placement group is deferred
+for failure_cooldown seconds in the following cycles instead of failing again every cycle.
+'''
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import deadline
+import pbscc
+
+
+class TokenBucket:
+    '''
+        Allows rate acquisitions per second on average and bursts of up to burst. A rate of None or 0 is unlimited.
+    '''
+
+    def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate or 0)
+        self.burst = max(1, int(burst))
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(self.burst)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        '''
+            Takes a token and returns 0, or returns how long until one is available.
+        '''
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        '''
+            Blocks until a token is available. Returns False, without taking one, if that would take longer than timeout.
+        '''
+        if not self.rate:
+            return True
+        give_up_at = None if timeout is None else self.clock() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if give_up_at is not None and self.clock() + wait > give_up_at:
+                return False
+            self.sleep(wait)
+
+
+class ScaleUpDispatcher:
+    '''
+        budget is the cycle's deadline.CycleBudget - no request is started, and no retry is waited for, past its end.
+        metrics, if set, is a cycle_metrics.CycleMetrics to count requests, retries and failures in.
+    '''
+
+    def __init__(self, clusters_api, budget=None, concurrency=1, rate=None, max_retries=2, backoff=1.0, max_backoff=30.0,
+                 history_path=None, failure_cooldown=300, in_flight_ttl=900, metrics=None, sleep=time.sleep):
+        self.clusters_api = clusters_api
+        self.budget = budget or deadline.CycleBudget()
+        self.concurrency = max(1, int(concurrency))
+        self.bucket = TokenBucket(rate, burst=self.concurrency, sleep=sleep)
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.history_path = history_path
+        self.failure_cooldown = failure_cooldown
+        self.in_flight_ttl = in_flight_ttl
+        self.metrics = metrics
+        self.sleep = sleep
+
+    def dispatch(self, autoscale_request):
+        '''
+            Submits each set of autoscale_request (see autoscale_util.create_autoscale_request) as its own request and returns
+            an outcome per set, in the same order. An outcome's status is ok, failed, or deferred if it was not submitted,
+            because it failed recently or because the cycle budget ran out.
+        '''
+        request_sets = autoscale_request.get("sets") or []
+        if not request_sets:
+            return []
+
+        failures, in_flight = self._load_history()
+        now = time.time()
+        base_request_id = autoscale_request.get("requestId") or str(uuid.uuid4())
+        outcomes = []
+        submissions = []
+
+        for n, request_set in enumerate(request_sets):
+            previous = in_flight.get(in_flight_key(request_set))
+            outcome = new_outcome(request_set, previous["request_id"] if previous else "%s-%d" % (base_request_id, n))
+            outcomes.append(outcome)
+
+            failure = failures.get(set_key(request_set))
+            if failure and now - failure["time"] < self.failure_cooldown:
+                outcome["status"] = "deferred"
+                outcome["error"] = "failed %d seconds ago: %s" % (now - failure["time"], failure["error"])
+                pbscc.warn("Deferring request for %d %s machines in nodearray %s, it failed %d seconds ago.",
+                           outcome["count"], outcome["machinetype"], outcome["nodearray"], now - failure["time"])
+                continue
+
+            request = dict([(key, value) for key, value in autoscale_request.iteritems() if key != "sets"])
+            request["requestId"] = outcome["request_id"]
+            request["sets"] = [request_set]
+            submissions.append((outcome, request))
+
+        self._incr("scale_up_requests", len(submissions))
+        self._submit_all(submissions)
+
+        for request_set, outcome in zip(request_sets, outcomes):
+            key = set_key(request_set)
+            if outcome["status"] == "ok":
+                in_flight.pop(in_flight_key(request_set), None)
+            elif outcome["attempts"]:
+                # it may still have reached CycleCloud, keep the time it was first sent so that the entry expires.
+                in_flight.setdefault(in_flight_key(request_set), {"time": now, "request_id": outcome["request_id"]})
+
+            if outcome["status"] == "ok":
+                failures.pop(key, None)
+            elif outcome["status"] == "failed":
+                self._incr("scale_up_failures")
+                failures[key] = {"time": now, "error": outcome["error"]}
+                pbscc.error("Could not request %d %s machines in nodearray %s after %d attempts: %s",
+                            outcome["count"], outcome["machinetype"], outcome["nodearray"], outcome["attempts"], outcome["error"])
+
+        self._save_history(failures, in_flight)
+        return outcomes
+
+    def _submit_all(self, submissions):
+        if self.concurrency == 1 or len(submissions) < 2:
+            for outcome, request in submissions:
+                self._submit(outcome, request)
+            return
+
+        pending = list(submissions)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    outcome, request = pending.pop(0)
+                self._submit(outcome, request)
+
+        threads = []
+        for _ in range(min(self.concurrency, len(submissions))):
+            thread = threading.Thread(target=worker)
+            # a request still in flight at the deadline must not keep the process alive.
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(self.budget.remaining())
+
+        for outcome, _ in submissions:
+            if outcome["status"] is None:
+                # the request may still complete, in which case the next cycle sees its nodes as booting.
+                outcome["status"] = "deferred"
+                outcome["error"] = "did not complete within the cycle budget"
+
+    def _submit(self, outcome, request):
+        for attempt in range(self.max_retries + 1):
+            if not self.bucket.acquire(self.budget.remaining()):
+                outcome["status"] = "deferred"
+                outcome["error"] = "rate limited until the end of the cycle budget"
+                return
+
+            outcome["attempts"] = attempt + 1
+            try:
+                self.budget.timeout()
+                self.clusters_api.add_nodes(request)
+                outcome["status"] = "ok"
+                outcome["error"] = None
+                return
+            except deadline.DeadlineExceededError as e:
+                outcome["status"] = "deferred"
+                outcome["error"] = str(e)
+                return
+            except Exception as e:
+                outcome["error"] = str(e)
+
+            if attempt == self.max_retries:
+                break
+
+            # "full jitter", so that sets throttled together do not all retry together.
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            remaining = self.budget.remaining()
+            if remaining is not None and delay >= remaining:
+                break
+            pbscc.warn("Request for %d %s machines in nodearray %s failed, retrying in %.1f seconds: %s",
+                       outcome["count"], outcome["machinetype"], outcome["nodearray"], delay, outcome["error"])
+            self._incr("scale_up_retries")
+            self.sleep(delay)
+
+        outcome["status"] = "failed"
+
+    def _incr(self, name, value=1):
+        if self.metrics:
+            self.metrics.incr(name, value)
+
+    def _load_history(self):
+        '''
+            Returns the recent failures by set_key and the unacknowledged requests by in_flight_key.
+        '''
+        if not self.history_path or not os.path.exists(self.history_path):
+            return {}, {}
+        try:
+            with open(self.history_path) as fr:
+                history = json.load(fr)
+        except Exception as e:
+            pbscc.warn("Could not load scale up history %s, ignoring it. Error was %s" % (self.history_path, str(e)))
+            return {}, {}
+
+        now = time.time()
+        failures = history.get("failures", {})
+        in_flight = history.get("in_flight", {})
+        return (dict([(key, failure) for key, failure in failures.iteritems() if now - failure["time"] < self.failure_cooldown]),
+                dict([(key, request) for key, request in in_flight.iteritems() if now - request["time"] < self.in_flight_ttl]))
+
+    def _save_history(self, failures, in_flight):
+        if not self.history_path:
+            return
+        # only touch the file when there is something to remember or forget.
+        if not failures and not in_flight and not os.path.exists(self.history_path):
+            return
+
+        tmp_path = self.history_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fw:
+                json.dump({"failures": failures, "in_flight": in_flight}, fw)
+            os.rename(tmp_path, self.history_path)
+        except Exception as e:
+            pbscc.warn("Could not save scale up history %s. Error was %s" % (self.history_path, str(e)))
+
+
+def set_key(request_set):
+    machinetype = (request_set.get("definition") or {}).get("machineType")
+    return "/".join([str(request_set.get("nodearray")), str(machinetype), str(request_set.get("placementGroupId") or "")])
+
+
+def in_flight_key(request_set):
+    return "%s/%d" % (set_key(request_set), request_set.get("count", 0))
+
+
+def new_outcome(request_set, request_id):
+    outcome = OrderedDict()
+    outcome["nodearray"] = request_set.get("nodearray")
+    outcome["machinetype"] = (request_set.get("definition") or {}).get("machineType")
+    outcome["placement_group"] = request_set.get("placementGroupId")
+    outcome["count"] = request_set.get("count", 0)
+    outcome["request_id"] = request_id
+    outcome["status"] = None
+    outcome["attempts"] = 0
+    outcome["error"] = None
+    return outcome
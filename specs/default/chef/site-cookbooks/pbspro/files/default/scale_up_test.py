@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import cycle_metrics
+import deadline
+import scale_up
+
+
+class FakeClustersAPI:
+
+    def __init__(self, failures=None, delay=0):
+        # nodearray -> number of times add_nodes fails for it before succeeding
+        self.failures = failures or {}
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def add_nodes(self, request):
+        with self._lock:
+            self.requests.append(request)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            nodearray = request["sets"][0]["nodearray"]
+            if self.failures.get(nodearray, 0) > 0:
+                self.failures[nodearray] -= 1
+                raise RuntimeError("429 Too Many Requests")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def new_request(*nodearrays):
+    return {"requestId": "r1",
+            "sets": [{"nodearray": nodearray, "count": 2, "definition": {"machineType": "Standard_F4"},
+                      "placementGroupId": "pg0" if nodearray == "mpi" else None, "nodeAttributes": {}} for nodearray in nodearrays]}
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        self.sleeps = []
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempdir)
+
+    def dispatcher(self, clusters_api, **kwargs):
+        kwargs["sleep"] = self.sleeps.append
+        return scale_up.ScaleUpDispatcher(clusters_api, **kwargs)
+
+    def test_split_per_set(self):
+        clusters_api = FakeClustersAPI()
+        outcomes = self.dispatcher(clusters_api).dispatch(new_request("execute", "mpi"))
+        self.assertEquals(["ok", "ok"], [x["status"] for x in outcomes])
+        self.assertEquals([["execute"], ["mpi"]], [[s["nodearray"] for s in r["sets"]] for r in clusters_api.requests])
+        self.assertEquals(["r1-0", "r1-1"], [r["requestId"] for r in clusters_api.requests])
+        self.assertEquals("pg0", outcomes[1]["placement_group"])
+        self.assertEquals([], self.dispatcher(clusters_api).dispatch({"sets": []}))
+
+    def test_retries_reuse_request_id(self):
+        clusters_api = FakeClustersAPI(failures={"execute": 2})
+        metrics = cycle_metrics.CycleMetrics()
+        outcomes = self.dispatcher(clusters_api, max_retries=2, metrics=metrics).dispatch(new_request("execute"))
+        self.assertEquals("ok", outcomes[0]["status"])
+        self.assertEquals(3, outcomes[0]["attempts"])
+        self.assertEquals(["r1-0"] * 3, [r["requestId"] for r in clusters_api.requests])
+        self.assertEquals(2, len(self.sleeps))
+        # full jitter, capped by the exponential backoff
+        self.assertTrue(0 <= self.sleeps[0] <= 1 and 0 <= self.sleeps[1] <= 2)
+        self.assertEquals(2, metrics.counters["scale_up_retries"])
+        self.assertEquals(0, metrics.counters["scale_up_failures"])
+
+    def test_failures_are_deferred_next_cycle(self):
+        history_path = os.path.join(self.tempdir, "scale_up.json")
+        clusters_api = FakeClustersAPI(failures={"mpi": 10})
+        outcomes = self.dispatcher(clusters_api, max_retries=1, history_path=history_path).dispatch(new_request("execute", "mpi"))
+        self.assertEquals(["ok", "failed"], [x["status"] for x in outcomes])
+        self.assertEquals("429 Too Many Requests", outcomes[1]["error"])
+        self.assertEquals(["mpi/Standard_F4/pg0"], json.load(open(history_path))["failures"].keys())
+
+        clusters_api.requests = []
+        outcomes = self.dispatcher(clusters_api, history_path=history_path).dispatch(new_request("execute", "mpi"))
+        self.assertEquals(["ok", "deferred"], [x["status"] for x in outcomes])
+        self.assertEquals(1, len(clusters_api.requests))
+
+        # after the cooldown it is tried again, and forgotten once it succeeds
+        clusters_api.failures = {}
+        outcomes = self.dispatcher(clusters_api, history_path=history_path, failure_cooldown=0).dispatch(new_request("mpi"))
+        self.assertEquals(["ok"], [x["status"] for x in outcomes])
+        self.assertEquals({}, json.load(open(history_path))["failures"])
+
+    def test_unacknowledged_request_id_is_reused(self):
+        history_path = os.path.join(self.tempdir, "scale_up.json")
+        clusters_api = FakeClustersAPI(failures={"execute": 1})
+        outcomes = self.dispatcher(clusters_api, max_retries=0, history_path=history_path).dispatch(new_request("execute"))
+        self.assertEquals("failed", outcomes[0]["status"])
+
+        # the next cycle sends the same set under the same id, whatever id the new request has
+        request = new_request("execute")
+        request["requestId"] = "r2"
+        outcomes = self.dispatcher(clusters_api, history_path=history_path, failure_cooldown=0).dispatch(request)
+        self.assertEquals("ok", outcomes[0]["status"])
+        self.assertEquals(["r1-0", "r1-0"], [r["requestId"] for r in clusters_api.requests])
+        self.assertEquals({}, json.load(open(history_path))["in_flight"])
+
+        # once acknowledged, or with a different count, it is a new request
+        outcomes = self.dispatcher(clusters_api, history_path=history_path).dispatch(request)
+        self.assertEquals("r2-0", outcomes[0]["request_id"])
+
+        clusters_api.failures = {"execute": 1}
+        self.dispatcher(clusters_api, max_retries=0, history_path=history_path).dispatch(request)
+        request = new_request("execute")
+        request["requestId"] = "r3"
+        request["sets"][0]["count"] = 3
+        outcomes = self.dispatcher(clusters_api, history_path=history_path, failure_cooldown=0).dispatch(request)
+        self.assertEquals("r3-0", outcomes[0]["request_id"])
+        self.assertEquals(["execute/Standard_F4//2"], json.load(open(history_path))["in_flight"].keys())
+
+        # nor is it reused past in_flight_ttl
+        request["requestId"] = "r4"
+        request["sets"][0]["count"] = 2
+        outcomes = self.dispatcher(clusters_api, history_path=history_path, failure_cooldown=0, in_flight_ttl=0).dispatch(request)
+        self.assertEquals("r4-0", outcomes[0]["request_id"])
+
+    def test_concurrency(self):
+        clusters_api = FakeClustersAPI(delay=0.05)
+        outcomes = scale_up.ScaleUpDispatcher(clusters_api, concurrency=3).dispatch(new_request(*["na%d" % n for n in range(6)]))
+        self.assertEquals(["ok"] * 6, [x["status"] for x in outcomes])
+        self.assertEquals(["na%d" % n for n in range(6)], [x["nodearray"] for x in outcomes])
+        self.assertEquals(3, clusters_api.max_in_flight)
+
+    def test_budget(self):
+        budget = deadline.CycleBudget(1)
+        budget.started -= 1
+        clusters_api = FakeClustersAPI()
+        outcomes = self.dispatcher(clusters_api, budget=budget).dispatch(new_request("execute"))
+        self.assertEquals("deferred", outcomes[0]["status"])
+        self.assertEquals([], clusters_api.requests)
+
+    def test_token_bucket(self):
+        now = [100.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        bucket = scale_up.TokenBucket(2, burst=2, clock=lambda: now[0], sleep=sleep)
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        self.assertEquals([], sleeps)
+        self.assertTrue(bucket.acquire())
+        self.assertEquals([0.5], sleeps)
+        self.assertFalse(bucket.acquire(timeout=0.1))
+        self.assertTrue(scale_up.TokenBucket(None).acquire(timeout=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -150,6 +150,24 @@ def placement_hook(hook_config, job):
             debug("Using the grouped slot_type as a resource (%s)." % slot_type)
 
 
+def signal_demand(hook_config):
+    '''
+        Tells the autoscale hook that demand changed, so that it starts a cycle on its next firing rather than at the end of
+        its interval. This runs for every submission, so it is a single non-blocking append and never fails the job.
+    '''
+    trigger_path = hook_config.get("demand_trigger")
+    if not trigger_path:
+        return
+    try:
+        fd = os.open(trigger_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NONBLOCK, 0o644)
+        try:
+            os.write(fd, "1")
+        finally:
+            os.close(fd)
+    except OSError as e:
+        debug("Could not signal the autoscaler through %s: %s" % (trigger_path, e))
+
+
 def debug(msg):
     pbs.logmsg(pbs.EVENT_DEBUG3, "cycle_sub_hook - %s" % msg)
 
@@ -178,6 +196,7 @@ try:
     if e.type == pbs.QUEUEJOB:
         j = e.job
         placement_hook(hook_config, j)
+        signal_demand(hook_config)
     elif e.type == pbs.PERIODIC:
         # Defined paths to PBS commands
         qselect_cmd = os.path.join(pbs.pbs_conf['PBS_EXEC'], 'bin', 'qselect')
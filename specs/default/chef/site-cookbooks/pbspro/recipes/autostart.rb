@@ -15,6 +15,62 @@ cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/autostart_hook.py" do
   group "root"
 end
 
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/cycle_lock.py" do
+  source "cycle_lock.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/cycle_metrics.py" do
+  source "cycle_metrics.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/cycle_profiler.py" do
+  source "cycle_profiler.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/cycle_recorder.py" do
+  source "cycle_recorder.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/cycle_schedule.py" do
+  source "cycle_schedule.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/deadline.py" do
+  source "deadline.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/fork_server.py" do
+  source "fork_server.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/memory_monitor.py" do
+  source "memory_monitor.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
 cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/logging_init.py" do
   source "logging_init.py"
   mode "0755"
@@ -36,6 +92,13 @@ cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/pbscc.py" do
   group "root"
 end
 
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/scale_up.py" do
+  source "scale_up.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
 file "#{node[:cyclecloud][:bootstrap]}/pbs/autostart.json" do
   mode "0644"
   owner "root"
@@ -50,7 +113,7 @@ bash "import autoscale hook" do
     /opt/pbs/bin/qmgr -c "import hook autoscale application/x-python default #{node[:cyclecloud][:bootstrap]}/pbs/autostart_hook.py"
     /opt/pbs/bin/qmgr -c "import hook autoscale application/x-config default #{node[:cyclecloud][:bootstrap]}/pbs/autostart.json"
     /opt/pbs/bin/qmgr -c "set hook autoscale event = periodic"
-    /opt/pbs/bin/qmgr -c "set hook autoscale freq = 15"
+    /opt/pbs/bin/qmgr -c "set hook autoscale freq = #{node[:pbspro][:autoscale_hook][:freq]}"
     touch #{node[:cyclecloud][:bootstrap]}/pbs/autoscalehook.imported
   EOH
   creates "#{node[:cyclecloud][:bootstrap]}/pbs/autoscalehook.imported"
@@ -60,6 +60,37 @@ end
 
 node_created_guard = "#{node['cyclecloud']['chefstate']}/pbs.nodecreated"
 
+# with pbspro.precreate_nodes the autoscaler has already created this node with everything below set (see precreate_hosts
+# in autostart.py), so all that is left is to start pbs_mom.
+precreated = lambda do
+  if node.run_state[:pbs_precreated].nil?
+    cmd = Mixlib::ShellOut.new("/opt/pbs/bin/pbsnodes #{node[:hostname]}")
+    stdout = cmd.run_command.stdout
+    node.run_state[:pbs_precreated] = stdout.include?("comment = cyclecloud-precreated") &&
+      stdout.include?("resources_available.instance_id = #{instance_id}")
+  end
+  node.run_state[:pbs_precreated]
+end
+
+# with pbspro.registrar enabled the master adds this node, along with every other node joining at the same time, in one
+# qmgr session (see node_registrar.py). The spool is on the master's shared filer, so if it is not mounted, or no ack
+# arrives within ack_timeout, the node registers itself below as before.
+registrar_spool = node[:pbspro][:registrar][:spool]
+use_registrar = lambda do
+  # decided once, so that add-node-to-scheduler and register-node-with-master agree
+  if node.run_state[:pbs_use_registrar].nil?
+    node.run_state[:pbs_use_registrar] = node[:pbspro][:registrar][:enabled] &&
+      ::File.directory?("#{registrar_spool}/pending") && !::File.exist?(node_created_guard) && !precreated.call
+  end
+  node.run_state[:pbs_use_registrar]
+end
+
+if not is_node_grouped then
+  ungrouped = true
+else
+  ungrouped = placement_group.nil?
+end
+
 bash "add-node-to-scheduler" do
   code lazy {"/opt/pbs/bin/qmgr -c 'c n #{node[:hostname]}'"}
   only_if do
@@ -68,17 +99,79 @@ bash "add-node-to-scheduler" do
     !list_of_pbs_nodes.include?(node[:hostname])
   end
   not_if {::File.exist?(node_created_guard)}
+  not_if { use_registrar.call }
 end
 
 defer_block 'Defer setting core count and slot_type, and start of PBS pbs_mom until end of converge' do
+  # touching the guard skips everything below
+  execute "start-precreated-node" do
+    command "touch #{node_created_guard}"
+    creates node_created_guard
+    only_if { precreated.call }
+    notifies :start, 'service[pbs]', :immediately
+    notifies :run, 'execute[trigger-scheduling-cycle]', :immediately
+  end
+
+  ruby_block "register-node-with-master" do
+    block do
+      record = {
+        "hostname" => node[:hostname],
+        "ncpus" => slots,
+        "slot_type" => slot_type,
+        "group_id" => placement_group,
+        "ungrouped" => ungrouped,
+        "instance_id" => instance_id,
+        "resources" => custom_resources.to_hash
+      }
+      ack_path = "#{registrar_spool}/acks/#{node[:hostname]}.json"
+      pending_path = "#{registrar_spool}/pending/#{node[:hostname]}.json"
+      ack = nil
+      begin
+        ::File.delete(ack_path) if ::File.exist?(ack_path)
+        ::File.write("#{pending_path}.tmp", Chef::JSONCompat.to_json(record))
+        ::File.rename("#{pending_path}.tmp", pending_path)
+
+        deadline = Time.now + node[:pbspro][:registrar][:ack_timeout]
+        while ack.nil? && Time.now < deadline
+          if ::File.exist?(ack_path)
+            ack = Chef::JSONCompat.parse(::File.read(ack_path))
+            ::File.delete(ack_path)
+          else
+            sleep 1
+          end
+        end
+      rescue StandardError => e
+        # e.g. the share went away mid converge, or an unreadable ack. Registering directly below is always safe.
+        Chef::Log.warn("Could not hand #{node[:hostname]} to the registrar: #{e}")
+        ack = nil
+      end
+
+      if ack && ack["status"] == "ok"
+        node.run_state[:pbs_node_registered] = true
+      else
+        Chef::Log.warn("The master did not register #{node[:hostname]} (#{ack ? ack["error"] : "no ack"}), registering it directly")
+        begin
+          ::File.delete(pending_path) if ::File.exist?(pending_path)
+        rescue StandardError => e
+          Chef::Log.warn("Could not remove #{pending_path}: #{e}")
+        end
+        pbsnodes = Mixlib::ShellOut.new("/opt/pbs/bin/pbsnodes -a").run_command.stdout.strip().split("\n")
+        Mixlib::ShellOut.new("/opt/pbs/bin/qmgr -c 'c n #{node[:hostname]}'").run_command unless pbsnodes.include?(node[:hostname])
+      end
+    end
+    only_if { use_registrar.call }
+  end
+
   execute "set-node-core-count" do
     command lazy { "/opt/pbs/bin/qmgr -c 's n #{node[:hostname]} resources_available.ncpus=#{slots}'" }
     only_if { !slots.nil? }
     not_if {::File.exist?(node_created_guard)}
+    not_if { node.run_state[:pbs_node_registered] }
   end
   execute "set-node-free" do
     command lazy { "/opt/pbs/bin/pbsnodes -r #{node[:hostname]}"}
     not_if {::File.exist?(node_created_guard)}
+    not_if { node.run_state[:pbs_node_registered] }
   end
 
   set_slot_type = "/opt/pbs/bin/qmgr -c 's n #{node[:hostname]} resources_available.slot_type=#{slot_type}'"
@@ -105,7 +198,10 @@ defer_block 'Defer setting core count and slot_type, and start of PBS pbs_mom un
   set_instance_id = "/opt/pbs/bin/qmgr -c 's n #{node[:hostname]} resources_available.instance_id=#{instance_id}'"
    
   execute "set-node-slot_type" do
-    command lazy {<<-EOS
+    command lazy {
+      if node.run_state[:pbs_node_registered] then
+        "touch #{node_created_guard}"
+      else <<-EOS
       #{set_slot_type} && \
       #{set_group_id} && \
       #{set_ungrouped} && \
@@ -113,9 +209,11 @@ defer_block 'Defer setting core count and slot_type, and start of PBS pbs_mom un
       #{set_custom_resources} && \
       touch #{node_created_guard}
       EOS
+      end
     }
     creates node_created_guard
     notifies :restart, 'service[pbs]', :immediately
+    notifies :run, 'execute[trigger-scheduling-cycle]', :immediately
   end
 end
 
@@ -123,4 +221,18 @@ service "pbs" do
   action :nothing
 end
 
+# don't leave a new node idle until the next scheduler_iteration (see doqmgr.sh) - once the mom has reported in, start a
+# scheduling cycle right away.
+execute "trigger-scheduling-cycle" do
+  command lazy {<<-EOS
+    for i in $(seq 1 #{node[:pbspro][:node_up_timeout]}); do
+      /opt/pbs/bin/pbsnodes #{node[:hostname]} | grep -q 'state = free' && break
+      sleep 1
+    done
+    /opt/pbs/bin/qmgr -c 'set server scheduling = true'
+    EOS
+  }
+  action :nothing
+end
+
 include_recipe "pbspro::autostop"
@@ -0,0 +1,57 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+#
+# Registers execute nodes with pbs_server in batches, see node_registrar.py. Execute nodes drop their join records into
+# the spool, which lives on the master's shared filer, and fall back to registering themselves if no ack arrives.
+
+registrar = node[:pbspro][:registrar]
+spool = registrar[:spool]
+
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/node_registrar.py" do
+  source "node_registrar.py"
+  mode "0755"
+  owner "root"
+  group "root"
+end
+
+["", "/pending", "/processing", "/acks"].each do |subdir|
+  directory "#{spool}#{subdir}" do
+    owner "root"
+    group "root"
+    # execute nodes write their join records as root, over the share
+    mode "0755"
+    recursive true
+  end
+end
+
+file "/etc/systemd/system/pbs_registrar.service" do
+  mode "0644"
+  owner "root"
+  group "root"
+  content <<-EOS
+[Unit]
+Description=Registers CycleCloud execute nodes with pbs_server
+After=pbs.service
+
+[Service]
+Environment=PYTHONPATH=#{node[:cyclecloud][:bootstrap]}/pbs
+ExecStart=#{node[:cyclecloud][:home]}/system/embedded/bin/python #{node[:cyclecloud][:bootstrap]}/pbs/node_registrar.py serve --spool #{spool} --window #{registrar[:window]} --max-batch #{registrar[:max_batch]} --log-file #{node[:cyclecloud][:bootstrap]}/pbs/node_registrar.log
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+  EOS
+  notifies :run, 'execute[pbs_registrar daemon-reload]', :immediately
+  notifies :restart, 'service[pbs_registrar]', :delayed
+end
+
+execute "pbs_registrar daemon-reload" do
+  command "systemctl daemon-reload"
+  action :nothing
+end
+
+service "pbs_registrar" do
+  provider Chef::Provider::Service::Systemd
+  action [:enable, :start]
+  subscribes :restart, "cookbook_file[#{node[:cyclecloud][:bootstrap]}/pbs/node_registrar.py]", :delayed
+end
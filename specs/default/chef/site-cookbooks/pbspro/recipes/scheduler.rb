@@ -49,3 +49,4 @@ end
 
 include_recipe "pbspro::autostart"
 include_recipe "pbspro::submit_hook"
+include_recipe "pbspro::registrar" if node[:pbspro][:registrar][:enabled]
@@ -25,6 +25,13 @@ cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/pbs_driver.py" do
     group "root"
 end
 
+cookbook_file "#{node[:cyclecloud][:bootstrap]}/pbs/pbs_ifl.py" do
+    source "pbs_ifl.py"
+    mode "0755"
+    owner "root"
+    group "root"
+end
+
 
 node.default[:tandem_driver_directory] = "#{node[:cyclecloud][:bootstrap]}/pbs"
 include_recipe "tandem::install_driver"